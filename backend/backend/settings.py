@@ -8,6 +8,8 @@ https://docs.djangoproject.com/en/4.2/topics/settings/
 from pathlib import Path
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -36,6 +38,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'shop.instrumentation.PerformanceMiddleware',  # Первым: замеряет весь запрос
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # Перед CommonMiddleware
@@ -44,8 +47,16 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'shop.routers.ReplicaMiddleware',  # Sticky primary после записи
 ]
 
+# Замеры запросов (shop.instrumentation): заголовок Server-Timing и лог медленных
+# запросов slow_requests.log. Выключено — middleware не участвует в обработке
+PERF_INSTRUMENTATION = os.getenv('PERF_INSTRUMENTATION', str(DEBUG)) == 'True'
+PERF_SLOW_REQUEST_MS = int(os.getenv('PERF_SLOW_REQUEST_MS', 500))
+PERF_SLOW_REQUEST_QUERIES = int(os.getenv('PERF_SLOW_REQUEST_QUERIES', 50))
+PERF_TOP_QUERIES = int(os.getenv('PERF_TOP_QUERIES', 5))  # Сколько самых частых SQL писать в лог
+
 # Разрешаем запросы с фронтенда
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:8080",  # Текущий порт фронтенда (Vue по умолчанию)
@@ -93,7 +104,13 @@ if DEBUG:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
-        }
+        },
+        # Реплика для проверки маршрутизации: копия db.sqlite3 в DB_REPLICA_NAME
+        # (по умолчанию тот же файл). В тестах — отдельная БД
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('DB_REPLICA_NAME', BASE_DIR / 'db.sqlite3'),
+        },
     }
 else:
     # MySQL для продакшена
@@ -111,6 +128,64 @@ else:
             },
         }
     }
+    if os.getenv('DB_REPLICA_HOST'):
+        # Реплика MySQL только для чтения; тестовую БД на ней не создаём
+        DATABASES['replica'] = {
+            **DATABASES['default'],
+            'HOST': os.getenv('DB_REPLICA_HOST'),
+            'PORT': os.getenv('DB_REPLICA_PORT', '3306'),
+            'USER': os.getenv('DB_REPLICA_USER', DATABASES['default']['USER']),
+            'PASSWORD': os.getenv('DB_REPLICA_PASSWORD', DATABASES['default']['PASSWORD']),
+            'TEST': {'MIRROR': 'default'},
+        }
+
+# Чтение каталога и отчётов с реплики (shop.routers). Без алиаса REPLICA_DATABASE
+# в DATABASES всё идёт в default
+DATABASE_ROUTERS = ['shop.routers.ReplicaRouter']
+REPLICA_DATABASE = 'replica'
+REPLICA_STICKY_SECONDS = int(os.getenv('DB_REPLICA_STICKY_SECONDS', 10))  # Сколько читать с default после записи
+REPLICA_CHECK_INTERVAL = int(os.getenv('DB_REPLICA_CHECK_INTERVAL', 30))  # Как часто проверять реплику
+
+# Кэш. Отдельный кэш 'catalog' хранит ответы API каталога (shop.caching) и
+# версии каталога, по которым их сбрасывают (shop.catalog_cache).
+# CATALOG_CACHE_BACKEND: locmem, file, redis (нужен пакет redis) или dummy (выключен).
+# Версии должны видеть все воркеры, поэтому вне DEBUG по умолчанию file: в locmem
+# сброс виден только процессу, который изменил данные
+CATALOG_CACHE_BACKEND = os.getenv('CATALOG_CACHE_BACKEND', 'locmem' if DEBUG else 'file')
+if CATALOG_CACHE_BACKEND == 'locmem' and int(os.getenv('WEB_CONCURRENCY', 1)) > 1:
+    # WEB_CONCURRENCY — число воркеров gunicorn/uvicorn
+    raise ImproperlyConfigured(
+        'CATALOG_CACHE_BACKEND=locmem нельзя использовать с несколькими воркерами: выберите file или redis.'
+    )
+CATALOG_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CATALOG_CACHE_LOCATION', str(BASE_DIR / 'cache' / 'catalog')),
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('CATALOG_CACHE_LOCATION', 'redis://127.0.0.1:6379/1'),
+    },
+    'dummy': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+}
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        **CATALOG_CACHE_BACKENDS[CATALOG_CACHE_BACKEND],
+        'TIMEOUT': int(os.getenv('CATALOG_CACHE_TIMEOUT', 600)),  # Секунды; сброс по сигналам, таймаут — страховка
+        'KEY_PREFIX': 'catalog',
+    },
+}
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -137,10 +212,25 @@ STATIC_ROOT = BASE_DIR / "staticfiles"  # Папка для продакшена
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# 3D-модели отдаёт shop.media.serve_model_3d (Range, gzip/br, ETag).
+# За nginx: MODEL_3D_SENDFILE=nginx и internal-location с префиксом MODEL_3D_ACCEL_PREFIX,
+# указывающий на MEDIA_ROOT; за apache с mod_xsendfile: MODEL_3D_SENDFILE=apache
+MODEL_3D_SENDFILE = os.getenv('MODEL_3D_SENDFILE', '')
+MODEL_3D_ACCEL_PREFIX = os.getenv('MODEL_3D_ACCEL_PREFIX', '/protected-media/')
+MODEL_3D_CACHE_MAX_AGE = int(os.getenv('MODEL_3D_CACHE_MAX_AGE', 60 * 60 * 24 * 365))
+
 # Настройки для загрузки файлов
 FILE_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5 MB максимальный размер файла в памяти
 DATA_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5 MB максимальный размер данных в запросе
 
+# Загрузка больших файлов частями (/api/uploads/, shop.uploads). Части пишутся
+# прямо на диск, в память читается не больше UPLOAD_READ_SIZE за раз
+UPLOAD_TEMP_DIR = os.getenv('UPLOAD_TEMP_DIR', str(BASE_DIR / 'uploads'))
+UPLOAD_CHUNK_MAX_SIZE = int(os.getenv('UPLOAD_CHUNK_MAX_SIZE', 16 * 1024 * 1024))
+UPLOAD_MAX_SIZE = int(os.getenv('UPLOAD_MAX_SIZE', 2 * 1024 * 1024 * 1024))
+UPLOAD_READ_SIZE = 64 * 1024
+UPLOAD_WRITE_TIMEOUT = 10 * 60  # через сколько секунд зависшая запись части считается прерванной
+
 # Email settings (для уведомлений, сброса пароля и т.д.)
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'  # Вывод в консоль для разработки
 # Для продакшена (раскомментируйте и настройте):
@@ -163,6 +253,10 @@ LOGGING = {
             'class': 'logging.FileHandler',
             'filename': BASE_DIR / 'debug.log',
         },
+        'slow_requests': {  # Запись в файл в фоновом потоке, не задерживает ответ
+            '()': 'shop.instrumentation.queued_file_handler',
+            'filename': BASE_DIR / 'slow_requests.log',
+        },
     },
     'loggers': {
         'django': {
@@ -175,6 +269,11 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': True,
         },
+        'shop.performance': {  # JSON-строки о медленных запросах (PERF_SLOW_REQUEST_*)
+            'handlers': ['slow_requests'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
     },
 }
 
@@ -2,19 +2,31 @@ from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import RedirectView
 from rest_framework.routers import DefaultRouter
-from shop.views import CategoryViewSet, ProductViewSet, OrderViewSet  # Добавлен OrderViewSet
+from shop.views import CategoryViewSet, ProductViewSet, OrderViewSet, ConfiguratorViewSet, UploadViewSet, AnalyticsViewSet  # Добавлен OrderViewSet
 from django.conf import settings
 from django.conf.urls.static import static
+from shop.media import serve_model_3d
+from shop import async_views
 
 # Настройка маршрутизатора
 router = DefaultRouter()
 router.register(r'categories', CategoryViewSet)
 router.register(r'products', ProductViewSet)
 router.register(r'orders', OrderViewSet)  # Регистрация OrderViewSet
+router.register(r'configurator', ConfiguratorViewSet, basename='configurator')
+router.register(r'uploads', UploadViewSet, basename='upload')
+router.register(r'analytics', AnalyticsViewSet, basename='analytics')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    # Асинхронные версии чтения каталога для ASGI (shop.async_views)
+    path('api/async/products/', async_views.product_list, name='async-product-list'),
+    path('api/async/products/<int:pk>/', async_views.product_detail, name='async-product-detail'),
+    path('api/async/categories/', async_views.category_list, name='async-category-list'),
+    path('api/async/configurator/', async_views.configurator_parts, name='async-configurator'),
     path('api/', include(router.urls)),
+    # 3D-модели отдаются и в продакшене: с поддержкой Range и сжатых копий
+    path(f"{settings.MEDIA_URL.strip('/')}/3d_models/<path:path>", serve_model_3d, name='model-3d'),
     path('', RedirectView.as_view(url='/api/', permanent=False)),
 ]
 
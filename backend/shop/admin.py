@@ -1,12 +1,18 @@
 # admin.py
 from django.contrib import admin
-from django.utils.html import format_html
-from django.db.models import Count, Sum
-import json
+from django.core.files.storage import default_storage
+from django.utils.html import format_html, format_html_join
+from django.db import transaction
+from django.db.models import Count
 from django.urls import reverse
-from django.utils.safestring import mark_safe
 from django.contrib import messages
-from .models import Category, Product, Order, ComponentOption
+from django.contrib.admin import helpers
+from django.template.response import TemplateResponse
+from .models import Category, Product, Order, OrderItem, ComponentOption, PriceChange, UploadSession
+from . import images, inventory, routers, search, uploads
+from .exports import csv_response, order_rows, product_rows
+from .forms import PriceAdjustmentForm
+from .pricing import apply_price_change, preview_price_change
 
 # Кастомизация стандартного admin.site
 admin.site.site_header = "Админ-панель Tech Shop"
@@ -18,36 +24,62 @@ class CustomAdminMixin:
         css = {'all': ('admin/css/output.css',)}
         js = ('admin/js/my_custom_admin.js',)  # Используем my_custom_admin.js, как было ранее
 
+class BulkPriceMixin:
+    """Изменение цен выбранных записей одним UPDATE, с предпросмотром и историей."""
+
+    def adjust_prices(self, request, queryset):
+        form = PriceAdjustmentForm(request.POST if 'preview' in request.POST or 'apply' in request.POST else None)
+        preview = None
+        if form.is_bound and form.is_valid():
+            if 'apply' in request.POST:
+                updated = apply_price_change(queryset, user=request.user, **form.change_kwargs())
+                self.message_user(request, f"Цены изменены для {updated} записей.")
+                return None
+            preview = preview_price_change(queryset, **form.change_kwargs())
+        context = {
+            **self.admin_site.each_context(request),
+            'title': "Изменить цены",
+            'opts': self.model._meta,
+            'form': form,
+            'preview': preview,
+            'selected_ids': list(queryset.values_list('pk', flat=True)),
+            'action': 'adjust_prices',
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        }
+        return TemplateResponse(request, 'admin/shop/adjust_prices.html', context)
+    adjust_prices.short_description = "Изменить цены (с предпросмотром)"
+
 @admin.register(ComponentOption)
-class ComponentOptionAdmin(CustomAdminMixin, admin.ModelAdmin):
+class ComponentOptionAdmin(BulkPriceMixin, CustomAdminMixin, admin.ModelAdmin):
     list_display = ('name', 'type', 'price', 'volume', 'product_count', 'display_type_label')
     list_filter = ('type',)
     search_fields = ('name', 'volume')
     list_display_links = ('name',)
     list_per_page = 20
     ordering = ('type', 'name')
-    actions = ['update_price_increase', 'update_price_decrease']
+    actions = ['update_price_increase', 'update_price_decrease', 'adjust_prices']
+
+    def get_queryset(self, request):
+        # Счётчик товаров одним GROUP BY вместо COUNT-запроса на каждую строку
+        return super().get_queryset(request).annotate(product_count=Count('product', distinct=True))
 
     def product_count(self, obj):
-        return obj.product_set.count()
+        return obj.product_count
     product_count.short_description = "Используется в товарах"
+    product_count.admin_order_field = 'product_count'
 
     def display_type_label(self, obj):
         return dict(ComponentOption.COMPONENT_TYPES).get(obj.type, obj.type)
     display_type_label.short_description = "Тип (название)"
 
     def update_price_increase(self, request, queryset):
-        for component in queryset:
-            component.price *= 1.05
-            component.save()
-        self.message_user(request, f"Цены увеличены на 5 процентов для {queryset.count()} комплектующих.")
+        updated = apply_price_change(queryset, percent=5, user=request.user)
+        self.message_user(request, f"Цены увеличены на 5 процентов для {updated} комплектующих.")
     update_price_increase.short_description = "Увеличить цену на 5 процентов"
 
     def update_price_decrease(self, request, queryset):
-        for component in queryset:
-            component.price *= 0.95
-            component.save()
-        self.message_user(request, f"Цены уменьшены на 5 процентов для {queryset.count()} комплектующих.")
+        updated = apply_price_change(queryset, percent=-5, user=request.user)
+        self.message_user(request, f"Цены уменьшены на 5 процентов для {updated} комплектующих.")
     update_price_decrease.short_description = "Уменьшить цену на 5 процентов"
 
     def get_fieldsets(self, request, obj=None):
@@ -67,31 +99,18 @@ class ComponentOptionAdmin(CustomAdminMixin, admin.ModelAdmin):
 
 @admin.register(Category)
 class CategoryAdmin(CustomAdminMixin, admin.ModelAdmin):
-    list_display = ('name', 'product_count', 'total_stock', 'total_value', 'category_link')
+    # Счётчики хранятся в категории (shop.counters): список не считает GROUP BY по товарам
+    list_display = ('name', 'product_count', 'in_stock_count', 'total_stock', 'total_value', 'category_link')
+    readonly_fields = ('product_count', 'in_stock_count', 'total_stock', 'catalog_value')
     search_fields = ('name',)
     actions = ['duplicate_categories', 'merge_categories']
     list_per_page = 20
     ordering = ('name',)
 
-    def get_queryset(self, request):
-        queryset = super().get_queryset(request)
-        return queryset.annotate(
-            product_count=Count('product'),
-            total_stock=Sum('product__stock'),
-            total_value=Sum('product__base_price')
-        )
-
-    def product_count(self, obj):
-        return obj.product_count
-    product_count.short_description = "Количество товаров"
-
-    def total_stock(self, obj):
-        return obj.total_stock or 0
-    total_stock.short_description = "Общий запас"
-
     def total_value(self, obj):
-        return f"${obj.total_value or 0:.2f}"
+        return f"${obj.catalog_value:.2f}"
     total_value.short_description = "Общая стоимость"
+    total_value.admin_order_field = 'catalog_value'
 
     def category_link(self, obj):
         url = reverse('admin:shop_product_changelist') + f'?category__id__exact={obj.id}'
@@ -112,10 +131,12 @@ class CategoryAdmin(CustomAdminMixin, admin.ModelAdmin):
             return
         main_category = queryset.first()
         other_categories = queryset.exclude(id=main_category.id)
-        products = Product.objects.filter(category__in=other_categories)
-        products.update(category=main_category)
-        other_categories.delete()
-        self.message_user(request, f"Объединено {other_categories.count()} категорий в '{main_category.name}'.")
+        merged = other_categories.count()
+        with transaction.atomic():
+            # update() переносит и счётчики: товары уходят из старых категорий в основную
+            Product.objects.filter(category__in=other_categories).update(category=main_category)
+            other_categories.delete()
+        self.message_user(request, f"Объединено {merged} категорий в '{main_category.name}'.")
     merge_categories.short_description = "Объединить выбранные категории"
 
     def get_form(self, request, obj=None, **kwargs):
@@ -129,28 +150,37 @@ class ComponentOptionInline(admin.TabularInline):
     verbose_name = "Комплектующее"
     verbose_name_plural = "Комплектующие"
 
+    def get_product(self, request):
+        # Товар со страницы редактирования загружаем один раз за запрос
+        if not hasattr(request, '_inline_product'):
+            object_id = request.resolver_match.kwargs.get('object_id')
+            request._inline_product = Product.objects.filter(pk=object_id).only('id', 'component_type').first() if object_id else None
+        return request._inline_product
+
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         if db_field.name == "componentoption":
-            if request.resolver_match.kwargs.get('object_id'):
-                try:
-                    product = Product.objects.get(id=request.resolver_match.kwargs['object_id'])
-                    if product.component_type:
-                        kwargs["queryset"] = ComponentOption.objects.filter(type=product.component_type)
-                    else:
-                        kwargs["queryset"] = ComponentOption.objects.all()
-                except Product.DoesNotExist:
-                    kwargs["queryset"] = ComponentOption.objects.all()
+            product = self.get_product(request)
+            if product and product.component_type:
+                kwargs["queryset"] = ComponentOption.objects.filter(type=product.component_type)
             else:
                 kwargs["queryset"] = ComponentOption.objects.all()
-        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+        field = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        if field is not None and db_field.name == "componentoption":
+            # Варианты выбора вычисляем один раз, иначе каждый select в каждой строке
+            # инлайна делает свой запрос к ComponentOption
+            if not hasattr(request, '_inline_component_choices'):
+                request._inline_component_choices = list(field.choices)
+            field.choices = request._inline_component_choices
+        return field
 
 @admin.register(Product)
-class ProductAdmin(CustomAdminMixin, admin.ModelAdmin):
+class ProductAdmin(BulkPriceMixin, CustomAdminMixin, admin.ModelAdmin):
     list_display = ('name', 'category', 'component_type', 'base_price', 'stock', 'display_image', 'is_available', 'discount', 'view_3d_model', 'final_price')
     list_filter = ('category', 'component_type', 'stock', 'discount')
+    list_select_related = ('category',)
     search_fields = ('name', 'description')
     list_editable = ('base_price', 'stock', 'discount')
-    actions = ['set_stock_to_zero', 'increase_price', 'decrease_price', 'apply_discount', 'remove_discount', 'export_to_csv']
+    actions = ['set_stock_to_zero', 'increase_price', 'decrease_price', 'adjust_prices', 'apply_discount', 'remove_discount', 'export_to_csv']
     prepopulated_fields = {'description': ('name',)}
     list_per_page = 20
     inlines = [ComponentOptionInline]
@@ -165,9 +195,18 @@ class ProductAdmin(CustomAdminMixin, admin.ModelAdmin):
     )
     ordering = ('name',)
 
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск через полнотекстовый индекс вместо LIKE '%...%' по описанию
+        if not search_term:
+            return queryset, False
+        return search.filter_products(queryset, search_term), False
+
     def display_image(self, obj):
         if obj.image:
-            return format_html('<img src="{}" style="max-height: 50px; max-width: 50px;" />', obj.image.url)
+            # Самая маленькая копия вместо оригинала, если она уже есть
+            thumbnail = images.smallest_variant(obj.image_variants)
+            url = default_storage.url(thumbnail) if thumbnail else obj.image.url
+            return format_html('<img src="{}" style="max-height: 50px; max-width: 50px;" loading="lazy" />', url)
         return "Нет изображения"
     display_image.short_description = "Изображение"
 
@@ -183,10 +222,9 @@ class ProductAdmin(CustomAdminMixin, admin.ModelAdmin):
     is_available.short_description = "В наличии"
 
     def final_price(self, obj):
-        if obj.discount:
-            return f"${(obj.base_price * (100 - obj.discount) / 100):.2f}"
-        return f"${obj.base_price:.2f}"
+        return f"${obj.final_price:.2f}"
     final_price.short_description = "Итоговая цена"
+    final_price.admin_order_field = 'final_price'
 
     def set_stock_to_zero(self, request, queryset):
         updated = queryset.update(stock=0)
@@ -194,17 +232,13 @@ class ProductAdmin(CustomAdminMixin, admin.ModelAdmin):
     set_stock_to_zero.short_description = "Установить запас в 0"
 
     def increase_price(self, request, queryset):
-        for product in queryset:
-            product.base_price *= 1.1
-            product.save()
-        self.message_user(request, f"Цены увеличены на 10 процентов для {queryset.count()} товаров")
+        updated = apply_price_change(queryset, percent=10, user=request.user)
+        self.message_user(request, f"Цены увеличены на 10 процентов для {updated} товаров")
     increase_price.short_description = "Увеличить цену на 10 процентов"
 
     def decrease_price(self, request, queryset):
-        for product in queryset:
-            product.base_price *= 0.9
-            product.save()
-        self.message_user(request, f"Цены уменьшены на 10 процентов для {queryset.count()} товаров")
+        updated = apply_price_change(queryset, percent=-10, user=request.user)
+        self.message_user(request, f"Цены уменьшены на 10 процентов для {updated} товаров")
     decrease_price.short_description = "Уменьшить цену на 10 процентов"
 
     def apply_discount(self, request, queryset):
@@ -218,25 +252,7 @@ class ProductAdmin(CustomAdminMixin, admin.ModelAdmin):
     remove_discount.short_description = "Снять скидку"
 
     def export_to_csv(self, request, queryset):
-        import csv
-        from django.http import HttpResponse
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="products_export.csv"'
-        writer = csv.writer(response)
-        writer.writerow(['ID', 'Название', 'Категория', 'Тип', 'Базовая цена', 'Запас', 'Скидка', 'Итоговая цена'])
-        for product in queryset:
-            final_price = product.base_price * (100 - product.discount) / 100 if product.discount else product.base_price
-            writer.writerow([
-                product.id,
-                product.name,
-                product.category.name,
-                product.component_type,
-                product.base_price,
-                product.stock,
-                product.discount,
-                final_price
-            ])
-        return response
+        return csv_response(product_rows(queryset.using(routers.report_database())), 'products_export.csv')
     export_to_csv.short_description = "Экспортировать в CSV"
 
     def get_form(self, request, obj=None, **kwargs):
@@ -253,6 +269,66 @@ class ProductAdmin(CustomAdminMixin, admin.ModelAdmin):
         form.base_fields['compatible_with'].label = "Совместимость"
         return form
 
+@admin.register(PriceChange)
+class PriceChangeAdmin(CustomAdminMixin, admin.ModelAdmin):
+    list_display = ('changed_at', 'product', 'component', 'old_price', 'new_price', 'reason', 'changed_by')
+    list_select_related = ('product', 'component', 'changed_by')
+    list_filter = ('changed_at',)
+    search_fields = ('product__name', 'component__name', 'reason')
+    date_hierarchy = 'changed_at'
+    list_per_page = 50
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(CustomAdminMixin, admin.ModelAdmin):
+    # Загрузки частями через /api/uploads/: видно, какие зависли и на каком байте
+    list_display = ('filename', 'product', 'field', 'progress', 'created_by', 'created_at', 'completed_at')
+    list_select_related = ('product', 'created_by')
+    list_filter = ('field', 'completed_at')
+    list_per_page = 50
+
+    def progress(self, obj):
+        return f"{obj.received * 100 // obj.size if obj.size else 0}%"
+    progress.short_description = "Получено"
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def delete_model(self, request, obj):
+        uploads.discard(obj)
+
+    def delete_queryset(self, request, queryset):
+        for session in queryset:
+            uploads.discard(session)
+
+class OrderItemInline(admin.TabularInline):
+    # Только просмотр: позиции заказа держат резерв на складе (shop.inventory),
+    # а правка количеств здесь его бы не меняла. Состав заказа после создания
+    # не меняется и через API
+    model = OrderItem
+    extra = 0
+    fields = ('product', 'name', 'quantity', 'unit_price', 'options')
+    readonly_fields = fields
+    verbose_name = "Позиция заказа"
+    verbose_name_plural = "Позиции заказа"
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 @admin.register(Order)
 class OrderAdmin(CustomAdminMixin, admin.ModelAdmin):
     list_display = ('id', 'customer_name', 'total', 'delivery', 'status', 'created_at', 'item_count', 'view_items')
@@ -261,33 +337,29 @@ class OrderAdmin(CustomAdminMixin, admin.ModelAdmin):
     readonly_fields = ('created_at',)
     actions = ['mark_as_express', 'mark_as_shipped', 'mark_as_delivered', 'cancel_orders', 'export_to_csv']
     fields = ('customer_name', 'address', 'delivery', 'comment', 'total', 'status', 'created_at', 'items')
+    inlines = [OrderItemInline]
     date_hierarchy = 'created_at'
     list_per_page = 20
     ordering = ('-created_at',)
 
+    def get_queryset(self, request):
+        # Количество позиций считает БД, а сами позиции подгружаются одним запросом на страницу
+        queryset = super().get_queryset(request)
+        return queryset.annotate(item_count=Count('order_items')).prefetch_related('order_items')
+
     def item_count(self, obj):
-        try:
-            items = json.loads(obj.items) if obj.items else []
-            return len(items)
-        except (json.JSONDecodeError, TypeError):
-            return len(obj.items.split(',')) if obj.items and isinstance(obj.items, str) and obj.items.strip() else 0
+        return obj.item_count
     item_count.short_description = "Товаров в заказе"
+    item_count.admin_order_field = 'item_count'
 
     def view_items(self, obj):
-        try:
-            items = json.loads(obj.items) if obj.items else []
-            if not items:
-                return "Нет товаров"
-            item_list = "<ul>"
-            for item in items:
-                if isinstance(item, dict) and 'name' in item:
-                    item_list += f"<li>{item['name']} (x{item.get('quantity', 1)})</li>"
-                else:
-                    item_list += f"<li>{item}</li>"
-            item_list += "</ul>"
-            return mark_safe(item_list)
-        except (json.JSONDecodeError, TypeError):
-            return obj.items or "Нет товаров"
+        items = obj.order_items.all()
+        if not items:
+            return "Нет товаров"
+        return format_html(
+            '<ul>{}</ul>',
+            format_html_join('', '<li>{} (x{})</li>', ((item.name, item.quantity) for item in items)),
+        )
     view_items.short_description = "Товары"
 
     def mark_as_express(self, request, queryset):
@@ -296,50 +368,45 @@ class OrderAdmin(CustomAdminMixin, admin.ModelAdmin):
     mark_as_express.short_description = "Пометить как Экспресс"
 
     def mark_as_shipped(self, request, queryset):
-        updated = queryset.update(status='Shipped')
+        # Отменённые заказы без резерва на складе: вернуть их можно только через форму заказа
+        updated = queryset.exclude(status=inventory.CANCELLED).update(status='Shipped')
         self.message_user(request, f"Обновлено {updated} заказов: статус изменён на 'Отправлен'")
     mark_as_shipped.short_description = "Пометить как отправленные"
 
     def mark_as_delivered(self, request, queryset):
-        updated = queryset.update(status='Delivered')
+        updated = queryset.exclude(status=inventory.CANCELLED).update(status='Delivered')
         self.message_user(request, f"Обновлено {updated} заказов: статус изменён на 'Доставлен'")
     mark_as_delivered.short_description = "Пометить как доставленные"
 
     def cancel_orders(self, request, queryset):
-        updated = queryset.update(status='Cancelled')
-        self.message_user(request, f"Обновлено {updated} заказов: статус изменён на 'Отменён'")
+        updated = inventory.cancel_orders(queryset)
+        self.message_user(request, f"Обновлено {updated} заказов: статус изменён на 'Отменён', товары возвращены на склад")
     cancel_orders.short_description = "Отменить заказы"
 
     def export_to_csv(self, request, queryset):
-        import csv
-        from django.http import HttpResponse
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="orders_export.csv"'
-        writer = csv.writer(response)
-        writer.writerow(['ID', 'Клиент', 'Итого', 'Тип доставки', 'Статус', 'Дата создания', 'Товары'])
-        for order in queryset:
-            writer.writerow([
-                order.id,
-                order.customer_name,
-                order.total,
-                order.delivery,
-                order.status,
-                order.created_at,
-                order.items
-            ])
-        return response
+        return csv_response(order_rows(queryset.using(routers.report_database())), 'orders_export.csv')
     export_to_csv.short_description = "Экспортировать в CSV"
 
+    def save_model(self, request, obj, form, change):
+        if not change or 'status' not in form.changed_data:
+            return super().save_model(request, obj, form, change)
+        # Статус меняем через склад: отмена возвращает остатки, возврат из отмены резервирует заново
+        status, obj.status = obj.status, form.initial['status']
+        super().save_model(request, obj, form, change)
+        try:
+            inventory.change_status(obj, status)
+        except inventory.InsufficientStock:
+            self.message_user(request, "Недостаточно товара на складе: статус заказа не изменён", messages.ERROR)
+
     def get_form(self, request, obj=None, **kwargs):
         form = super().get_form(request, obj, **kwargs)
         form.base_fields['items'].widget = admin.widgets.AdminTextareaWidget(attrs={'rows': 5, 'cols': 50})
-        form.base_fields['items'].help_text = "Перечислите товары в формате JSON или через запятую, например: Product1, Product2, Product3"
+        form.base_fields['items'].help_text = "Устаревшее текстовое поле: состав заказа хранится в позициях ниже"
         form.base_fields['customer_name'].label = "Имя клиента"
         form.base_fields['address'].label = "Адрес"
         form.base_fields['delivery'].label = "Тип доставки"
         form.base_fields['comment'].label = "Комментарий"
         form.base_fields['total'].label = "Итого"
         form.base_fields['status'].label = "Статус"
-        form.base_fields['created_at'].label = "Дата создания"
         form.base_fields['items'].label = "Товары"
         return form
\ No newline at end of file
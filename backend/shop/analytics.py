@@ -0,0 +1,209 @@
+# shop/analytics.py
+"""
+Сводные таблицы продаж для отчётов.
+
+SalesDaily и SalesHourly — число заказов и выручка за день (час) в разрезе
+статуса и способа доставки, ProductSalesDaily — проданные штуки и выручка
+по товару за день. Период считается по created_at заказа в TIME_ZONE.
+
+Таблицы обновляются приращениями при каждом изменении заказов: tracking()
+снимает вклад затронутых заказов до и после изменения и прибавляет разницу
+одним INSERT ... ON CONFLICT/ON DUPLICATE KEY UPDATE на таблицу. Поэтому
+отчёт читает сотни строк сводки, а не всю таблицу заказов. Для заполнения
+по старым данным — команда rebuild_sales_rollups.
+
+Строку сводки (сегодня, Pending, доставка) меняет каждый новый заказ,
+поэтому приращения прибавляются после коммита транзакции заказа, каждое
+в своей короткой транзакции: оформление заказов не выстраивается в очередь
+за блокировкой этой строки. Приращения складываются, так что порядок их
+применения не важен. Цена — окно между коммитом и записью сводки: если
+процесс упадёт в нём, заказ не попадёт в сводку, а rebuild_sales_rollups,
+запущенный в этот момент, учтёт его дважды. Такие расхождения исправляет
+повторный rebuild_sales_rollups.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, time
+from decimal import Decimal
+
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+UPSERT_BATCH_SIZE = 200
+LOCK_BATCH_SIZE = 1000
+
+
+def periods(created_at):
+    local = timezone.localtime(created_at)
+    return local.date(), local.replace(minute=0, second=0, microsecond=0)
+
+
+def new_rollups():
+    # {модель: {ключ: [счётчик, выручка]}}
+    return defaultdict(lambda: defaultdict(lambda: [0, Decimal('0.00')]))
+
+
+def add(rollups, orders, items):
+    """
+    Добавляет в rollups вклад заказов (created_at, status, delivery, total)
+    и позиций (product_id, quantity, unit_price, created_at, status).
+    """
+    from .models import ProductSalesDaily, SalesDaily, SalesHourly
+
+    for created_at, status, delivery, total in orders:
+        day, hour = periods(created_at)
+        for model, period in ((SalesDaily, day), (SalesHourly, hour)):
+            row = rollups[model][(period, status, delivery)]
+            row[0] += 1
+            row[1] += total
+    for product_id, quantity, unit_price, created_at, status in items:
+        row = rollups[ProductSalesDaily][(periods(created_at)[0], product_id, status)]
+        row[0] += quantity
+        row[1] += unit_price * quantity
+    return rollups
+
+
+def collect(order_ids, lock=False):
+    """
+    Текущий вклад заказов order_ids в сводные таблицы. С lock заказы и их
+    позиции читаются с блокировкой по возрастанию id (как counters.collect):
+    видны последние значения, а параллельное изменение тех же заказов ждёт
+    коммита и не вычтет из сводки тот же прежний статус ещё раз.
+    """
+    from .models import Order, OrderItem
+
+    rollups = new_rollups()
+    order_ids = sorted(order_ids)
+    for start in range(0, len(order_ids), LOCK_BATCH_SIZE):
+        batch = order_ids[start:start + LOCK_BATCH_SIZE]
+        orders = Order.objects.filter(pk__in=batch).order_by('pk')
+        items = OrderItem.objects.filter(order_id__in=batch, product__isnull=False).order_by('pk')
+        if lock:
+            orders, items = orders.select_for_update(), items.select_for_update()
+        add(
+            rollups,
+            orders.values_list('created_at', 'status', 'delivery', 'total'),
+            items.values_list('product_id', 'quantity', 'unit_price', 'order__created_at', 'order__status'),
+        )
+    return rollups
+
+
+def difference(after, before):
+    changes = new_rollups()
+    for model in set(after) | set(before):
+        for key in set(after[model]) | set(before[model]):
+            count = after[model][key][0] - before[model][key][0]
+            amount = after[model][key][1] - before[model][key][1]
+            if count or amount:
+                changes[model][key] = [count, amount]
+    return changes
+
+
+def upsert(model, rows):
+    """
+    Прибавляет {ключ: [счётчик, выручка]} к строкам model, создавая
+    недостающие. Прибавление делает БД, поэтому параллельные заказы не
+    затирают друг друга; строки идут в порядке ключа, чтобы транзакции
+    блокировали их в одном порядке.
+    """
+    if not rows:
+        return
+    connection = connections[router.db_for_write(model)]
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    keys = [model._meta.get_field(name) for name in model.ROLLUP_KEY]
+    values = [model._meta.get_field(name) for name in model.ROLLUP_VALUES]
+    columns = ', '.join(quote(field.column) for field in keys + values)
+    if connection.vendor == 'mysql':
+        conflict = 'ON DUPLICATE KEY UPDATE ' + ', '.join(
+            f'{quote(field.column)} = {quote(field.column)} + VALUES({quote(field.column)})' for field in values
+        )
+    else:
+        conflict = f"ON CONFLICT ({', '.join(quote(field.column) for field in keys)}) DO UPDATE SET " + ', '.join(
+            f'{quote(field.column)} = {table}.{quote(field.column)} + excluded.{quote(field.column)}' for field in values
+        )
+    placeholder = f"({', '.join(['%s'] * len(keys + values))})"
+    items = sorted(rows.items())
+    with connection.cursor() as cursor:
+        for start in range(0, len(items), UPSERT_BATCH_SIZE):
+            batch = items[start:start + UPSERT_BATCH_SIZE]
+            params = []
+            for key, increments in batch:
+                params.extend(
+                    field.get_db_prep_save(value, connection)
+                    for field, value in zip(keys + values, (*key, *increments))
+                )
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) VALUES {', '.join([placeholder] * len(batch))} {conflict}",
+                params,
+            )
+
+
+def write(rollups):
+    for model, rows in rollups.items():
+        upsert(model, rows)
+
+
+def apply(rollups):
+    """Прибавляет rollups к сводкам после коммита текущей транзакции (сразу, если её нет)."""
+    if any(rollups.values()):
+        # robust: ошибка сводки не должна превращать уже сохранённый заказ в ошибку запроса
+        transaction.on_commit(lambda: write(rollups), robust=True)
+
+
+def record(orders=(), items=()):
+    """
+    Прибавляет вклад новых заказов и позиций прямо из объектов, без
+    повторного чтения из БД: путь оформления заказа остаётся коротким.
+    """
+    apply(add(
+        new_rollups(),
+        [(order.created_at, order.status, order.delivery, order.total) for order in orders],
+        [
+            (item.product_id, item.quantity, item.unit_price, item.order.created_at, item.order.status)
+            for item in items if item.product_id
+        ],
+    ))
+
+
+@contextmanager
+def tracking(order_ids):
+    """
+    Обновляет сводки по заказам, которые меняются внутри блока. Новые
+    заказы добавляйте в выданное множество после сохранения.
+    """
+    order_ids = set(order_ids)
+    # Без точки сохранения: при ошибке откатится охватывающая транзакция
+    with transaction.atomic(savepoint=False):
+        before = collect(order_ids, lock=True)
+        yield order_ids
+        apply(difference(collect(order_ids), before))
+
+
+def rebuild(since=None, chunk_size=2000):
+    """
+    Пересчитывает сводки по заказам с даты since (все, если None) порциями
+    по chunk_size заказов. Возвращает число обработанных заказов.
+    """
+    from .models import Order, ProductSalesDaily, SalesDaily, SalesHourly
+
+    orders = Order.objects.order_by()
+    with transaction.atomic():
+        if since is None:
+            for model in (SalesDaily, SalesHourly, ProductSalesDaily):
+                model.objects.all().delete()
+        else:
+            start = timezone.make_aware(datetime.combine(since, time.min))
+            orders = orders.filter(created_at__gte=start)
+            SalesDaily.objects.filter(date__gte=since).delete()
+            SalesHourly.objects.filter(hour__gte=start).delete()
+            ProductSalesDaily.objects.filter(date__gte=since).delete()
+
+        count, last = 0, 0
+        while True:
+            ids = list(orders.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+            if not ids:
+                return count
+            write(collect(ids))
+            count += len(ids)
+            last = ids[-1]
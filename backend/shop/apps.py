@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ShopConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shop'
+
+    def ready(self):
+        from . import search, signals  # noqa: F401 — регистрация обработчиков сигналов
+        # Полнотекстовый индекс мог пропасть при пересборке таблицы в миграциях SQLite
+        post_migrate.connect(search.ensure_search_index, sender=self)
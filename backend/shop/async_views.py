@@ -0,0 +1,112 @@
+# shop/async_views.py
+"""
+Асинхронные версии горячих GET-эндпоинтов каталога (/api/async/...) для
+запуска под ASGI, например uvicorn backend.asgi:application.
+
+Синхронный вьюсет DRF под ASGI выполняется в пуле потоков, и поток занят,
+пока ответ не уйдёт медленному клиенту. Эти вьюхи — корутины: ожидание сети
+не занимает потоков, поэтому один процесс держит много одновременных
+соединений. Данные читаются асинхронным ORM и асинхронным API кэша (в
+Django 4.2 сам SQL по-прежнему выполняется в отдельном потоке, но только на
+время запроса к БД), а сериализаторы DRF работают по уже загруженным
+объектам без обращений к БД.
+
+Ответы совпадают с /api/products/, /api/categories/ и /api/configurator/,
+включая кэш ответов и чтение с реплики. Сравнение с WSGI — команда
+benchmark_catalog.
+"""
+from functools import wraps
+
+from django.http import HttpResponse, HttpResponseNotAllowed
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from . import caching, catalog_cache, configurator
+from .filters import ProductFilter, ProductOrderingFilter
+from .instrumentation import span
+from .models import Category, Product
+from .pagination import KeysetPagination
+from .routers import acheck_replica, replica_reads
+from .serializers import CategorySerializer, ProductListSerializer, ProductSerializer, requested_fields
+
+
+def render(data, status=200, cache_status=None):
+    with span('render'):
+        content = JSONRenderer().render(data)
+    response = HttpResponse(content, status=status, content_type='application/json')
+    if cache_status:
+        response['X-Cache'] = cache_status
+    return response
+
+
+def catalog_endpoint(*namespaces, cache_response=True):
+    """
+    Обёртка для асинхронной вьюхи, возвращающей данные ответа: только
+    GET/HEAD, кэш ответов по пространствам namespaces, ошибки DRF — в JSON.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return HttpResponseNotAllowed(['GET', 'HEAD'])
+            cache = catalog_cache.get_cache()
+            if cache_response:
+                key = await caching.aresponse_key(request, namespaces)
+                data = await cache.aget(key)
+                if data is not None:
+                    return render(data, cache_status='HIT')
+            await acheck_replica()
+            try:
+                with replica_reads(request, namespaces):
+                    data = await view(Request(request), *args, **kwargs)
+            except APIException as exc:
+                # Как exception_handler DRF: строка ошибки — в поле detail
+                detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+                return render(detail, status=exc.status_code)
+            if not cache_response:
+                return render(data)
+            await cache.aset(key, data)
+            return render(data, cache_status='MISS')
+        return wrapper
+    return decorator
+
+
+@catalog_endpoint('products')
+async def product_list(request):
+    # Те же фильтры, сортировка, ?fields=/?expand= и курсор, что у ProductViewSet.list
+    fields = requested_fields(request.query_params, ProductListSerializer)
+    queryset = Product.objects.for_catalog(fields)
+    queryset = ProductFilter().filter_queryset(request, queryset, None)
+    queryset = ProductOrderingFilter().filter_queryset(request, queryset, None)
+    paginator = KeysetPagination()
+    page = await paginator.apaginate_queryset(queryset, request)
+    serializer = ProductListSerializer(page, many=True, fields=fields, context={'request': request})
+    return paginator.get_paginated_data(serializer.data)
+
+
+@catalog_endpoint('products')
+async def product_detail(request, pk):
+    fields = requested_fields(request.query_params, ProductSerializer)
+    try:
+        product = await Product.objects.for_catalog(fields).aget(pk=pk)
+    except Product.DoesNotExist:
+        # Текст как у get_object_or_404 во вьюсете
+        raise NotFound(f'No {Product._meta.object_name} matches the given query.')
+    return ProductSerializer(product, fields=fields, context={'request': request}).data
+
+
+@catalog_endpoint('categories')
+async def category_list(request):
+    # Категорий немного: читаем все и делим на страницы как PageNumberPagination вьюсета
+    categories = [category async for category in Category.objects.all()]
+    paginator = PageNumberPagination()
+    page = paginator.paginate_queryset(categories, request)
+    return paginator.get_paginated_response(CategorySerializer(page, many=True).data).data
+
+
+@catalog_endpoint('products', cache_response=False)
+async def configurator_parts(request):
+    # Детали уже кэшируются в configurator по версии каталога
+    return {'fields': configurator.PART_FIELDS, 'parts': await configurator.aget_parts()}
@@ -0,0 +1,119 @@
+# shop/caching.py
+"""
+Кэш ответов API каталога.
+
+Ключ ответа — версии пространств имён (products, categories, ...) плюс полный
+путь с query string и формат ответа. При изменении данных сигналы увеличивают
+версию нужного пространства, и все старые ключи перестают совпадать: ничего
+не нужно искать и удалять, устаревшие записи просто истекают.
+
+Те же версии служат штампами каталога для условных GET: ETag списка строится
+из них, а Last-Modified — из времени последнего сброса. Версии и их сброс —
+в shop.catalog_cache.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from .catalog_cache import aget_versions, get_cache, get_last_modified, get_versions
+
+
+def request_digest(request):
+    renderer = getattr(request, 'accepted_media_type', '') or ''
+    return hashlib.sha1(f'{request.get_full_path()}|{renderer}'.encode('utf-8')).hexdigest()
+
+
+def response_key(request, namespaces):
+    versions = '.'.join(str(version) for version in get_versions(namespaces))
+    return f"response:{'.'.join(namespaces)}:{versions}:{request_digest(request)}"
+
+
+async def aresponse_key(request, namespaces):
+    versions = '.'.join(str(version) for version in await aget_versions(namespaces))
+    return f"response:{'.'.join(namespaces)}:{versions}:{request_digest(request)}"
+
+
+class CachedResponseMixin:
+    """
+    Кэширует успешные GET-ответы list/retrieve (и выбранных action) во вьюсете.
+    cache_namespaces — от каких данных зависит ответ.
+    """
+    cache_namespaces = ()
+    cached_actions = ('list', 'retrieve')
+
+    def cached_response(self, request, handler, *args, **kwargs):
+        if request.method != 'GET' or self.action not in self.cached_actions:
+            return handler(request, *args, **kwargs)
+        cache = get_cache()
+        key = response_key(request, self.cache_namespaces)
+        data = cache.get(key)
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
+
+
+class ConditionalGetMixin:
+    """
+    ETag/Last-Modified для list/retrieve и ответ 304 без сборки данных.
+
+    Для списков валидаторы берутся из штампов каталога (без запросов к БД),
+    для объекта — из его updated_at (один запрос по первичному ключу).
+    Вьюсет должен задавать cache_namespaces.
+    """
+    conditional_actions = ('list', 'retrieve')
+
+    def get_validators(self, request, **kwargs):
+        if self.action == 'retrieve':
+            lookup = kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+            updated_at = self.get_queryset().model.objects.filter(
+                **{self.lookup_field: lookup},
+            ).order_by().values_list('updated_at', flat=True).first()
+            if updated_at is None:
+                return None, None
+            etag = f'{lookup}-{updated_at.timestamp():.6f}-{request_digest(request)[:12]}'
+            return etag, updated_at.timestamp()
+        versions = get_versions(self.cache_namespaces)
+        if None in versions:
+            # Кэш каталога выключен (dummy): версии не хранятся, и ETag не менялся бы никогда
+            return None, None
+        etag = f"{'.'.join(str(version) for version in versions)}-{request_digest(request)[:12]}"
+        return etag, get_last_modified(self.cache_namespaces)
+
+    def conditional_response(self, request, handler, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or self.action not in self.conditional_actions:
+            return handler(request, *args, **kwargs)
+        etag, last_modified = self.get_validators(request, **kwargs)
+        if etag is None:
+            return handler(request, *args, **kwargs)
+        etag = quote_etag(etag)
+        last_modified = int(last_modified) if last_modified else None
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        response = not_modified or handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+            # Браузер и прокси хранят ответ, но каждый раз перепроверяют его по ETag
+            patch_cache_control(response, no_cache=True)
+            patch_vary_headers(response, ('Accept',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().retrieve, *args, **kwargs)
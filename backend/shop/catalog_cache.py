@@ -0,0 +1,94 @@
+# shop/catalog_cache.py
+"""
+Версии каталога в общем кэше 'catalog'.
+
+Каждое пространство имён (products, categories, ...) имеет версию и время
+последнего сброса. Изменение данных увеличивает версию (invalidate), и все
+ключи, построенные на старой версии, перестают совпадать: кэш ответов API
+(shop.caching), ETag списков, детали конфигуратора и граф совместимости.
+
+Модуль не зависит от DRF, поэтому его импортируют модели и сигналы. Если
+воркеров несколько, бэкенд кэша должен быть общим (file или redis, см.
+CATALOG_CACHE_BACKEND), иначе каждый процесс видит только свои изменения.
+"""
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+
+CACHE_ALIAS = 'catalog'
+
+# Какие пространства имён затрагивает изменение модели. Товар содержит
+# название категории и вложенные комплектующие, поэтому их изменения
+# сбрасывают и кэш товаров.
+MODEL_NAMESPACES = {
+    'shop.product': ('products',),
+    'shop.category': ('categories', 'products'),
+    'shop.componentoption': ('products',),
+}
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def version_key(namespace):
+    return f'ns:{namespace}'
+
+
+def modified_key(namespace):
+    return f'modified:{namespace}'
+
+
+def get_versions(namespaces):
+    cache = get_cache()
+    keys = [version_key(namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Версия могла быть вытеснена: начинаем с текущего времени, чтобы
+            # не совпасть ни с одной из прежних версий
+            cache.add(key, int(time.time() * 1000), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+async def aget_versions(namespaces):
+    """get_versions() через асинхронный API кэша (shop.async_views)."""
+    cache = get_cache()
+    keys = [version_key(namespace) for namespace in namespaces]
+    versions = await cache.aget_many(keys)
+    for key in keys:
+        if key not in versions:
+            await cache.aadd(key, int(time.time() * 1000), timeout=None)
+            versions[key] = await cache.aget(key)
+    return [versions[key] for key in keys]
+
+
+def get_last_modified(namespaces):
+    stamps = get_cache().get_many([modified_key(namespace) for namespace in namespaces])
+    return max(stamps.values()) if len(stamps) == len(namespaces) else None
+
+
+def bump(*namespaces):
+    cache = get_cache()
+    now = time.time()
+    for namespace in namespaces:
+        key = version_key(namespace)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, int(now * 1000), timeout=None)
+    cache.set_many({modified_key(namespace): now for namespace in namespaces}, timeout=None)
+
+
+def invalidate(*namespaces):
+    # Сбрасываем сразу и ещё раз после коммита: иначе параллельный запрос
+    # успеет закэшировать данные, которые видел до коммита транзакции
+    bump(*namespaces)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: bump(*namespaces))
+
+
+def invalidate_model(model):
+    invalidate(*MODEL_NAMESPACES.get(model._meta.label_lower, ()))
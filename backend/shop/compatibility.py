@@ -0,0 +1,216 @@
+# shop/compatibility.py
+"""
+Граф совместимости комплектующих в памяти процесса.
+
+Product.compatible_with загружается двумя запросами в словари множеств:
+для каждого товара — с какими товарами каждого типа он связан (в любую
+сторону, связь достаточно указать у одного из пары).
+Дальше проверка сборки и подбор кандидатов — только операции над
+множествами, без запросов к БД. Граф обновляется по сигналам
+(m2m_changed, post_save, post_delete), а изменения в других процессах
+замечаются по версии в кэше каталога — тогда граф перечитывается целиком.
+
+Правило совместимости пары (a, b): если ни у одного из товаров нет связей
+с товарами типа другого, ограничений нет. Иначе пара должна быть связана.
+"""
+from collections import defaultdict
+import threading
+
+from django.db import transaction
+
+from . import catalog_cache
+
+NAMESPACE = 'compatibility'
+
+# Слоты сборки ПК в порядке отображения в конфигураторе
+BUILD_SLOTS = ('cpu', 'gpu', 'ram', 'motherboard', 'case', 'psu', 'storage')
+
+
+class CompatibilityGraph:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.version = None
+        self.reset()
+
+    def reset(self):
+        self.types = {}                        # id товара -> component_type
+        self.by_type = defaultdict(set)        # component_type -> id товаров
+        self.declared = defaultdict(set)       # a -> товары, объявленные совместимыми с a
+        self.declared_by = defaultdict(set)    # b -> товары, объявившие b совместимым
+        self.neighbors = defaultdict(lambda: defaultdict(set))  # a -> тип -> связанные id
+
+    # Загрузка и синхронизация
+
+    def load(self):
+        from .models import Product
+
+        with self.lock:
+            version = catalog_cache.get_versions([NAMESPACE])[0]
+            self.reset()
+            for pk, component_type in Product.objects.order_by().values_list('id', 'component_type').iterator():
+                self.types[pk] = component_type
+                self.by_type[component_type].add(pk)
+            through = Product.compatible_with.through.objects.values_list('from_product_id', 'to_product_id')
+            for source, target in through.iterator():
+                self._link(source, target)
+            self.version = version
+            self.loaded = True
+
+    def ensure_loaded(self):
+        if not self.loaded or catalog_cache.get_versions([NAMESPACE])[0] != self.version:
+            self.load()
+        return self
+
+    def _changed(self):
+        # Остальные процессы перечитают граф: сейчас и ещё раз после коммита,
+        # когда изменения станут им видны. Если транзакция откатится, граф этого
+        # процесса останется с лишней правкой до следующего изменения
+        self._publish()
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(self._publish)
+
+    def _publish(self):
+        with self.lock:
+            current = catalog_cache.get_versions([NAMESPACE])[0]
+            catalog_cache.bump(NAMESPACE)
+            # Свою правку мы уже применили; если чужих изменений не было, перечитывать не нужно
+            if self.loaded and current == self.version:
+                self.version = catalog_cache.get_versions([NAMESPACE])[0]
+
+    def _link(self, source, target):
+        self.declared[source].add(target)
+        self.declared_by[target].add(source)
+        self._connect(source, target)
+
+    def _unlink(self, source, target):
+        self.declared[source].discard(target)
+        self.declared_by[target].discard(source)
+        # Связь в обратную сторону по-прежнему делает пару совместимой
+        if source not in self.declared[target]:
+            self._disconnect(source, target)
+
+    def _connect(self, a, b):
+        if a in self.types and b in self.types:
+            self.neighbors[a][self.types[b]].add(b)
+            self.neighbors[b][self.types[a]].add(a)
+
+    def _disconnect(self, a, b):
+        for node, other in ((a, b), (b, a)):
+            component_type = self.types.get(other)
+            linked = self.neighbors[node].get(component_type) if node in self.neighbors else None
+            if linked is not None:
+                linked.discard(other)
+                if not linked:
+                    del self.neighbors[node][component_type]
+
+    def _related(self, pk):
+        return self.declared[pk] | self.declared_by[pk]
+
+    # Инкрементальные обновления (из shop.signals)
+
+    def links_added(self, source, targets):
+        with self.lock:
+            if self.loaded:
+                for target in targets:
+                    self._link(source, target)
+            self._changed()
+
+    def links_removed(self, source, targets):
+        with self.lock:
+            if self.loaded:
+                for target in targets:
+                    self._unlink(source, target)
+            self._changed()
+
+    def links_cleared(self, source=None, target=None):
+        with self.lock:
+            if self.loaded:
+                if source is not None:
+                    for other in list(self.declared[source]):
+                        self._unlink(source, other)
+                if target is not None:
+                    for other in list(self.declared_by[target]):
+                        self._unlink(other, target)
+            self._changed()
+
+    def product_saved(self, pk, component_type):
+        with self.lock:
+            if self.loaded:
+                if self.types.get(pk) == component_type:
+                    return
+                related = self._related(pk)
+                for other in related:
+                    self._disconnect(pk, other)
+                old_type = self.types.get(pk)
+                if old_type is not None:
+                    self.by_type[old_type].discard(pk)
+                self.types[pk] = component_type
+                self.by_type[component_type].add(pk)
+                for other in related:
+                    self._connect(pk, other)
+            self._changed()
+
+    def product_deleted(self, pk):
+        with self.lock:
+            if self.loaded and pk in self.types:
+                for target in list(self.declared[pk]):
+                    self._unlink(pk, target)
+                for source in list(self.declared_by[pk]):
+                    self._unlink(source, pk)
+                self.by_type[self.types.pop(pk)].discard(pk)
+                self.declared.pop(pk, None)
+                self.declared_by.pop(pk, None)
+                self.neighbors.pop(pk, None)
+            self._changed()
+
+    # Запросы
+
+    def compatible(self, a, b):
+        linked_a = self.neighbors[a].get(self.types.get(b)) if a in self.neighbors else None
+        linked_b = self.neighbors[b].get(self.types.get(a)) if b in self.neighbors else None
+        if not linked_a and not linked_b:
+            return True
+        return bool(linked_a) and b in linked_a
+
+    def validate(self, build):
+        """
+        Проверяет сборку {слот: id товара}. Возвращает список ошибок;
+        пустой список — сборка согласована.
+        """
+        with self.lock:
+            errors = []
+            for slot, pk in build.items():
+                if pk not in self.types:
+                    errors.append({'slot': slot, 'error': 'not_found', 'product': pk})
+                elif self.types[pk] != slot:
+                    errors.append({'slot': slot, 'error': 'wrong_type', 'product': pk, 'component_type': self.types[pk]})
+            if errors:
+                return errors
+            items = list(build.items())
+            for i, (slot_a, a) in enumerate(items):
+                for slot_b, b in items[i + 1:]:
+                    if not self.compatible(a, b):
+                        errors.append({'slot': slot_a, 'error': 'incompatible', 'product': a, 'with_slot': slot_b, 'with_product': b})
+            return errors
+
+    def candidates(self, build, slots=BUILD_SLOTS):
+        """Для каждого незаполненного слота — id товаров, совместимых со всей сборкой."""
+        with self.lock:
+            selected = [pk for pk in build.values() if pk in self.types]
+            result = {}
+            for slot in slots:
+                if slot in build:
+                    continue
+                result[slot] = sorted(
+                    pk for pk in self.by_type.get(slot, ())
+                    if all(self.compatible(pk, other) for other in selected)
+                )
+            return result
+
+
+graph = CompatibilityGraph()
+
+
+def get_graph():
+    return graph.ensure_loaded()
@@ -0,0 +1,75 @@
+# shop/configurator.py
+"""
+Данные для конструктора ПК: все комплектующие в наличии, сгруппированные
+по component_type, в компактном виде. Собираются двумя запросами (товары
+и id их вариантов) и кэшируются до изменения каталога.
+"""
+from . import catalog_cache
+from .compatibility import BUILD_SLOTS
+from .models import Product
+
+PART_FIELDS = ('id', 'name', 'price', 'options')
+
+
+def parts_query():
+    return (
+        Product.objects
+        .filter(stock__gt=0, component_type__in=BUILD_SLOTS)
+        .order_by('component_type', 'final_price', 'id')
+        .values('component_type', 'id', 'name', 'final_price')
+    )
+
+
+def options_query():
+    # Пары (товар, вариант) отдельным запросом, а не GROUP_CONCAT: в MySQL он
+    # обрезает строку до group_concat_max_len, и id вариантов терялись бы молча
+    Through = Product.components.through
+    return (
+        Through.objects
+        .filter(product__stock__gt=0, product__component_type__in=BUILD_SLOTS)
+        .order_by('componentoption_id')
+        .values_list('product_id', 'componentoption_id')
+    )
+
+
+def group_parts(rows, option_pairs):
+    options = {}
+    for product_id, option_id in option_pairs:
+        options.setdefault(product_id, []).append(option_id)
+    parts = {slot: [] for slot in BUILD_SLOTS}
+    for row in rows:
+        parts[row['component_type']].append([row['id'], row['name'], str(row['final_price']), options.get(row['id'], [])])
+    return parts
+
+
+def load_parts():
+    return group_parts(parts_query(), options_query())
+
+
+def parts_key(version):
+    return f'configurator:parts:{version}'
+
+
+def get_parts():
+    """{тип: [[id, название, цена со скидкой, [id вариантов]], ...]}, товары по возрастанию цены."""
+    cache = catalog_cache.get_cache()
+    key = parts_key(catalog_cache.get_versions(['products'])[0])
+    parts = cache.get(key)
+    if parts is None:
+        parts = load_parts()
+        cache.set(key, parts)
+    return parts
+
+
+async def aget_parts():
+    """get_parts() для shop.async_views: асинхронные ORM и API кэша."""
+    cache = catalog_cache.get_cache()
+    key = parts_key((await catalog_cache.aget_versions(['products']))[0])
+    parts = await cache.aget(key)
+    if parts is None:
+        parts = group_parts(
+            [row async for row in parts_query()],
+            [pair async for pair in options_query()],
+        )
+        await cache.aset(key, parts)
+    return parts
@@ -0,0 +1,170 @@
+# shop/counters.py
+"""
+Счётчики товаров в категории: Category.product_count, in_stock_count,
+total_stock и catalog_value (сумма базовых цен).
+
+Хранятся в самой категории, чтобы админка и API не делали GROUP BY по всем
+товарам. Обновляются приращениями: новые товары добавляют свой вклад сразу,
+а при изменении или удалении tracking() снимает вклад затронутых товаров до
+и после и прибавляет разницу одним UPDATE категорий. Расхождения (например,
+после правки БД вручную) исправляет команда reconcile_category_counters.
+
+Исключение — резервирование остатков при заказе (shop.inventory): строка
+категории общая для всех её товаров, и её блокировка в транзакции заказа
+выстроила бы в очередь все заказы категории. Поэтому inventory считает
+изменение in_stock_count и total_stock по уже заблокированным строкам
+товаров и прибавляет его после коммита (apply_after_commit). Если процесс
+упадёт между коммитом и этим UPDATE, расхождение исправит
+reconcile_category_counters.
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+
+from . import catalog_cache
+
+COUNTER_FIELDS = ('product_count', 'in_stock_count', 'total_stock', 'catalog_value')
+
+# Поля товара, от которых зависят счётчики
+TRACKED_FIELDS = {'category', 'category_id', 'stock', 'base_price'}
+
+LOCK_BATCH_SIZE = 1000
+
+
+def new_counters():
+    return defaultdict(lambda: [0, 0, 0, Decimal('0.00')])
+
+
+def add(counters, rows):
+    """Добавляет вклад товаров (category_id, stock, base_price) в counters."""
+    for category_id, stock, base_price in rows:
+        row = counters[category_id]
+        row[0] += 1
+        row[1] += 1 if stock > 0 else 0
+        row[2] += stock
+        row[3] += base_price
+    return counters
+
+
+def collect(product_ids):
+    """
+    Текущий вклад товаров product_ids. Строки читаются с блокировкой: так
+    видны их последние значения, а не снимок начала транзакции (MySQL
+    REPEATABLE READ), и параллельное изменение тех же товаров ждёт коммита.
+    """
+    from .models import Product
+
+    counters = new_counters()
+    product_ids = sorted(product_ids)
+    for start in range(0, len(product_ids), LOCK_BATCH_SIZE):
+        add(counters, Product.objects.select_for_update().filter(
+            pk__in=product_ids[start:start + LOCK_BATCH_SIZE],
+        ).order_by('pk').values_list('category_id', 'stock', 'base_price'))
+    return counters
+
+
+def difference(after, before):
+    changes = {}
+    for category_id in set(after) | set(before):
+        delta = [a - b for a, b in zip(after[category_id], before[category_id])]
+        if any(delta):
+            changes[category_id] = delta
+    return changes
+
+
+def apply(changes):
+    """Прибавляет {id категории: [товары, в наличии, запас, стоимость]} одним UPDATE."""
+    from .models import Category
+
+    if not changes:
+        return
+    increments = {}
+    for index, (name, field) in enumerate(zip(COUNTER_FIELDS, (
+        models.IntegerField(), models.IntegerField(), models.IntegerField(),
+        models.DecimalField(max_digits=14, decimal_places=2),
+    ))):
+        whens = [When(pk=pk, then=Value(delta[index])) for pk, delta in changes.items() if delta[index]]
+        if whens:
+            increments[name] = F(name) + Case(*whens, default=Value(0, output_field=field), output_field=field)
+    # Через базовый менеджер: CategoryQuerySet.update сдвинул бы updated_at всех товаров категории
+    Category._base_manager.filter(pk__in=changes).update(**increments)
+    catalog_cache.invalidate('categories')
+
+
+def apply_after_commit(changes):
+    """apply() после коммита текущей транзакции (сразу, если её нет)."""
+    if changes:
+        transaction.on_commit(lambda: apply(changes), robust=True)
+
+
+def stock_changes(rows):
+    """
+    Изменения счётчиков от смены остатков [(id категории, было, стало)]
+    без чтения из БД: shop.inventory знает остатки заблокированных товаров.
+    """
+    changes = new_counters()
+    for category_id, before, after in rows:
+        delta = changes[category_id]
+        delta[1] += (after > 0) - (before > 0)
+        delta[2] += after - before
+    return {pk: delta for pk, delta in changes.items() if any(delta)}
+
+
+def record(products):
+    """Прибавляет вклад новых товаров прямо из объектов."""
+    counters = add(new_counters(), [
+        (product.category_id, int(product.stock), Decimal(str(product.base_price or 0))) for product in products
+    ])
+    apply({pk: delta for pk, delta in counters.items() if any(delta)})
+
+
+@contextmanager
+def tracking(product_ids):
+    """Обновляет счётчики по товарам, которые меняются или удаляются внутри блока."""
+    product_ids = set(product_ids)
+    # Без точки сохранения: при ошибке откатится охватывающая транзакция
+    with transaction.atomic(savepoint=False):
+        before = collect(product_ids)
+        yield product_ids
+        apply(difference(collect(product_ids), before))
+
+
+@transaction.atomic
+def reconcile(dry_run=False):
+    """
+    Пересчитывает счётчики по товарам и исправляет расхождения. Возвращает
+    [(категория, {поле: (было, стало)}), ...].
+    """
+    from .models import Category, Product
+
+    # Сначала блокируем категории: изменения товаров, не успевшие дойти до
+    # счётчиков, дождутся нашего коммита и прибавятся уже к верным значениям
+    categories = list(Category._base_manager.select_for_update().order_by('pk'))
+    actual = {
+        row['category_id']: row for row in Product.objects.values('category_id').annotate(
+            product_count=Count('id'),
+            in_stock_count=Count('id', filter=Q(stock__gt=0)),
+            total_stock=Sum('stock'),
+            catalog_value=Sum('base_price'),
+        ).order_by()
+    }
+    fixed = []
+    for category in categories:
+        row = actual.get(category.pk, {})
+        drift = {}
+        for name in COUNTER_FIELDS:
+            value = row.get(name) or 0
+            if name == 'catalog_value':
+                value = Decimal(value).quantize(Decimal('0.01'))
+            if getattr(category, name) != value:
+                drift[name] = (getattr(category, name), value)
+        if drift:
+            fixed.append((category, drift))
+            if not dry_run:
+                Category._base_manager.filter(pk=category.pk).update(**{name: new for name, (_, new) in drift.items()})
+    if fixed and not dry_run:
+        catalog_cache.invalidate('categories')
+    return fixed
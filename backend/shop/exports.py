@@ -0,0 +1,91 @@
+# shop/exports.py
+"""
+Потоковая выгрузка CSV. Строки читаются из БД порциями по первичному ключу,
+поэтому память не растёт с количеством записей, а ответ начинает отдаваться
+клиенту сразу, не дожидаясь конца выборки.
+"""
+import csv
+
+from django.http import StreamingHttpResponse
+
+CHUNK_SIZE = 2000
+
+PRODUCT_HEADER = ['ID', 'Название', 'Категория', 'Тип', 'Базовая цена', 'Запас', 'Скидка', 'Итоговая цена']
+ORDER_HEADER = ['ID', 'Клиент', 'Итого', 'Тип доставки', 'Статус', 'Дата создания', 'Товары']
+
+
+class Echo:
+    """Псевдо-файл для csv.writer: write() просто возвращает строку."""
+
+    def write(self, value):
+        return value
+
+
+def iterate_in_chunks(queryset, chunk_size=CHUNK_SIZE):
+    # Постранично по id, а не iterator(): драйвер MySQL по умолчанию буферизует весь
+    # результат на клиенте, а prefetch_related так выполняется один раз на порцию
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1].pk
+
+
+def product_rows(queryset, chunk_size=CHUNK_SIZE):
+    yield PRODUCT_HEADER
+    queryset = queryset.select_related('category').only(
+        'id', 'name', 'category__name', 'component_type', 'base_price', 'stock', 'discount', 'final_price',
+    )
+    for product in iterate_in_chunks(queryset, chunk_size):
+        yield [
+            product.id,
+            product.name,
+            product.category.name,
+            product.component_type,
+            product.base_price,
+            product.stock,
+            product.discount,
+            product.final_price,
+        ]
+
+
+def order_rows(queryset, chunk_size=CHUNK_SIZE):
+    yield ORDER_HEADER
+    for order in iterate_in_chunks(queryset.prefetch_related('order_items'), chunk_size):
+        items = order.order_items.all()
+        yield [
+            order.id,
+            order.customer_name,
+            order.total,
+            order.delivery,
+            order.status,
+            order.created_at,
+            '; '.join(f"{item.name} x{item.quantity}" for item in items) if items else order.items,
+        ]
+
+
+def stream_csv(rows):
+    writer = csv.writer(Echo())
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def write_csv(rows, file):
+    writer = csv.writer(file)
+    count = -1  # заголовок не считаем
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def csv_response(rows, filename):
+    response = StreamingHttpResponse(stream_csv(rows), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
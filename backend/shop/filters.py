@@ -0,0 +1,80 @@
+# shop/filters.py
+from decimal import Decimal, InvalidOperation
+
+from rest_framework import filters
+from rest_framework.exceptions import ValidationError
+
+from . import search
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+
+def split_param(value):
+    # Параметр можно передать как ?brand=a,b или ?brand=a&brand=b
+    return [item.strip() for part in value for item in part.split(',') if item.strip()]
+
+
+class ProductFilter(filters.BaseFilterBackend):
+    """Фильтрация каталога на стороне БД по параметрам запроса."""
+
+    def parse_decimal(self, request, name):
+        value = request.query_params.get(name)
+        if value in (None, ''):
+            return None
+        try:
+            number = Decimal(value)
+        except InvalidOperation:
+            number = None
+        # NaN и Infinity Decimal принимает, но сравнивать их с ценой в БД нельзя
+        if number is None or not number.is_finite():
+            raise ValidationError({name: 'Некорректное число.'})
+        return number
+
+    def parse_ids(self, request, name):
+        values = split_param(request.query_params.getlist(name))
+        try:
+            return [int(value) for value in values]
+        except ValueError:
+            raise ValidationError({name: 'Ожидается список числовых ID.'})
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+
+        categories = self.parse_ids(request, 'category')
+        if categories:
+            queryset = queryset.filter(category_id__in=categories)
+
+        brands = split_param(params.getlist('brand'))
+        if brands:
+            queryset = queryset.filter(brand__in=brands)
+
+        component_types = split_param(params.getlist('component_type'))
+        if component_types:
+            queryset = queryset.filter(component_type__in=component_types)
+
+        min_price = self.parse_decimal(request, 'min_price')
+        if min_price is not None:
+            queryset = queryset.filter(final_price__gte=min_price)
+        max_price = self.parse_decimal(request, 'max_price')
+        if max_price is not None:
+            queryset = queryset.filter(final_price__lte=max_price)
+
+        if params.get('in_stock', '').lower() in TRUE_VALUES:
+            queryset = queryset.filter(stock__gt=0)
+
+        term = params.get('search', '').strip()
+        if term:
+            queryset = search.filter_products(queryset, term)
+
+        return queryset
+
+
+class ProductOrderingFilter(filters.OrderingFilter):
+    ordering_fields = ('name', 'final_price', 'base_price', 'created_at', 'stock', 'discount')
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        # id в конце делает порядок однозначным, иначе страницы могут пересекаться
+        if ordering and not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            ordering = [*ordering, 'id']
+        return ordering
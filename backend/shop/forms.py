@@ -0,0 +1,24 @@
+# shop/forms.py
+from django import forms
+
+
+class PriceAdjustmentForm(forms.Form):
+    MODES = (
+        ('percent', 'В процентах'),
+        ('delta', 'На фиксированную сумму'),
+    )
+    mode = forms.ChoiceField(label="Способ", choices=MODES, initial='percent')
+    value = forms.DecimalField(
+        label="Изменение", max_digits=10, decimal_places=2,
+        help_text="Отрицательное значение уменьшает цену, например -10",
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('mode') == 'percent' and cleaned_data.get('value') is not None and cleaned_data['value'] <= -100:
+            self.add_error('value', "Скидка не может быть 100% и больше.")
+        return cleaned_data
+
+    def change_kwargs(self):
+        mode, value = self.cleaned_data['mode'], self.cleaned_data['value']
+        return {'percent': value} if mode == 'percent' else {'delta': value}
@@ -0,0 +1,116 @@
+# shop/images.py
+"""
+Уменьшенные копии фото товаров.
+
+При загрузке изображения для каждой ширины из VARIANT_WIDTHS сохраняются
+WebP и JPEG рядом с оригиналом (products/variants/). Имена файлов хранятся в
+Product.image_variants, клиенты выбирают нужный размер (srcset) и не качают
+оригинал. Для уже загруженных фото — команда generate_image_variants.
+"""
+from io import BytesIO
+import hashlib
+import logging
+import os
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+VARIANT_WIDTHS = (160, 480, 960)
+VARIANT_DIR = 'products/variants'
+
+# Расширение -> формат Pillow и параметры сжатия
+VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def variant_name(name, width, extension):
+    # Хэш полного имени оригинала: у products/a.png и products/a.jpg свои копии
+    stem = os.path.splitext(os.path.basename(name))[0]
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest()[:10]
+    return f'{VARIANT_DIR}/{stem}-{digest}-{width}.{extension}'
+
+
+def flatten(image):
+    # JPEG не умеет прозрачность: подкладываем белый фон
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def generate_variants(name, storage=default_storage):
+    """
+    Создаёт копии изображения name во всех размерах и форматах. Возвращает
+    {'source': name, 'width': ..., 'webp': {'160': имя файла, ...}, 'jpeg': {...}}.
+    Копий шире оригинала не делаем; если оригинал уже меньше всех ширин,
+    остаётся одна копия в исходном размере.
+    """
+    with storage.open(name, 'rb') as file:
+        image = Image.open(file)
+        image = flatten(ImageOps.exif_transpose(image))
+    widths = [width for width in VARIANT_WIDTHS if width < image.width] or [image.width]
+    variants = {'source': name, 'width': image.width}
+    for extension, (image_format, options) in VARIANT_FORMATS.items():
+        variants[extension] = {}
+        for width in widths:
+            height = max(round(image.height * width / image.width), 1)
+            resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+            buffer = BytesIO()
+            resized.save(buffer, image_format, **options)
+            target = variant_name(name, width, extension)
+            if storage.exists(target):
+                storage.delete(target)
+            variants[extension][str(width)] = storage.save(target, ContentFile(buffer.getvalue()))
+    return variants
+
+
+def variant_files(variants):
+    return [name for extension in VARIANT_FORMATS for name in (variants or {}).get(extension, {}).values()]
+
+
+def delete_variants(variants, storage=default_storage):
+    for name in variant_files(variants):
+        storage.delete(name)
+
+
+def refresh_variants(name, variants):
+    """
+    Новые копии, если изображение сменилось; иначе прежние. Ошибка в файле
+    не мешает сохранить товар: копий просто не будет.
+    """
+    if not name:
+        if variants:
+            delete_variants(variants)
+        return {}
+    if variants and variants.get('source') == name:
+        return variants
+    try:
+        fresh = generate_variants(name)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+        logger.warning('Не удалось создать копии изображения %s', name, exc_info=True)
+        return {}
+    # Копии с совпадающими именами уже перезаписаны, удаляем только лишние
+    for stale in set(variant_files(variants)) - set(variant_files(fresh)):
+        default_storage.delete(stale)
+    return fresh
+
+
+def smallest_variant(variants, extension='jpeg'):
+    files = (variants or {}).get(extension) or {}
+    return files[min(files, key=int)] if files else None
+
+
+def init_worker():
+    # При запуске процессов через spawn (macOS, Windows) Django в них ещё не настроен
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
@@ -0,0 +1,324 @@
+# shop/importer.py
+"""
+Импорт прайс-листов поставщиков (CSV или JSON Lines) пачками.
+
+Строки читаются потоком и обрабатываются пачками по batch_size: товары
+сопоставляются по артикулу (sku), новые создаются одним bulk_create,
+у существующих обновляются только изменившиеся строки, а изменившиеся комплектующие пишутся прямо
+в промежуточную таблицу (с новым updated_at товара). Совместимость (compatible_with — список артикулов)
+проставляется в конце, когда созданы все товары файла. Ошибочные строки
+пропускаются и попадают в отчёт с номером строки.
+
+Колонки: sku (обязательно), name, category (название), base_price,
+discount, stock, description, brand, component_type, components (id
+комплектующих через ';'), compatible_with (артикулы через ';').
+"""
+import codecs
+from collections import defaultdict
+import csv
+from decimal import Decimal, InvalidOperation
+import io
+import json
+
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from . import catalog_cache, compatibility, counters
+from .models import PRICE_FIELDS, Category, ComponentOption, Product, calculate_final_price
+
+BATCH_SIZE = 1000
+LIST_SEPARATOR = ';'
+
+PRODUCT_FIELDS = ('name', 'description', 'brand', 'component_type', 'base_price', 'discount', 'stock')
+UPDATE_FIELDS = PRODUCT_FIELDS + ('category_id',)
+COMPONENT_TYPES = dict(Product.COMPONENT_TYPES)
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_csv(file, delimiter=','):
+    for number, row in enumerate(csv.DictReader(file, delimiter=delimiter), start=2):
+        yield number, {key.strip(): value for key, value in row.items() if key}
+
+
+def read_jsonl(file):
+    for number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as error:
+            yield number, RowError(f'Некорректный JSON: {error.msg}')
+            continue
+        yield number, row if isinstance(row, dict) else RowError('Ожидается JSON-объект.')
+
+
+def read_rows(file, format='csv', delimiter=','):
+    """
+    (номер строки, словарь) из текстового или бинарного файла. Подходит
+    любой объект, по которому можно идти построчно, в том числе поток запроса.
+    """
+    if not isinstance(file, io.TextIOBase):
+        file = codecs.iterdecode(file, 'utf-8-sig')
+    if format == 'jsonl':
+        return read_jsonl(file)
+    return read_csv(file, delimiter)
+
+
+def split_list(value):
+    if value in (None, ''):
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(item).strip() for item in value if str(item).strip()]
+    return [item.strip() for item in str(value).split(LIST_SEPARATOR) if item.strip()]
+
+
+def clean_row(row):
+    """Проверяет и приводит типы. Возвращает только поля, которые есть в строке."""
+    if isinstance(row, RowError):
+        raise row
+    sku = str(row.get('sku') or '').strip()
+    if not sku:
+        raise RowError('Не указан sku.')
+    data = {'sku': sku[:64]}
+    for field in ('name', 'description', 'brand'):
+        if field in row and row[field] is not None:
+            data[field] = str(row[field]).strip()
+    if 'name' in data and not data['name']:
+        raise RowError('Пустое название.')
+    if row.get('component_type') not in (None, ''):
+        if row['component_type'] not in COMPONENT_TYPES:
+            raise RowError(f'Неизвестный component_type: {row["component_type"]}.')
+        data['component_type'] = row['component_type']
+    if row.get('base_price') not in (None, ''):
+        try:
+            data['base_price'] = Decimal(str(row['base_price'])).quantize(Decimal('0.01'))
+        except InvalidOperation:
+            raise RowError(f'Некорректная цена: {row["base_price"]}.')
+        if data['base_price'] < 0:
+            raise RowError('Цена не может быть отрицательной.')
+    for field in ('discount', 'stock'):
+        if row.get(field) not in (None, ''):
+            try:
+                data[field] = int(row[field])
+            except (TypeError, ValueError):
+                raise RowError(f'Некорректное значение {field}: {row[field]}.')
+    if not 0 <= data.get('discount', 0) <= 100:
+        raise RowError('Скидка должна быть от 0 до 100.')
+    if row.get('category') not in (None, ''):
+        data['category'] = str(row['category']).strip()
+    if 'components' in row:
+        try:
+            data['components'] = [int(pk) for pk in split_list(row['components'])]
+        except ValueError:
+            raise RowError('components — id комплектующих через ";".')
+    if 'compatible_with' in row:
+        data['compatible_with'] = split_list(row['compatible_with'])
+    return data
+
+
+def update_products(changes):
+    """
+    Обновляет товары [(товар, {изменённые поля}), ...]. Для каждого набора полей —
+    один UPDATE ... WHERE id = %s через executemany: QuerySet.bulk_update строит
+    CASE WHEN на каждую строку и поле, и на тысячах строк это секунды работы ORM
+    на пачку. final_price и updated_at поддерживаем здесь, как ProductQuerySet.
+    """
+    groups = defaultdict(list)
+    for product, fields in changes:
+        if fields & set(PRICE_FIELDS):
+            product.final_price = calculate_final_price(product.base_price, product.discount)
+            fields = fields | {'final_price'}
+        groups[frozenset(fields)].append(product)
+
+    connection = connections[router.db_for_write(Product)]
+    quote = connection.ops.quote_name
+    now = timezone.now()
+    # Категория, остаток и цена входят в счётчики категорий (shop.counters)
+    tracked = [product.pk for product, fields in changes if counters.TRACKED_FIELDS.intersection(fields)]
+    with counters.tracking(tracked), connection.cursor() as cursor:
+        for names, products in groups.items():
+            fields = [Product._meta.get_field(name) for name in sorted(names)] + [Product._meta.get_field('updated_at')]
+            assignments = ', '.join(f'{quote(field.column)} = %s' for field in fields)
+            sql = f'UPDATE {quote(Product._meta.db_table)} SET {assignments} WHERE {quote("id")} = %s'
+            params = []
+            for product in products:
+                product.updated_at = now
+                params.append([field.get_db_prep_save(getattr(product, field.attname), connection) for field in fields] + [product.pk])
+            cursor.executemany(sql, params)
+
+
+class CatalogImporter:
+    def __init__(self, batch_size=BATCH_SIZE, max_errors=1000):
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.created = self.updated = self.unchanged = 0
+        self.errors = []
+        self.error_count = 0
+        self.categories = {}
+        self.option_ids = None
+        self.compatibility = {}  # sku -> список артикулов
+        self.unchanged_skus = set()  # из них: строки, посчитанные неизменёнными до записи связей
+
+    def error(self, number, sku, message):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'row': number, 'sku': sku, 'error': message})
+
+    def run(self, rows):
+        batch = []
+        for number, row in rows:
+            try:
+                batch.append((number, clean_row(row)))
+            except RowError as error:
+                self.error(number, row.get('sku') if isinstance(row, dict) else None, str(error))
+            if len(batch) >= self.batch_size:
+                self.import_batch(batch)
+                batch = []
+        if batch:
+            self.import_batch(batch)
+        self.link_compatibility()
+        catalog_cache.invalidate('products', 'categories', compatibility.NAMESPACE)
+        return self.report()
+
+    def report(self):
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'unchanged': self.unchanged,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+    def resolve_categories(self, names):
+        missing = {name for name in names if name not in self.categories}
+        if missing:
+            self.categories.update(Category.objects.filter(name__in=missing).values_list('name', 'id'))
+            new = [Category(name=name) for name in missing if name not in self.categories]
+            if new:
+                Category.objects.bulk_create(new)
+                # MySQL не возвращает id после bulk_create, поэтому перечитываем
+                self.categories.update(Category.objects.filter(name__in=missing).values_list('name', 'id'))
+
+    def valid_options(self):
+        if self.option_ids is None:
+            self.option_ids = set(ComponentOption.objects.values_list('id', flat=True))
+        return self.option_ids
+
+    @transaction.atomic
+    def import_batch(self, batch):
+        # Повтор артикула внутри пачки: действует последняя строка
+        rows = {}
+        for number, data in batch:
+            rows[data['sku']] = (number, data)
+        self.resolve_categories({data['category'] for _, data in rows.values() if 'category' in data})
+        existing = {product.sku: product for product in Product.objects.filter(sku__in=rows)}
+
+        to_create, to_update, unchanged, m2m = [], [], set(), {}
+        for sku, (number, data) in rows.items():
+            missing_options = set(data['components']) - self.valid_options() if data.get('components') else None
+            if missing_options:
+                self.error(number, sku, f'Комплектующие не найдены: {sorted(missing_options)}.')
+                continue
+            if 'category' in data:
+                data['category_id'] = self.categories[data['category']]
+            product = existing.get(sku)
+            if product is None:
+                if not data.get('name') or not data.get('category'):
+                    self.error(number, sku, 'Для нового товара нужны name и category.')
+                    continue
+                product = Product(sku=sku)
+                to_create.append(product)
+            else:
+                # Пишем только то, что изменилось: в прайс-листах большинство строк повторяются
+                changed = {field for field in UPDATE_FIELDS if field in data and getattr(product, field) != data[field]}
+                if changed:
+                    to_update.append((product, changed))
+                else:
+                    unchanged.add(sku)
+            for field in UPDATE_FIELDS:
+                if field in data:
+                    setattr(product, field, data[field])
+            if 'components' in data:
+                m2m[sku] = data['components']
+            if 'compatible_with' in data:
+                self.compatibility[sku] = data['compatible_with']
+
+        if to_create:
+            Product.objects.bulk_create(to_create, batch_size=self.batch_size)
+        if to_update:
+            update_products(to_update)
+
+        relinked = {}
+        if m2m:
+            # id новых товаров на MySQL после bulk_create неизвестны — берём по артикулу
+            ids = dict(Product.objects.filter(sku__in=m2m).values_list('sku', 'id'))
+            Through = Product.components.through
+            current = defaultdict(set)
+            for product_id, option_id in Through.objects.filter(product_id__in=ids.values()).values_list('product_id', 'componentoption_id'):
+                current[product_id].add(option_id)
+            relinked = {sku: option_ids for sku, option_ids in m2m.items() if set(option_ids) != current[ids[sku]]}
+            if relinked:
+                Through.objects.filter(product_id__in=[ids[sku] for sku in relinked]).delete()
+                Through.objects.bulk_create([
+                    Through(product_id=ids[sku], componentoption_id=option_id)
+                    for sku, option_ids in relinked.items()
+                    for option_id in dict.fromkeys(option_ids)
+                ], batch_size=self.batch_size)
+                # Комплектующие входят в ответ по товару: сдвигаем updated_at (ETag)
+                self.touch([ids[sku] for sku in relinked if sku in existing])
+
+        # Строка без изменённых полей, но с новыми комплектующими — обновлённая
+        moved = unchanged.intersection(relinked)
+        unchanged -= moved
+        self.created += len(to_create)
+        self.updated += len(to_update) + len(moved)
+        self.unchanged += len(unchanged)
+        self.unchanged_skus.update(sku for sku in unchanged if sku in self.compatibility)
+
+    def touch(self, ids):
+        if ids:
+            Product.objects.filter(pk__in=ids).update(updated_at=timezone.now())
+
+    def link_compatibility(self):
+        if not self.compatibility:
+            return
+        Through = Product.compatible_with.through
+        items = list(self.compatibility.items())
+        for start in range(0, len(items), self.batch_size):
+            chunk = dict(items[start:start + self.batch_size])
+            skus = set(chunk) | {target for targets in chunk.values() for target in targets}
+            ids = dict(Product.objects.filter(sku__in=skus).values_list('sku', 'id'))
+            current = defaultdict(set)
+            sources = [ids[sku] for sku in chunk if sku in ids]
+            for source, target in Through.objects.filter(from_product_id__in=sources).values_list('from_product_id', 'to_product_id'):
+                current[source].add(target)
+            relinked, links = [], []
+            for sku, targets in chunk.items():
+                if sku not in ids:
+                    continue
+                unknown = [target for target in targets if target not in ids]
+                if unknown:
+                    self.error(None, sku, f'compatible_with: неизвестные артикулы {unknown}.')
+                wanted = [ids[target] for target in dict.fromkeys(targets) if target in ids and target != sku]
+                if set(wanted) != current[ids[sku]]:
+                    relinked.append(sku)
+                    links.extend(Through(from_product_id=ids[sku], to_product_id=pk) for pk in wanted)
+            if not relinked:
+                continue
+            with transaction.atomic():
+                Through.objects.filter(from_product_id__in=[ids[sku] for sku in relinked]).delete()
+                Through.objects.bulk_create(links, batch_size=self.batch_size)
+                # compatible_with входит в ответ по товару: сдвигаем updated_at (ETag)
+                self.touch([ids[sku] for sku in relinked])
+            moved = self.unchanged_skus.intersection(relinked)
+            self.unchanged -= len(moved)
+            self.updated += len(moved)
+
+
+def import_catalog(file, format='csv', delimiter=',', batch_size=BATCH_SIZE, max_errors=1000):
+    """Импортирует файл и возвращает отчёт: created, updated, unchanged, error_count, errors."""
+    importer = CatalogImporter(batch_size=batch_size, max_errors=max_errors)
+    return importer.run(read_rows(file, format, delimiter))
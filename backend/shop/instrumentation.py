@@ -0,0 +1,177 @@
+# shop/instrumentation.py
+"""
+Замеры каждого запроса: число и время SQL-запросов, время сериализации и
+рендеринга ответа.
+
+PerformanceMiddleware отдаёт их в заголовке Server-Timing (видно во
+вкладке Network браузера) и пишет в лог shop.performance JSON-строку о
+запросе, который медленнее PERF_SLOW_REQUEST_MS или сделал больше
+PERF_SLOW_REQUEST_QUERIES запросов к БД, вместе с самыми частыми SQL. Лог
+пишется через очередь в отдельном потоке (queued_file_handler), чтобы
+запись на диск не задерживала ответ.
+
+Без PERF_INSTRUMENTATION middleware исключается из цепочки при запуске, а
+span() сводится к чтению одной контекстной переменной.
+"""
+import atexit
+import json
+import logging
+import re
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger('shop.performance')
+
+_metrics = ContextVar('request_metrics', default=None)
+
+# IN (%s, %s, ...) любой длины — один и тот же запрос
+IN_LIST = re.compile(r'\((?:%s, )*%s\)')
+
+
+def queued_file_handler(filename):
+    """Обработчик для LOGGING: запись в файл идёт в фоновом потоке."""
+    queue = SimpleQueue()
+    listener = QueueListener(queue, logging.FileHandler(filename, encoding='utf-8', delay=True))
+    listener.start()
+    atexit.register(listener.stop)
+    return QueueHandler(queue)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.spans = defaultdict(float)
+        self.open_spans = set()
+        # {SQL без параметров: [сколько раз, время]}
+        self.statements = defaultdict(lambda: [0, 0.0])
+
+    def add_query(self, sql, duration):
+        self.queries += 1
+        self.db_time += duration
+        statement = self.statements[IN_LIST.sub('(...)', sql)]
+        statement[0] += 1
+        statement[1] += duration
+
+    def top_queries(self, limit):
+        top = sorted(self.statements.items(), key=lambda item: (-item[1][0], -item[1][1]))[:limit]
+        return [{'sql': sql, 'count': count, 'ms': round(duration * 1000, 1)} for sql, (count, duration) in top]
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = _metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_query(sql, time.perf_counter() - start)
+
+
+def install(connection, **kwargs):
+    # Обёртка остаётся на соединении: вне замеряемого запроса она сразу вызывает execute
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def span(name):
+    """Добавляет время блока к метрике name текущего запроса (вложенные блоки не считаются дважды)."""
+    metrics = _metrics.get()
+    if metrics is None or name in metrics.open_spans:
+        yield
+        return
+    metrics.open_spans.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.open_spans.discard(name)
+        metrics.spans[name] += time.perf_counter() - start
+
+
+class PerformanceMiddleware:
+    """Server-Timing и лог медленных запросов. Ставится первым в MIDDLEWARE."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PERF_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_ms = settings.PERF_SLOW_REQUEST_MS
+        self.slow_queries = settings.PERF_SLOW_REQUEST_QUERIES
+        self.top_queries = settings.PERF_TOP_QUERIES
+        # Соединения потоков, в которых асинхронный ORM выполняет SQL, тоже получат обёртку
+        connection_created.connect(install, dispatch_uid='shop.instrumentation')
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        for alias in connections:
+            install(connections[alias])
+        metrics, token, started = self.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _metrics.reset(token)
+        return self.finish(request, response, metrics, started)
+
+    async def __acall__(self, request):
+        metrics, token, started = self.start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _metrics.reset(token)
+        return self.finish(request, response, metrics, started)
+
+    def start(self):
+        metrics = RequestMetrics()
+        return metrics, _metrics.set(metrics), time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # Ответы DRF рендерятся после всех middleware: время меряем колбэком после рендеринга
+        metrics = _metrics.get()
+        if metrics is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                metrics.spans['render'] += time.perf_counter() - start
+            response.add_post_render_callback(rendered)
+        return response
+
+    def finish(self, request, response, metrics, started):
+        total = time.perf_counter() - started
+        timings = [
+            ('db', metrics.db_time, f'{metrics.queries} SQL'),
+            ('serialize', metrics.spans.get('serialize', 0.0), None),
+            ('render', metrics.spans.get('render', 0.0), None),
+            ('total', total, None),
+        ]
+        response['Server-Timing'] = ', '.join(
+            f'{name};dur={duration * 1000:.1f}' + (f';desc="{desc}"' if desc else '')
+            for name, duration, desc in timings
+        )
+        if total * 1000 >= self.slow_ms or metrics.queries > self.slow_queries:
+            logger.warning(json.dumps({
+                'method': request.method,
+                'path': request.get_full_path(),
+                'status': response.status_code,
+                **{f'{name}_ms': round(duration * 1000, 1) for name, duration, _ in timings},
+                'queries': metrics.queries,
+                'top_queries': metrics.top_queries(self.top_queries),
+            }, ensure_ascii=False))
+        return response
@@ -0,0 +1,136 @@
+# shop/inventory.py
+"""
+Резервирование остатков при оформлении заказа.
+
+Остаток списывается условным UPDATE: stock = stock - n только там, где
+stock >= n. Проверка и списание выполняются одной командой в БД, поэтому
+параллельные заказы не читают устаревший остаток и не продают больше, чем
+есть. Строки товаров блокируются по возрастанию id первой командой
+транзакции заказа, до вставки заказа и его позиций: два заказа с общими
+товарами берут блокировки в одном порядке. Если бы позиции вставлялись
+раньше, проверка их FK в InnoDB взяла бы на товары разделяемые блокировки,
+и повышение их до исключительных у двух заказов одного товара кончалось бы
+взаимоблокировкой (ошибка 1213). При отмене заказа остаток
+возвращается. Счётчики категорий (shop.counters) меняются после коммита,
+чтобы строка категории не блокировалась в транзакции заказа.
+"""
+from collections import Counter
+
+from django.db import models, transaction
+from django.db.models import Case, F, Sum, Value, When
+
+from . import counters
+from .models import Order, OrderItem, Product
+
+CANCELLED = 'Cancelled'
+
+
+class InsufficientStock(Exception):
+    """Не хватает остатка; shortages — {id товара: сколько есть на складе}."""
+
+    def __init__(self, shortages):
+        super().__init__(f'Недостаточно товара на складе: {shortages}')
+        self.shortages = shortages
+
+
+def item_quantities(items):
+    """{id товара: количество} по позициям заказа (словарям с product и quantity)."""
+    quantities = Counter()
+    for item in items:
+        if item.get('product') is not None:
+            quantities[item['product'].pk] += item.get('quantity', 1)
+    return dict(quantities)
+
+
+def order_quantities(order_ids):
+    rows = (
+        OrderItem.objects.filter(order_id__in=order_ids, product__isnull=False)
+        .values('product_id').annotate(quantity=Sum('quantity')).order_by()
+    )
+    return {row['product_id']: row['quantity'] for row in rows}
+
+
+def per_product(quantities):
+    # Своё количество для каждой строки в одном UPDATE
+    return Case(
+        *[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+        output_field=models.IntegerField(),
+    )
+
+
+def lock_products(ids):
+    """Блокирует строки товаров и возвращает {id: (остаток, id категории)}."""
+    # Порядок блокировок одинаковый для всех транзакций: по возрастанию id
+    rows = Product.objects.select_for_update().filter(pk__in=ids).order_by('pk').values_list('pk', 'stock', 'category_id')
+    return {pk: (stock, category_id) for pk, stock, category_id in rows}
+
+
+def update_counters(locked, quantities, sign):
+    # Остатки до изменения уже прочитаны под блокировкой: счётчики считаем без запросов
+    counters.apply_after_commit(counters.stock_changes(
+        (category_id, stock, stock + sign * quantities[pk]) for pk, (stock, category_id) in locked.items()
+    ))
+
+
+def reserve(quantities):
+    """
+    Списывает остатки {id товара: количество}. Вызывается внутри транзакции
+    заказа; если хоть одного товара не хватает, ничего не списывается и
+    бросается InsufficientStock (транзакция откатывается вызывающим).
+    """
+    if not quantities:
+        return
+    locked = lock_products(quantities)
+    stock = {pk: row[0] for pk, row in locked.items()}
+    shortages = {pk: max(stock.get(pk, 0), 0) for pk, quantity in quantities.items() if stock.get(pk, 0) < quantity}
+    if not shortages:
+        needed = per_product(quantities)
+        updated = Product.objects.filter(pk__in=quantities, stock__gte=needed).update_stock(F('stock') - needed)
+        if updated == len(quantities):
+            update_counters(locked, quantities, -1)
+            return
+        # Остаток изменился между чтением и UPDATE (БД без блокировки строк):
+        # какой именно товар кончился, уже не узнать
+        shortages = {pk: max(stock.get(pk, 0), 0) for pk in quantities}
+    raise InsufficientStock(shortages)
+
+
+def release(quantities):
+    """Возвращает остатки {id товара: количество} на склад."""
+    if not quantities:
+        return
+    locked = lock_products(quantities)
+    Product.objects.filter(pk__in=quantities).update_stock(F('stock') + per_product(quantities))
+    update_counters(locked, quantities, 1)
+
+
+@transaction.atomic
+def cancel_orders(queryset):
+    """
+    Отменяет заказы и возвращает их товары на склад. Уже отменённые заказы
+    пропускаются, поэтому остаток не вернётся дважды. Возвращает число отменённых.
+    """
+    ids = list(
+        Order.objects.filter(pk__in=list(queryset.values_list('pk', flat=True)))
+        .exclude(status=CANCELLED).select_for_update().order_by('pk').values_list('pk', flat=True)
+    )
+    if not ids:
+        return 0
+    Order.objects.filter(pk__in=ids).update(status=CANCELLED)
+    release(order_quantities(ids))
+    return len(ids)
+
+
+@transaction.atomic
+def change_status(order, status):
+    """
+    Меняет статус заказа с учётом склада: отмена возвращает остатки,
+    возврат из отмены снова их резервирует (может бросить InsufficientStock).
+    """
+    if status == CANCELLED:
+        cancel_orders(Order.objects.filter(pk=order.pk))
+    elif Order.objects.filter(pk=order.pk, status=CANCELLED).update(status=status):
+        reserve(order_quantities([order.pk]))
+    else:
+        Order.objects.filter(pk=order.pk).update(status=status)
+    order.status = status
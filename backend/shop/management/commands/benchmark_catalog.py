@@ -0,0 +1,153 @@
+"""
+Сравнение пропускной способности каталога под WSGI и ASGI при большом числе
+одновременных медленных клиентов. Всё выполняется в одном процессе без сети:
+
+- wsgi: синхронные вьюсеты через WSGIHandler в пуле из --threads потоков
+  (как gunicorn --threads): поток занят, пока клиент читает ответ;
+- asgi-sync: те же вьюсеты через ASGIHandler, каждый запрос уходит в поток;
+- asgi: асинхронные вьюхи /api/async/... (shop.async_views) через ASGIHandler.
+
+Медленный клиент — пауза --client-delay мс на передачу ответа. На настоящих
+серверах то же сравнивается так: gunicorn backend.wsgi --threads 8 и
+uvicorn backend.asgi:application под нагрузкой wrk или hey.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+from urllib.parse import urlsplit
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+
+MODES = ('wsgi', 'asgi-sync', 'asgi')
+
+
+def wsgi_request(handler, path, query, delay):
+    environ = {
+        'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '', 'PATH_INFO': path, 'QUERY_STRING': query,
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': 'localhost',
+        'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': BytesIO(), 'wsgi.errors': StringIO(),
+        'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+    statuses = []
+    response = handler(environ, lambda status, headers, exc_info=None: statuses.append(int(status[:3])))
+    try:
+        for _ in response:
+            pass
+        time.sleep(delay)  # Клиент медленно читает ответ, поток ждёт
+    finally:
+        response.close()
+    return statuses[0]
+
+
+async def asgi_request(handler, path, query, delay):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', b'localhost')], 'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+    }
+    done = asyncio.Event()
+    requested = False
+    status = None
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await done.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        elif not message.get('more_body'):
+            await asyncio.sleep(delay)  # Клиент медленно читает ответ, поток не занят
+
+    try:
+        await handler(scope, receive, send)
+    finally:
+        done.set()
+    return status
+
+
+class Command(BaseCommand):
+    help = "Сравнивает пропускную способность чтения каталога под WSGI и ASGI при медленных клиентах"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/products/', help="Путь синхронного эндпоинта, можно с ?query")
+        parser.add_argument('--requests', type=int, default=2000, help="Сколько запросов в каждом режиме")
+        parser.add_argument('--concurrency', type=int, default=200, help="Сколько клиентов одновременно")
+        parser.add_argument('--threads', type=int, default=8, help="Потоков WSGI-сервера")
+        parser.add_argument('--client-delay', type=float, default=50, help="Мс на передачу ответа клиенту")
+        parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['path'])
+        if not url.path.startswith('/api/'):
+            raise CommandError("Путь должен начинаться с /api/")
+        if min(options['requests'], options['concurrency'], options['threads']) < 1:
+            raise CommandError("--requests, --concurrency и --threads должны быть положительными")
+        delay = options['client_delay'] / 1000
+
+        self.stdout.write(
+            f"{options['requests']} запросов к {options['path']}, клиентов: {options['concurrency']}, "
+            f"пауза клиента: {options['client_delay']:g} мс, потоков WSGI: {options['threads']}"
+        )
+        self.stdout.write(f"{'Режим':<10} {'Запросов/с':>11} {'p50, мс':>9} {'p99, мс':>9} {'Ошибок':>7} {'Потоков':>8}")
+        for mode in options['modes']:
+            path = url.path.replace('/api/', '/api/async/', 1) if mode == 'asgi' else url.path
+            result = asyncio.run(self.run_mode(mode, path, url.query, delay, options))
+            self.stdout.write(
+                f"{mode:<10} {result['rps']:>11.1f} {result['p50']:>9.1f} {result['p99']:>9.1f} "
+                f"{result['errors']:>7} {result['threads']:>8}"
+            )
+
+    async def run_mode(self, mode, path, query, delay, options):
+        if mode == 'wsgi':
+            handler = WSGIHandler()
+            pool = ThreadPoolExecutor(max_workers=options['threads'])
+            loop = asyncio.get_running_loop()
+
+            def request():
+                return loop.run_in_executor(pool, wsgi_request, handler, path, query, delay)
+        else:
+            handler = ASGIHandler()
+            pool = None
+
+            def request():
+                return asgi_request(handler, path, query, delay)
+
+        # Прогрев: соединения с БД и кэш ответа
+        await request()
+        slots = asyncio.Semaphore(options['concurrency'])
+        latencies, errors, peak_threads = [], 0, threading.active_count()
+
+        async def client():
+            nonlocal errors, peak_threads
+            async with slots:
+                started = time.perf_counter()
+                status = await request()
+                latencies.append(time.perf_counter() - started)
+                errors += status >= 400
+                peak_threads = max(peak_threads, threading.active_count())
+
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(client() for _ in range(options['requests'])))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        return {
+            'rps': len(latencies) / elapsed,
+            'p50': latencies[len(latencies) // 2] * 1000,
+            'p99': latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000,
+            'errors': errors,
+            'threads': peak_threads,
+        }
@@ -0,0 +1,108 @@
+"""
+Пропускная способность оформления заказов при конкуренции за остатки.
+
+Заказы оформляются через OrderSerializer (проверка, резерв остатков,
+запись заказа и позиций) из --threads потоков в четырёх сценариях:
+
+- serial: один поток, один товар — базовая линия;
+- hot-sku: все потоки покупают один и тот же товар;
+- shared-category: у каждого потока свой товар, все в одной категории;
+- separate-categories: у каждого потока свой товар в своей категории.
+
+Сравнение с serial показывает, сколько стоит ожидание блокировок строк
+товаров и категорий. Смысл замеры имеют на MySQL: SQLite блокирует всю базу.
+Команда создаёт свои категории, товары и заказы и удаляет их по окончании,
+поэтому запускайте её на копии базы, а не на продакшене.
+"""
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+
+from shop.models import Category, Order, Product
+from shop.serializers import OrderSerializer
+
+SCENARIOS = ('serial', 'hot-sku', 'shared-category', 'separate-categories')
+
+
+class Command(BaseCommand):
+    help = "Сравнивает пропускную способность оформления заказов при общих товарах и категориях"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help="Сколько покупателей одновременно")
+        parser.add_argument('--orders', type=int, default=20, help="Сколько заказов оформляет каждый покупатель")
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+
+    def handle(self, *args, **options):
+        if min(options['threads'], options['orders']) < 1:
+            raise CommandError("--threads и --orders должны быть положительными")
+        self.categories, self.products, self.order_ids = [], [], []
+        self.stdout.write(f"Потоков: {options['threads']}, заказов на поток: {options['orders']}, БД: {connection.vendor}")
+        self.stdout.write(f"{'Сценарий':<20} {'Заказов/с':>10} {'К serial':>9} {'Ошибок':>7}")
+        baseline = None
+        try:
+            for scenario in options['scenarios']:
+                rate, errors = self.run_scenario(scenario, options['threads'], options['orders'])
+                if scenario == 'serial':
+                    baseline = rate
+                ratio = f'{rate / baseline:.2f}' if baseline else '—'
+                self.stdout.write(f"{scenario:<20} {rate:>10.1f} {ratio:>9} {errors:>7}")
+        finally:
+            self.cleanup()
+
+    def create_products(self, count, categories):
+        categories = [Category.objects.create(name=f'benchmark_checkout {i}') for i in range(categories)]
+        self.categories.extend(categories)
+        products = [
+            Product.objects.create(
+                name=f'benchmark_checkout {len(self.products) + i}', category=categories[i % len(categories)],
+                base_price=100, stock=10 ** 6,
+            )
+            for i in range(count)
+        ]
+        self.products.extend(products)
+        return products
+
+    def run_scenario(self, scenario, threads, orders):
+        if scenario == 'serial':
+            threads, products = 1, self.create_products(1, 1)
+        elif scenario == 'hot-sku':
+            products = self.create_products(1, 1)
+        elif scenario == 'shared-category':
+            products = self.create_products(threads, 1)
+        else:
+            products = self.create_products(threads, threads)
+        created, errors = [], []
+        start = threading.Barrier(threads)
+
+        def buyer(product):
+            payload = {'customer_name': 'benchmark_checkout', 'address': '-', 'delivery': 'standard',
+                       'order_items': [{'product': product.pk, 'quantity': 1}]}
+            try:
+                start.wait()
+                for _ in range(orders):
+                    serializer = OrderSerializer(data=payload)
+                    try:
+                        serializer.is_valid(raise_exception=True)
+                        created.append(serializer.save().pk)
+                    except DatabaseError as error:
+                        # На MySQL так выглядит взаимоблокировка (1213) или таймаут ожидания блокировки
+                        errors.append(error)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=buyer, args=(products[i % len(products)],)) for i in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        self.order_ids.extend(created)
+        return len(created) / elapsed, len(errors)
+
+    def cleanup(self):
+        Order.objects.filter(pk__in=self.order_ids).delete()
+        Product.objects.filter(pk__in=[product.pk for product in self.products]).delete()
+        Category.objects.filter(pk__in=[category.pk for category in self.categories]).delete()
@@ -0,0 +1,26 @@
+import os
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from shop import media
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = "Создаёт сжатые копии (.gz, .br) для уже загруженных 3D-моделей"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Пересоздать существующие копии")
+
+    def handle(self, *args, **options):
+        names = Product.objects.exclude(model_3d='').exclude(model_3d__isnull=True).values_list('model_3d', flat=True).distinct()
+        count = 0
+        for name in names.iterator():
+            if not default_storage.exists(name):
+                continue
+            if not options['force'] and os.path.exists(default_storage.path(name) + '.gz'):
+                continue
+            media.compress_model_sidecars(name)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"Сжато моделей: {count}"))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from shop.exports import CHUNK_SIZE, order_rows, product_rows, write_csv
+from shop.models import Order, Product
+
+
+class Command(BaseCommand):
+    help = "Потоковая выгрузка товаров или заказов в CSV (для больших объёмов, без веб-запроса)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=['products', 'orders'])
+        parser.add_argument('-o', '--output', help="Файл для записи (по умолчанию stdout)")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Сколько строк читать из БД за раз")
+
+    def handle(self, *args, **options):
+        if options['model'] == 'products':
+            rows = product_rows(Product.objects.all(), options['chunk_size'])
+        else:
+            rows = order_rows(Order.objects.all(), options['chunk_size'])
+
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as file:
+                count = write_csv(rows, file)
+            self.stderr.write(self.style.SUCCESS(f"Выгружено строк: {count} -> {options['output']}"))
+        else:
+            write_csv(rows, self.stdout)
@@ -0,0 +1,44 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from shop import images
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = "Создаёт уменьшенные копии изображений товаров, у которых их ещё нет (параллельно в нескольких процессах)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Число процессов (1 — без пула)")
+        parser.add_argument('--force', action='store_true', help="Пересоздать копии для всех изображений")
+        parser.add_argument('--batch-size', type=int, default=200, help="Сколько товаров сохранять одним bulk_update")
+
+    def handle(self, *args, **options):
+        rows = Product.objects.exclude(image='').exclude(image__isnull=True).values_list('id', 'image', 'image_variants')
+        pending = [
+            (pk, name, None if options['force'] else variants)
+            for pk, name, variants in rows.iterator()
+            if options['force'] or (variants or {}).get('source') != name
+        ]
+        if not pending:
+            self.stdout.write("Все изображения уже обработаны.")
+            return
+
+        names = [name for _, name, _ in pending]
+        old_variants = [variants for _, _, variants in pending]
+        if options['workers'] > 1:
+            # Рабочие процессы работают только с файлами; соединения с БД не должны
+            # достаться им по наследству при fork
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=images.init_worker) as executor:
+                results = list(executor.map(images.refresh_variants, names, old_variants, chunksize=4))
+        else:
+            results = list(map(images.refresh_variants, names, old_variants))
+
+        products = [Product(pk=pk, image_variants=variants) for (pk, _, _), variants in zip(pending, results)]
+        Product.objects.bulk_update(products, ['image_variants'], batch_size=options['batch_size'])
+        failed = sum(1 for variants in results if not variants)
+        self.stdout.write(self.style.SUCCESS(f"Обработано изображений: {len(results) - failed}, с ошибкой: {failed}"))
@@ -0,0 +1,35 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.importer import BATCH_SIZE, import_catalog
+
+
+class Command(BaseCommand):
+    help = "Импорт товаров из CSV или JSON Lines пачками (сопоставление по sku)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Файл для импорта или '-' для stdin")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="По умолчанию — по расширению файла")
+        parser.add_argument('--delimiter', default=',', help="Разделитель колонок CSV")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Сколько строк записывать за раз")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        try:
+            file = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        except OSError as error:
+            raise CommandError(error)
+        with file:
+            report = import_catalog(file, format, options['delimiter'], options['batch_size'])
+
+        for error in report['errors']:
+            row = f"строка {error['row']}" if error['row'] else 'совместимость'
+            self.stderr.write(f"{row} ({error['sku'] or 'без sku'}): {error['error']}")
+        if report['error_count'] > len(report['errors']):
+            self.stderr.write(f"... и ещё {report['error_count'] - len(report['errors'])} ошибок")
+        self.stdout.write(self.style.SUCCESS(
+            f"Создано: {report['created']}, обновлено: {report['updated']}, "
+            f"без изменений: {report['unchanged']}, ошибок: {report['error_count']}"
+        ))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from shop.analytics import rebuild
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает сводные таблицы продаж по заказам (заполнение по старым данным)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="Пересчитать только с этой даты (ГГГГ-ММ-ДД)")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Сколько заказов обрабатывать за раз")
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_date(options['since'])
+            if since is None:
+                raise CommandError("Дата в формате ГГГГ-ММ-ДД")
+        count = rebuild(since, options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Учтено заказов: {count}"))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from shop.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает счётчики товаров в категориях и исправляет расхождения"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Только показать расхождения")
+
+    def handle(self, *args, **options):
+        fixed = reconcile(dry_run=options['dry_run'])
+        for category, drift in fixed:
+            changes = ', '.join(f"{name}: {old} -> {new}" for name, (old, new) in drift.items())
+            self.stdout.write(f"{category.name} (id {category.pk}): {changes}")
+        verb = "Найдено расхождений" if options['dry_run'] else "Исправлено категорий"
+        self.stdout.write(self.style.SUCCESS(f"{verb}: {len(fixed)}"))
@@ -0,0 +1,185 @@
+# shop/media.py
+"""
+Отдача 3D-моделей (.glb) из MEDIA_ROOT/3d_models/ в том числе в продакшене.
+
+- HTTP Range: просмотрщик может грузить файл частями и докачивать после обрыва.
+- Сжатые копии .gz/.br создаются при загрузке модели и отдаются по
+  Accept-Encoding (только целиком: диапазоны считаются по исходному файлу).
+- Сильный ETag по размеру и времени изменения файла, долгий Cache-Control.
+- За nginx/apache саму передачу можно отдать серверу: MODEL_3D_SENDFILE =
+  'nginx' (X-Accel-Redirect) или 'apache' (X-Sendfile).
+"""
+import gzip
+import logging
+import mimetypes
+import os
+import re
+import shutil
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен: без него остаётся gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+MODEL_DIR = '3d_models'
+CHUNK_SIZE = 64 * 1024
+
+# Расширение копии -> Content-Encoding, в порядке предпочтения
+ENCODINGS = (('.br', 'br'), ('.gz', 'gzip'))
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+mimetypes.add_type('model/gltf-binary', '.glb')
+mimetypes.add_type('model/gltf+json', '.gltf')
+
+
+def compress_sidecars(name, storage=default_storage):
+    """Создаёт name.gz и (если установлен brotli) name.br рядом с файлом модели."""
+    path = storage.path(name)
+    with open(path, 'rb') as source, gzip.open(f'{path}.gz', 'wb', compresslevel=9) as target:
+        shutil.copyfileobj(source, target, CHUNK_SIZE)
+    if brotli is not None:
+        compressor = brotli.Compressor(quality=9)
+        with open(path, 'rb') as source, open(f'{path}.br', 'wb') as target:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                target.write(compressor.process(chunk))
+            target.write(compressor.finish())
+
+
+def compress_model_sidecars(name, storage=default_storage):
+    # Без сжатых копий модель всё равно отдаётся, поэтому ошибка не мешает сохранению
+    try:
+        compress_sidecars(name, storage)
+    except (OSError, NotImplementedError):
+        logger.warning('Не удалось создать сжатые копии %s', name, exc_info=True)
+
+
+def file_etag(stat, suffix=''):
+    # Сильный ETag: у каждого представления (исходник, gzip, br) свой
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}{suffix}"'
+
+
+def parse_range(header, size):
+    """
+    (start, end) включительно для одного диапазона, None — отдать файл целиком
+    (нет заголовка, несколько диапазонов или неизвестный формат), 'invalid' —
+    диапазон за пределами файла.
+    """
+    match = RANGE_RE.match(header or '')
+    if not match or not any(match.groups()):
+        return None
+    start, end = match.groups()
+    if not start:
+        # bytes=-500: последние 500 байт
+        length = int(end)
+        if length == 0:
+            return 'invalid'
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        return 'invalid'
+    return start, end
+
+
+def read_chunks(path, start, length):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def if_range_matches(request, etag, last_modified):
+    value = request.headers.get('If-Range')
+    if not value:
+        return True
+    if value.startswith('"') or value.startswith('W/'):
+        return value == etag
+    return parse_http_date_safe(value) == int(last_modified)
+
+
+def choose_encoding(request, path):
+    accepted = {part.split(';')[0].strip() for part in request.headers.get('Accept-Encoding', '').split(',')}
+    for extension, encoding in ENCODINGS:
+        if encoding in accepted and os.path.exists(path + extension):
+            return path + extension, encoding
+    return path, None
+
+
+@require_safe
+def serve_model_3d(request, path):
+    try:
+        full_path = safe_join(os.path.join(settings.MEDIA_ROOT, MODEL_DIR), path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path) or full_path.endswith(('.gz', '.br')):
+        raise Http404
+
+    range_header = request.headers.get('Range')
+    # Диапазоны — только по исходному файлу, сжатую копию отдаём целиком
+    served_path, encoding = (full_path, None) if range_header else choose_encoding(request, full_path)
+    stat = os.stat(served_path)
+    etag = file_etag(stat, f'-{encoding}' if encoding else '')
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+
+    if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+        response = HttpResponseNotModified()
+    else:
+        byte_range = parse_range(range_header, stat.st_size)
+        if byte_range is not None and not if_range_matches(request, etag, stat.st_mtime):
+            byte_range = None
+        if byte_range == 'invalid':
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+        response = build_response(request, served_path, stat, byte_range)
+        response['Content-Type'] = content_type
+        if encoding:
+            response['Content-Encoding'] = encoding
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = f'public, max-age={settings.MODEL_3D_CACHE_MAX_AGE}'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def build_response(request, path, stat, byte_range):
+    sendfile = settings.MODEL_3D_SENDFILE
+    if sendfile:
+        # Диапазоны и саму передачу файла выполнит веб-сервер
+        response = HttpResponse()
+        relative = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+        if sendfile == 'nginx':
+            response['X-Accel-Redirect'] = settings.MODEL_3D_ACCEL_PREFIX + relative
+        else:
+            response['X-Sendfile'] = path
+        return response
+
+    if byte_range is None:
+        start, end, status = 0, stat.st_size - 1, 200
+    else:
+        (start, end), status = byte_range, 206
+    length = end - start + 1
+    body = read_chunks(path, start, length) if request.method != 'HEAD' else iter(())
+    response = StreamingHttpResponse(body, status=status)
+    response['Content-Length'] = str(length)
+    if status == 206:
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    return response
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:02
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import F, Value
+from django.db.models.functions import Round
+
+
+def fill_final_price(apps, schema_editor):
+    Product = apps.get_model('shop', 'Product')
+    Product.objects.update(final_price=Round(
+        F('base_price') * (Value(100) - F('discount')) * Value(Decimal('0.01')),
+        2,
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_product_created_at_catalog_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='final_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, help_text='Цена с учетом скидки', max_digits=10),
+        ),
+        migrations.RunPython(fill_final_price, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['final_price', 'id'], name='product_final_price_idx'),
+        ),
+    ]
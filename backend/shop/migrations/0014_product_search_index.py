@@ -0,0 +1,71 @@
+from django.db import migrations
+
+# DDL на момент миграции. Текущая версия — в shop.search, её при каждом
+# migrate восстанавливает обработчик post_migrate (ensure_search_index)
+
+SQLITE_TABLE = """
+CREATE VIRTUAL TABLE IF NOT EXISTS shop_product_fts USING fts5(
+    name, description,
+    content='shop_product', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+)
+"""
+
+SQLITE_TRIGGERS = {
+    'shop_product_fts_ai': """
+CREATE TRIGGER IF NOT EXISTS shop_product_fts_ai AFTER INSERT ON shop_product BEGIN
+    INSERT INTO shop_product_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+END
+""",
+    'shop_product_fts_ad': """
+CREATE TRIGGER IF NOT EXISTS shop_product_fts_ad AFTER DELETE ON shop_product BEGIN
+    INSERT INTO shop_product_fts(shop_product_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+END
+""",
+    'shop_product_fts_au': """
+CREATE TRIGGER IF NOT EXISTS shop_product_fts_au AFTER UPDATE OF name, description ON shop_product BEGIN
+    INSERT INTO shop_product_fts(shop_product_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+    INSERT INTO shop_product_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+END
+""",
+}
+
+
+def install_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute(SQLITE_TABLE)
+        for sql in SQLITE_TRIGGERS.values():
+            schema_editor.execute(sql)
+        schema_editor.execute("INSERT INTO shop_product_fts(shop_product_fts) VALUES ('rebuild')")
+    elif connection.vendor == 'mysql':
+        # Индекс мог уже создать post_migrate предыдущего migrate
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM information_schema.statistics "
+                "WHERE table_schema = DATABASE() AND table_name = 'shop_product' AND index_name = 'product_fulltext_idx'"
+            )
+            exists = cursor.fetchone() is not None
+        if not exists:
+            schema_editor.execute("ALTER TABLE shop_product ADD FULLTEXT INDEX product_fulltext_idx (name, description)")
+
+
+def uninstall_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        for name in SQLITE_TRIGGERS:
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        schema_editor.execute("DROP TABLE IF EXISTS shop_product_fts")
+    elif connection.vendor == 'mysql':
+        schema_editor.execute("ALTER TABLE shop_product DROP INDEX product_fulltext_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0013_product_final_price'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0015_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Название товара на момент заказа', max_length=200)),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('unit_price', models.DecimalField(decimal_places=2, default=0, help_text='Цена за единицу на момент заказа', max_digits=10)),
+                ('options', models.ManyToManyField(blank=True, help_text='Выбранные комплектующие', to='shop.componentoption')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_items', to='shop.order')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_items', to='shop.product')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,97 @@
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import migrations
+
+CHUNK_SIZE = 500
+
+
+def parse_items_text(text):
+    # Копия shop.orders.parse_items_text на момент миграции: дальнейшие правки
+    # парсера не должны менять то, как переносятся старые заказы
+    if not text or not text.strip():
+        return []
+    try:
+        data = json.loads(text)
+    except (json.JSONDecodeError, TypeError):
+        data = [part.strip() for part in text.split(',') if part.strip()]
+    if not isinstance(data, list):
+        data = [data]
+
+    items = []
+    for entry in data:
+        if isinstance(entry, dict):
+            try:
+                quantity = max(int(entry.get('quantity') or 1), 1)
+            except (TypeError, ValueError):
+                quantity = 1
+            try:
+                price = Decimal(str(entry['price'])) if entry.get('price') not in (None, '') else None
+            except InvalidOperation:
+                price = None
+            if price is not None and not price.is_finite():
+                # NaN и Infinity не записать в DecimalField
+                price = None
+            product_id = entry.get('product') or entry.get('product_id') or entry.get('id')
+            items.append({
+                'name': str(entry.get('name') or '')[:200],
+                'quantity': quantity,
+                'price': price,
+                'product_id': product_id if isinstance(product_id, int) else None,
+            })
+        elif entry not in (None, ''):
+            items.append({'name': str(entry)[:200], 'quantity': 1, 'price': None, 'product_id': None})
+    return items
+
+
+def convert_order_items(apps, schema_editor):
+    # Переносим текст Order.items в OrderItem порциями, чтобы не держать в памяти всю таблицу
+    Order = apps.get_model('shop', 'Order')
+    OrderItem = apps.get_model('shop', 'OrderItem')
+    Product = apps.get_model('shop', 'Product')
+
+    last_id = 0
+    while True:
+        orders = list(
+            Order.objects.filter(id__gt=last_id).exclude(items='')
+            .order_by('id').values_list('id', 'items')[:CHUNK_SIZE]
+        )
+        if not orders:
+            break
+        last_id = orders[-1][0]
+        converted = set(OrderItem.objects.filter(order_id__in=[pk for pk, _ in orders]).values_list('order_id', flat=True))
+        parsed = [(pk, parse_items_text(text)) for pk, text in orders if pk not in converted]
+
+        ids = {item['product_id'] for _, items in parsed for item in items if item['product_id']}
+        names = {item['name'] for _, items in parsed for item in items if not item['product_id'] and item['name']}
+        products = {p.id: p for p in Product.objects.filter(id__in=ids).only('id', 'name', 'final_price')}
+        by_name = {}
+        for product in Product.objects.filter(name__in=names).only('id', 'name', 'final_price'):
+            by_name.setdefault(product.name, product)
+
+        rows = []
+        for order_id, items in parsed:
+            for item in items:
+                product = products.get(item['product_id']) or by_name.get(item['name'])
+                price = item['price']
+                if price is None:
+                    price = product.final_price if product else 0
+                rows.append(OrderItem(
+                    order_id=order_id,
+                    product_id=product.id if product else None,
+                    name=item['name'] or (product.name if product else ''),
+                    quantity=item['quantity'],
+                    unit_price=price,
+                ))
+        OrderItem.objects.bulk_create(rows, batch_size=CHUNK_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0016_orderitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(convert_order_items, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:07
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('shop', '0017_convert_order_items'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('old_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('new_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('reason', models.CharField(blank=True, help_text='Описание изменения, например «+10%»', max_length=200)),
+                ('changed_at', models.DateTimeField(auto_now_add=True)),
+                ('changed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('component', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='price_changes', to='shop.componentoption')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='price_changes', to='shop.product')),
+            ],
+            options={
+                'ordering': ['-changed_at'],
+            },
+        ),
+    ]
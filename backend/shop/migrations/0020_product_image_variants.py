@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0019_catalog_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Уменьшенные копии изображения (shop.images)'),
+        ),
+    ]
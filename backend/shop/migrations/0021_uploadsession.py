@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:22
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('shop', '0020_product_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('field', models.CharField(choices=[('image', 'Изображение'), ('model_3d', '3D модель')], max_length=20)),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField(help_text='Размер файла в байтах')),
+                ('sha256', models.CharField(blank=True, help_text='Контрольная сумма всего файла (необязательно)', max_length=64)),
+                ('received', models.BigIntegerField(default=0, help_text='Сколько байт уже записано')),
+                ('writing_since', models.DateTimeField(blank=True, help_text='Когда начата запись текущей части', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='upload_sessions', to='shop.product')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
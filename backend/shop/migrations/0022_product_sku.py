@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0021_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='sku',
+            field=models.CharField(blank=True, help_text='Артикул поставщика (ключ для импорта каталога)', max_length=64, null=True, unique=True),
+        ),
+    ]
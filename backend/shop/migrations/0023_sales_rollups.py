@@ -0,0 +1,72 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0022_product_sku'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSalesDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('status', models.CharField(choices=[('Pending', 'Ожидает обработки'), ('Shipped', 'Отправлен'), ('Delivered', 'Доставлен'), ('Cancelled', 'Отменён')], max_length=20)),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'ordering': ['date', 'product'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SalesDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('Pending', 'Ожидает обработки'), ('Shipped', 'Отправлен'), ('Delivered', 'Доставлен'), ('Cancelled', 'Отменён')], max_length=20)),
+                ('delivery', models.CharField(max_length=50)),
+                ('orders', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('date', models.DateField()),
+            ],
+            options={
+                'ordering': ['date', 'status', 'delivery'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SalesHourly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('Pending', 'Ожидает обработки'), ('Shipped', 'Отправлен'), ('Delivered', 'Доставлен'), ('Cancelled', 'Отменён')], max_length=20)),
+                ('delivery', models.CharField(max_length=50)),
+                ('orders', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('hour', models.DateTimeField()),
+            ],
+            options={
+                'ordering': ['hour', 'status', 'delivery'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='saleshourly',
+            constraint=models.UniqueConstraint(fields=('hour', 'status', 'delivery'), name='saleshourly_key'),
+        ),
+        migrations.AddConstraint(
+            model_name='salesdaily',
+            constraint=models.UniqueConstraint(fields=('date', 'status', 'delivery'), name='salesdaily_key'),
+        ),
+        migrations.AddField(
+            model_name='productsalesdaily',
+            name='product',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='shop.product'),
+        ),
+        migrations.AddConstraint(
+            model_name='productsalesdaily',
+            constraint=models.UniqueConstraint(fields=('date', 'product', 'status'), name='productsalesdaily_key'),
+        ),
+    ]
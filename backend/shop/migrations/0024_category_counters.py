@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:44
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def fill_counters(apps, schema_editor):
+    # Начальные значения одним GROUP BY, дальше их поддерживает shop.counters
+    Category = apps.get_model('shop', 'Category')
+    Product = apps.get_model('shop', 'Product')
+    rows = Product.objects.values('category_id').annotate(
+        product_count=Count('id'),
+        in_stock_count=Count('id', filter=Q(stock__gt=0)),
+        total_stock=Sum('stock'),
+        catalog_value=Sum('base_price'),
+    ).order_by()
+    for row in rows:
+        Category.objects.filter(pk=row.pop('category_id')).update(**row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0023_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='catalog_value',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, help_text='Сумма базовых цен товаров', max_digits=14, verbose_name='Общая стоимость'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='in_stock_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='В наличии'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='product_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Количество товаров'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='total_stock',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Общий запас'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
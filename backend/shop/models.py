@@ -1,11 +1,91 @@
-from django.db import models
+from decimal import Decimal, ROUND_HALF_UP
+import uuid
+
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Round
+from django.utils import timezone
+
+from . import analytics, catalog_cache, compatibility, counters, images, media
+
+
+class CatalogQuerySet(models.QuerySet):
+    # Массовые операции не отправляют сигналы и не трогают auto_now,
+    # поэтому updated_at и кэш каталога обновляем здесь
+    def update(self, **kwargs):
+        kwargs.setdefault('updated_at', timezone.now())
+        updated = super().update(**kwargs)
+        catalog_cache.invalidate_model(self.model)
+        return updated
+
+    def bulk_create(self, objs, *args, **kwargs):
+        created = super().bulk_create(objs, *args, **kwargs)
+        catalog_cache.invalidate_model(self.model)
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        now = timezone.now()
+        for obj in objs:
+            obj.updated_at = now
+        if 'updated_at' not in fields:
+            fields = [*fields, 'updated_at']
+        updated = super().bulk_update(objs, fields, *args, **kwargs)
+        catalog_cache.invalidate_model(self.model)
+        return updated
+
+
+class DependentProductsQuerySet(CatalogQuerySet):
+    # Категория и комплектующие входят в ответ API по товару, поэтому
+    # массовое изменение полей из product_fields сдвигает updated_at связанных товаров
+    product_lookup = None
+    product_fields = ()
+
+    def update(self, **kwargs):
+        if not set(self.product_fields).intersection(kwargs):
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            # Товары отбираем подзапросом до изменения: оно может затронуть условия фильтра
+            Product.objects.filter(**{f'{self.product_lookup}__in': self.values('pk')}).update(updated_at=timezone.now())
+            return super().update(**kwargs)
+
+
+class CategoryQuerySet(DependentProductsQuerySet):
+    product_lookup = 'category'
+    product_fields = ('name',)  # category_name
+
+
+class ComponentOptionQuerySet(DependentProductsQuerySet):
+    product_lookup = 'components'
+    product_fields = ('name', 'price', 'volume')  # ComponentOptionSerializer
+
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # Поддерживаются приращениями при изменении товаров (shop.counters)
+    product_count = models.IntegerField("Количество товаров", default=0, editable=False)
+    in_stock_count = models.IntegerField("В наличии", default=0, editable=False)
+    total_stock = models.IntegerField("Общий запас", default=0, editable=False)
+    catalog_value = models.DecimalField("Общая стоимость", max_digits=14, decimal_places=2, default=0, editable=False, help_text="Сумма базовых цен товаров")
+
+    objects = CategoryQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if self._state.adding or self.pk is None:
+            # Новая категория (в том числе копия существующей) ещё без товаров
+            for name in counters.COUNTER_FIELDS:
+                setattr(self, name, 0)
+        elif kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            # Счётчики в памяти могли устареть: их меняют только приращения
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in counters.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = ['name']  # Добавляем сортировку по умолчанию
 
@@ -25,6 +105,9 @@ class ComponentOption(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2, default=0, help_text="Дополнительная стоимость")
     volume = models.CharField(max_length=50, blank=True, null=True, help_text="Объем/характеристика (например, 16GB)")
     type = models.CharField(max_length=50, choices=COMPONENT_TYPES, default='other', help_text="Тип комплектующего")
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = ComponentOptionQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.name} ({self.volume})" if self.volume else self.name
@@ -33,6 +116,111 @@ class ComponentOption(models.Model):
         ordering = ['type', 'name']  # Добавляем сортировку по умолчанию
 
 
+PRICE_FIELDS = ('base_price', 'discount')
+
+
+def calculate_final_price(base_price, discount):
+    base_price = Decimal(base_price or 0)
+    if not discount:
+        return base_price.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    return (base_price * (100 - discount) / 100).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def final_price_expression(base_price=None, discount=None):
+    # SQL-версия calculate_final_price. Умножаем на 0.01, а не делим на 100,
+    # чтобы SQLite не выполнял целочисленное деление
+    base_price = F('base_price') if base_price is None else base_price
+    discount = F('discount') if discount is None else discount
+    return Round(
+        base_price * (Value(100) - discount) * Value(Decimal('0.01')),
+        2,
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+    )
+
+
+class ProductQuerySet(CatalogQuerySet):
+    def update(self, **kwargs):
+        # final_price должен меняться вместе с ценой и скидкой и при массовом update().
+        # Ставим его первым: MySQL вычисляет SET слева направо с уже новыми значениями
+        if any(field in kwargs for field in PRICE_FIELDS) and 'final_price' not in kwargs:
+            kwargs = {
+                'final_price': final_price_expression(kwargs.get('base_price'), kwargs.get('discount')),
+                **kwargs,
+            }
+        if counters.TRACKED_FIELDS.intersection(kwargs):
+            # Категория, остаток и цена входят в счётчики категорий
+            with counters.tracking(self.values_list('pk', flat=True)):
+                updated = super().update(**kwargs)
+        else:
+            updated = super().update(**kwargs)
+        if 'component_type' in kwargs:
+            catalog_cache.invalidate(compatibility.NAMESPACE)
+        return updated
+
+    def update_stock(self, stock):
+        """
+        Меняет остаток без counters.tracking: shop.inventory сам считает
+        изменение счётчиков категорий и прибавляет его после коммита.
+        """
+        return super().update(stock=stock)
+
+    def delete(self):
+        with counters.tracking(self.values_list('pk', flat=True)):
+            return super().delete()
+
+    def bulk_create(self, objs, *args, **kwargs):
+        for obj in objs:
+            obj.final_price = calculate_final_price(obj.base_price, obj.discount)
+        with transaction.atomic(savepoint=False):
+            created = super().bulk_create(objs, *args, **kwargs)
+            counters.record(created)
+        # Граф совместимости в памяти не видит новые товары без сигналов
+        catalog_cache.invalidate(compatibility.NAMESPACE)
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if any(field in fields for field in PRICE_FIELDS):
+            for obj in objs:
+                obj.final_price = calculate_final_price(obj.base_price, obj.discount)
+            if 'final_price' not in fields:
+                fields = [*fields, 'final_price']
+        if counters.TRACKED_FIELDS.intersection(fields):
+            with counters.tracking(obj.pk for obj in objs):
+                updated = super().bulk_update(objs, fields, *args, **kwargs)
+        else:
+            updated = super().bulk_update(objs, fields, *args, **kwargs)
+        if 'component_type' in fields:
+            catalog_cache.invalidate(compatibility.NAMESPACE)
+        return updated
+
+    # Колонки, которые можно не читать, если поле не запрошено. Поля, по которым
+    # сортирует каталог, не откладываем: их читает постраничный вывод по ключу
+    DEFERRABLE_FIELDS = ('description', 'image', 'image_variants', 'model_3d', 'brand')
+
+    def for_catalog(self, fields=None):
+        """
+        Запрос под набор полей сериализатора (None — все поля). JOIN для
+        категории и по одному запросу на каждую M2M-связь, независимо от
+        количества товаров на странице; ненужные связи и тяжёлые колонки не читаются.
+        """
+        fields = None if fields is None else set(fields)
+        queryset = self
+        if fields is None or 'category_name' in fields:
+            queryset = queryset.select_related('category')
+        if fields is None or 'components' in fields:
+            queryset = queryset.prefetch_related('components')
+        if fields is None or 'compatible_with' in fields:
+            queryset = queryset.prefetch_related(models.Prefetch(
+                'compatible_with',
+                queryset=Product.objects.only('id').order_by(),
+            ))
+        if fields is not None:
+            deferred = [name for name in self.DEFERRABLE_FIELDS if name not in fields]
+            if deferred:
+                queryset = queryset.defer(*deferred)
+        return queryset
+
+
 class Product(models.Model):
     COMPONENT_TYPES = (
         ('cpu', 'Процессор'),
@@ -45,23 +233,107 @@ class Product(models.Model):
         ('other', 'Другое'),
     )
     name = models.CharField(max_length=200)
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True, help_text="Артикул поставщика (ключ для импорта каталога)")
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     base_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, help_text="Базовая цена без учета комплектующих")
     description = models.TextField(blank=True, null=True)
     image = models.ImageField(upload_to='products/', null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False, help_text="Уменьшенные копии изображения (shop.images)")
     model_3d = models.FileField(upload_to='3d_models/', null=True, blank=True, help_text="3D модель в формате .glb")
     stock = models.IntegerField(default=0)
     discount = models.IntegerField(default=0, help_text="Скидка в процентах (0-100)")
+    final_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False, help_text="Цена с учетом скидки")
     component_type = models.CharField(max_length=50, choices=COMPONENT_TYPES, default='other')
     components = models.ManyToManyField(ComponentOption, blank=True, help_text="Доступные комплектующие")
     compatible_with = models.ManyToManyField('self', symmetrical=False, blank=True, help_text="Совместимые комплектующие")
     brand = models.CharField(max_length=100, blank=True, null=True, help_text="Бренд продукта")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = ProductQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Тип, записанный в БД: граф совместимости сбрасывается, только если он изменился
+        if 'component_type' in field_names:
+            instance.saved_component_type = instance.component_type
+        return instance
+
+    def save(self, *args, **kwargs):
+        self.final_price = calculate_final_price(self.base_price, self.discount)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and any(field in update_fields for field in PRICE_FIELDS):
+            kwargs['update_fields'] = update_fields = {*update_fields, 'final_price'}
+        if update_fields is None or 'image' in update_fields:
+            self.update_image_variants()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'image_variants'}
+        if self.model_3d and not self.model_3d._committed:
+            # Сжатые копии .gz/.br для отдачи через shop.media делаем один раз, при загрузке
+            self.model_3d.save(self.model_3d.name, self.model_3d.file, save=False)
+            media.compress_model_sidecars(self.model_3d.name)
+        if self.pk is None:
+            with transaction.atomic(savepoint=False):
+                super().save(*args, **kwargs)
+                counters.record([self])
+        elif update_fields is None or counters.TRACKED_FIELDS.intersection(update_fields):
+            with counters.tracking([self.pk]):
+                super().save(*args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with counters.tracking([self.pk]):
+            return super().delete(*args, **kwargs)
+
+    def update_image_variants(self):
+        # Файл нового изображения сохраняем сразу (обычно это делает pre_save поля),
+        # чтобы нарезать копии до записи товара и обойтись одним UPDATE
+        if self.image and not self.image._committed:
+            self.image.save(self.image.name, self.image.file, save=False)
+        self.image_variants = images.refresh_variants(self.image.name if self.image else None, self.image_variants)
+
     class Meta:
         ordering = ['name']  # Добавляем сортировку по умолчанию
+        indexes = [
+            # Индексы под фильтры и сортировки каталога (/api/products/)
+            models.Index(fields=['category', 'name'], name='product_category_name_idx'),
+            models.Index(fields=['component_type', 'name'], name='product_type_name_idx'),
+            models.Index(fields=['brand', 'name'], name='product_brand_name_idx'),
+            models.Index(fields=['base_price', 'id'], name='product_price_idx'),
+            models.Index(fields=['final_price', 'id'], name='product_final_price_idx'),
+            # Составные индексы для постраничного вывода по ключу (shop.pagination.KeysetPagination)
+            # по каждому полю ProductOrderingFilter.ordering_fields; (stock, id) служит и фильтру in_stock
+            models.Index(fields=['name', 'id'], name='product_name_id_idx'),
+            models.Index(fields=['created_at', 'id'], name='product_created_id_idx'),
+            models.Index(fields=['stock', 'id'], name='product_stock_id_idx'),
+            models.Index(fields=['discount', 'id'], name='product_discount_id_idx'),
+        ]
+
+
+class OrderQuerySet(models.QuerySet):
+    # Массовые операции не проходят через Order.save, поэтому сводки продаж
+    # (shop.analytics) пересчитываем здесь по затронутым заказам
+    TRACKED_FIELDS = {'status', 'delivery', 'total', 'created_at'}
+
+    def update(self, **kwargs):
+        if not self.TRACKED_FIELDS.intersection(kwargs):
+            return super().update(**kwargs)
+        with analytics.tracking(self.values_list('pk', flat=True)):
+            return super().update(**kwargs)
+
+    def delete(self):
+        with analytics.tracking(self.values_list('pk', flat=True)):
+            return super().delete()
+
+    def bulk_create(self, objs, *args, **kwargs):
+        created = super().bulk_create(objs, *args, **kwargs)
+        analytics.record(orders=created)
+        return created
 
 
 class Order(models.Model):
@@ -80,8 +352,167 @@ class Order(models.Model):
     items = models.TextField(default='', blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='Pending')
 
+    objects = OrderQuerySet.as_manager()
+
     def __str__(self):
         return f"Order {self.id} by {self.customer_name}"
 
+    def save(self, *args, **kwargs):
+        if self.pk is None:
+            super().save(*args, **kwargs)
+            # Сводки продаж прибавятся после коммита, а не в начале транзакции заказа
+            analytics.record(orders=[self])
+            return
+        with analytics.tracking([self.pk]):
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with analytics.tracking([self.pk]):
+            return super().delete(*args, **kwargs)
+
+    class Meta:
+        ordering = ['-created_at']  # Добавляем сортировку по умолчанию (новые заказы сначала)
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='order_created_id_idx'),
+        ]
+
+class OrderItemQuerySet(models.QuerySet):
+    TRACKED_FIELDS = {'order', 'order_id', 'product', 'product_id', 'quantity', 'unit_price'}
+
+    def update(self, **kwargs):
+        if not self.TRACKED_FIELDS.intersection(kwargs):
+            return super().update(**kwargs)
+        with analytics.tracking(self.values_list('order_id', flat=True)) as order_ids:
+            if 'order' in kwargs or 'order_id' in kwargs:
+                order = kwargs.get('order', kwargs.get('order_id'))
+                order_ids.add(getattr(order, 'pk', order))
+            return super().update(**kwargs)
+
+    def delete(self):
+        with analytics.tracking(self.values_list('order_id', flat=True)):
+            return super().delete()
+
+    def bulk_create(self, objs, *args, **kwargs):
+        created = super().bulk_create(objs, *args, **kwargs)
+        analytics.record(items=created)
+        return created
+
+
+class OrderItem(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='order_items')
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True, related_name='order_items')
+    name = models.CharField(max_length=200, help_text="Название товара на момент заказа")
+    quantity = models.PositiveIntegerField(default=1)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, help_text="Цена за единицу на момент заказа")
+    options = models.ManyToManyField(ComponentOption, blank=True, help_text="Выбранные комплектующие")
+
+    objects = OrderItemQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.name} x{self.quantity}"
+
+    def save(self, *args, **kwargs):
+        # Позицию могли перенести в другой заказ: учитываем и прежний
+        previous = OrderItem.objects.filter(pk=self.pk).values_list('order_id', flat=True) if self.pk else []
+        with analytics.tracking([self.order_id, *previous]):
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with analytics.tracking([self.order_id]):
+            return super().delete(*args, **kwargs)
+
+    class Meta:
+        ordering = ['id']
+
+
+class SalesRollup(models.Model):
+    # Ключ строки сводки и счётчики, к которым shop.analytics прибавляет изменения
+    ROLLUP_VALUES = ('orders', 'revenue')
+
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    delivery = models.CharField(max_length=50)
+    orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        abstract = True
+
+
+class SalesDaily(SalesRollup):
+    """Заказы и выручка за день по статусу и способу доставки."""
+    ROLLUP_KEY = ('date', 'status', 'delivery')
+
+    date = models.DateField()
+
+    class Meta:
+        ordering = ['date', 'status', 'delivery']
+        constraints = [models.UniqueConstraint(fields=['date', 'status', 'delivery'], name='salesdaily_key')]
+
+
+class SalesHourly(SalesRollup):
+    """То же по часам: для графиков нагрузки внутри дня."""
+    ROLLUP_KEY = ('hour', 'status', 'delivery')
+
+    hour = models.DateTimeField()
+
+    class Meta:
+        ordering = ['hour', 'status', 'delivery']
+        constraints = [models.UniqueConstraint(fields=['hour', 'status', 'delivery'], name='saleshourly_key')]
+
+
+class ProductSalesDaily(models.Model):
+    """Проданные штуки и выручка по товару за день, по статусу заказа."""
+    ROLLUP_KEY = ('date', 'product', 'status')
+    ROLLUP_VALUES = ('units', 'revenue')
+
+    date = models.DateField()
+    # История продаж остаётся и после удаления товара, поэтому без внешнего ключа в БД
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        ordering = ['date', 'product']
+        constraints = [models.UniqueConstraint(fields=['date', 'product', 'status'], name='productsalesdaily_key')]
+
+
+class PriceChange(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, null=True, blank=True, related_name='price_changes')
+    component = models.ForeignKey(ComponentOption, on_delete=models.CASCADE, null=True, blank=True, related_name='price_changes')
+    old_price = models.DecimalField(max_digits=10, decimal_places=2)
+    new_price = models.DecimalField(max_digits=10, decimal_places=2)
+    reason = models.CharField(max_length=200, blank=True, help_text="Описание изменения, например «+10%»")
+    changed_by = models.ForeignKey('auth.User', on_delete=models.SET_NULL, null=True, blank=True)
+    changed_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.product or self.component}: {self.old_price} -> {self.new_price}"
+
+    class Meta:
+        ordering = ['-changed_at']
+
+
+class UploadSession(models.Model):
+    """Загрузка большого файла частями (shop.uploads), с докачкой после обрыва."""
+    FIELD_CHOICES = (
+        ('image', 'Изображение'),
+        ('model_3d', '3D модель'),
+    )
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='upload_sessions')
+    field = models.CharField(max_length=20, choices=FIELD_CHOICES)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField(help_text="Размер файла в байтах")
+    sha256 = models.CharField(max_length=64, blank=True, help_text="Контрольная сумма всего файла (необязательно)")
+    received = models.BigIntegerField(default=0, help_text="Сколько байт уже записано")
+    writing_since = models.DateTimeField(null=True, blank=True, help_text="Когда начата запись текущей части")
+    created_by = models.ForeignKey('auth.User', on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size})"
+
     class Meta:
-        ordering = ['-created_at']  # Добавляем сортировку по умолчанию (новые заказы сначала)
\ No newline at end of file
+        ordering = ['-created_at']
@@ -0,0 +1,183 @@
+# shop/orders.py
+import json
+from decimal import Decimal, InvalidOperation
+
+from .models import Order, OrderItem, Product
+
+
+def field_limit(field):
+    # Наибольшее значение DecimalField: 10 знаков, 2 после запятой — 99999999.99
+    return Decimal(10) ** (field.max_digits - field.decimal_places) - Decimal(1).scaleb(-field.decimal_places)
+
+
+MAX_TOTAL = field_limit(Order._meta.get_field('total'))
+MAX_QUANTITY = 2 ** 31 - 1  # PositiveIntegerField на всех СУБД
+
+
+def parse_items_text(text):
+    """
+    Разбирает старое текстовое поле Order.items: JSON-список или перечисление
+    через запятую. Возвращает список словарей name/quantity/price/product_id.
+    """
+    if not text or not text.strip():
+        return []
+    try:
+        data = json.loads(text)
+    except (json.JSONDecodeError, TypeError):
+        data = [part.strip() for part in text.split(',') if part.strip()]
+    if not isinstance(data, list):
+        data = [data]
+
+    items = []
+    for entry in data:
+        if isinstance(entry, dict):
+            try:
+                quantity = max(int(entry.get('quantity') or 1), 1)
+            except (TypeError, ValueError):
+                quantity = 1
+            try:
+                price = Decimal(str(entry['price'])) if entry.get('price') not in (None, '') else None
+            except InvalidOperation:
+                price = None
+            product_id = entry.get('product') or entry.get('product_id') or entry.get('id')
+            items.append({
+                'name': str(entry.get('name') or '')[:200],
+                'quantity': quantity,
+                'price': price,
+                'product_id': product_id if isinstance(product_id, int) else None,
+            })
+        elif entry not in (None, ''):
+            items.append({'name': str(entry)[:200], 'quantity': 1, 'price': None, 'product_id': None})
+    return items
+
+
+def resolve_items(items, allow_prices=False):
+    """
+    Заменяет id товаров и комплектующих в позициях на объекты: два запроса
+    на весь заказ (товары и их комплектующие). Комплектующие принимаются
+    только из product.components. Цену позиции без товара может прислать
+    только сотрудник (allow_prices). Возвращает ошибки по позициям (пустые
+    словари, если всё в порядке).
+    """
+    products = Product.objects.prefetch_related('components').in_bulk(
+        {item['product'] for item in items if item.get('product')}
+    )
+    errors = []
+    for item in items:
+        item_errors = {}
+        product = products.get(item.get('product'))
+        if item.get('product'):
+            if product is None:
+                item_errors['product'] = [f'Товар {item["product"]} не найден.']
+        elif not item.get('name'):
+            item_errors['name'] = ['Укажите товар или название позиции.']
+        elif item.get('unit_price') is not None and not allow_prices:
+            item_errors['unit_price'] = ['Цену позиции без товара указывает только сотрудник.']
+        requested = item.get('options', [])
+        available = {option.pk: option for option in product.components.all()} if product else {}
+        missing = [pk for pk in requested if pk not in available]
+        if missing and product is not None:
+            item_errors['options'] = [f'Комплектующие недоступны для этого товара: {missing}.']
+        elif missing and not item.get('product'):
+            item_errors['options'] = ['Комплектующие выбираются только вместе с товаром.']
+        item['product'] = product
+        item['options'] = [available[pk] for pk in requested if pk in available]
+        errors.append(item_errors)
+    return errors
+
+
+def price_items(items):
+    """
+    Считает цены позиций на сервере: цена товара со скидкой плюс выбранные
+    комплектующие. Проставляет unit_price и line_total, возвращает итог.
+    Цену позиции без товара прислать мог только сотрудник (см. resolve_items
+    и items_from_text), без неё позиция бесплатна.
+    """
+    total = Decimal('0.00')
+    for item in items:
+        product = item.get('product')
+        if product is not None:
+            item['unit_price'] = product.final_price + sum((option.price for option in item.get('options', [])), Decimal('0.00'))
+        unit_price = item.get('unit_price') or Decimal('0.00')
+        item['line_total'] = unit_price * item.get('quantity', 1)
+        total += item['line_total']
+    return total
+
+
+def amount_error(items, total):
+    """
+    Сообщение об ошибке, если количество или итог (см. price_items) не
+    поместятся в поля заказа: иначе INSERT упадёт с ошибкой БД уже после
+    начала записи.
+    """
+    if any(item.get('quantity', 1) > MAX_QUANTITY for item in items):
+        return f'Количество в позиции не может быть больше {MAX_QUANTITY}.'
+    if total > MAX_TOTAL:
+        return f'Сумма заказа не может быть больше {MAX_TOTAL}.'
+    return None
+
+
+def create_order_items(order, items_data):
+    """
+    Создаёт позиции заказа одним bulk_create, а выбранные комплектующие —
+    одной вставкой в промежуточную таблицу. В items_data уже загруженные
+    объекты product/options (см. OrderSerializer.validate_order_items).
+    Вызывается для только что созданного заказа.
+    """
+    if not items_data:
+        return []
+    order_items = []
+    for item in items_data:
+        product = item.get('product')
+        unit_price = item.get('unit_price')
+        if unit_price is None:
+            unit_price = product.final_price if product else 0
+        order_items.append(OrderItem(
+            order=order,
+            product=product,
+            name=item.get('name') or (product.name if product else ''),
+            quantity=item.get('quantity', 1),
+            unit_price=unit_price,
+        ))
+    OrderItem.objects.bulk_create(order_items)
+    if any(order_item.pk is None for order_item in order_items):
+        # MySQL не возвращает id после bulk_create. Заказ новый, других позиций
+        # у него нет, а id одной многострочной вставки растут в порядке строк
+        ids = OrderItem.objects.filter(order=order).order_by('pk').values_list('pk', flat=True)
+        for order_item, pk in zip(order_items, ids):
+            order_item.pk = pk
+
+    Through = OrderItem.options.through
+    links = [
+        Through(orderitem_id=order_item.pk, componentoption_id=option.pk)
+        for order_item, item in zip(order_items, items_data)
+        for option in item.get('options', [])
+    ]
+    if links:
+        Through.objects.bulk_create(links)
+    return order_items
+
+
+def items_from_text(text, keep_prices=False):
+    """
+    Превращает текст Order.items в данные для create_order_items. Цены из
+    текста остаются только при keep_prices (заказ оформляет сотрудник).
+    """
+    items = parse_items_text(text)
+    ids = {item['product_id'] for item in items if item['product_id']}
+    names = {item['name'] for item in items if not item['product_id'] and item['name']}
+    products = Product.objects.in_bulk(ids) if ids else {}
+    by_name = {}
+    if names:
+        for product in Product.objects.filter(name__in=names).only('id', 'name'):
+            by_name.setdefault(product.name, product)
+    return [{
+        'product': products.get(item['product_id']) or by_name.get(item['name']),
+        'name': item['name'],
+        'quantity': item['quantity'],
+        'unit_price': item['price'] if keep_prices and valid_price(item['price']) else None,
+    } for item in items]
+
+
+def valid_price(price):
+    return price is not None and price.is_finite() and price >= 0
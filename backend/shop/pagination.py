@@ -0,0 +1,191 @@
+# shop/pagination.py
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+import binascii
+import datetime
+import decimal
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+
+class CursorEncoder(json.JSONEncoder):
+    # В отличие от DjangoJSONEncoder не обрезает микросекунды: курсор должен быть точным
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.date)):
+            return o.isoformat()
+        if isinstance(o, decimal.Decimal):
+            return str(o)
+        return super().default(o)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Постраничный вывод по ключу (keyset/cursor) вместо OFFSET.
+
+    Курсор хранит значения полей сортировки последней записи страницы, и
+    следующая страница выбирается условием WHERE (поле, id) > (значение, id)
+    по составному индексу. Поэтому глубокие страницы стоят столько же, сколько
+    первая. Сортировка берётся из queryset (в том числе из ?ordering=), к ней
+    всегда добавляется id. COUNT(*) не выполняется, пока не передан ?count=1.
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    page_size_query_param = 'page_size'
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    invalid_cursor_message = 'Некорректный курсор.'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_ordering(self, queryset):
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        if any(not isinstance(field, str) for field in ordering):
+            raise TypeError('KeysetPagination поддерживает сортировку только по именам полей.')
+        ordering = ['id' if field == 'pk' else '-id' if field == '-pk' else field for field in ordering]
+        if not any(field.lstrip('-') == 'id' for field in ordering):
+            ordering.append('-id' if ordering and ordering[0].startswith('-') else 'id')
+        return ordering
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            data = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            reverse, values = bool(data['r']), list(data['v'])
+        except (TypeError, ValueError, KeyError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return reverse, [self.cursor_value(field, value) for field, value in zip(self.ordering, values)]
+
+    def cursor_value(self, field, value):
+        # Значение из курсора приводим к типу поля сортировки: иначе null или
+        # строка вместо даты дойдут до SQL и вызовут ошибку 500
+        if value is None:
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            model_field = self.model._meta.get_field(field.lstrip('-'))
+        except FieldDoesNotExist:
+            return value
+        try:
+            value = model_field.to_python(value)
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if value is None:
+            raise NotFound(self.invalid_cursor_message)
+        return value
+
+    def encode_cursor(self, obj, reverse):
+        values = [getattr(obj, field.lstrip('-')) for field in self.ordering]
+        data = json.dumps({'r': int(reverse), 'v': values}, cls=CursorEncoder)
+        encoded = urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def keyset_filter(self, values, reverse):
+        # (a, b, id) > (x, y, z)  ->  a > x OR (a = x AND b > y) OR (a = x AND b = y AND id > z)
+        condition = Q()
+        for position, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            step = Q(**{f"{name}__{'lt' if descending else 'gt'}": values[position]})
+            for previous, value in zip(self.ordering[:position], values):
+                step &= Q(**{previous.lstrip('-'): value})
+            condition |= step
+        return condition
+
+    def page_queryset(self, queryset, request):
+        """Запрос страницы (на одну запись больше); COUNT выполняет вызывающий."""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.model = queryset.model
+        self.ordering = self.get_ordering(queryset)
+        self.count = None
+        self.wants_count = request.query_params.get(self.count_query_param, '').lower() in TRUE_VALUES
+
+        self.cursor = self.decode_cursor(request)
+        reverse, values = self.cursor or (False, None)
+        if values is not None:
+            queryset = queryset.filter(self.keyset_filter(values, reverse))
+        if reverse:
+            queryset = queryset.order_by(*[f[1:] if f.startswith('-') else f'-{f}' for f in self.ordering])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        # Берём на одну запись больше, чтобы узнать, есть ли следующая страница
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        reverse, values = self.cursor or (False, None)
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = values is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, values is not None
+        self.page = results
+        return results
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page = self.page_queryset(queryset, request)
+        if self.wants_count:
+            self.count = queryset.count()
+        return self.set_page(list(page))
+
+    async def apaginate_queryset(self, queryset, request):
+        """То же через асинхронный ORM (shop.async_views)."""
+        page = self.page_queryset(queryset, request)
+        if self.wants_count:
+            self.count = await queryset.acount()
+        return self.set_page([obj async for obj in page])
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_data(self, data):
+        payload = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        }
+        if self.count is not None:
+            payload = {'count': self.count, **payload}
+        return payload
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {'type': 'integer'},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,75 @@
+# shop/pricing.py
+"""
+Массовое изменение цен одним UPDATE.
+
+Новая цена считается в SQL в Decimal с округлением до копеек и не может
+стать отрицательной. Вместе с изменением пачкой пишется история PriceChange.
+"""
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import Count, F, Max, Min, Value
+from django.db.models.functions import Greatest, Round
+
+from .models import ComponentOption, PriceChange, Product
+
+# Поле цены и FK в PriceChange для каждой модели
+PRICE_FIELDS = {
+    Product: ('base_price', 'product_id'),
+    ComponentOption: ('price', 'component_id'),
+}
+
+
+def describe_change(percent=None, delta=None):
+    parts = []
+    if percent:
+        parts.append(f"{percent:+}%")
+    if delta:
+        parts.append(f"{delta:+}")
+    return ' '.join(parts) or 'без изменений'
+
+
+def price_expression(field, percent=None, delta=None):
+    price_field = models.DecimalField(max_digits=10, decimal_places=2)
+    expression = F(field)
+    if percent:
+        expression = expression * (Value(Decimal(100)) + Value(Decimal(percent))) * Value(Decimal('0.01'))
+    if delta:
+        expression = expression + Value(Decimal(delta))
+    return Greatest(Round(expression, 2, output_field=price_field), Value(Decimal('0.00')), output_field=price_field)
+
+
+def preview_price_change(queryset, percent=None, delta=None):
+    """Количество затронутых записей и диапазон цен до и после — одним запросом."""
+    field, _ = PRICE_FIELDS[queryset.model]
+    return queryset.order_by().aggregate(
+        count=Count('pk'),
+        old_min=Min(field),
+        old_max=Max(field),
+        new_min=Min(price_expression(field, percent, delta)),
+        new_max=Max(price_expression(field, percent, delta)),
+    )
+
+
+def apply_price_change(queryset, percent=None, delta=None, user=None):
+    """
+    Меняет цены выбранных записей одним UPDATE внутри транзакции и пишет
+    историю одним bulk_create. Возвращает количество изменённых записей.
+    """
+    model = queryset.model
+    field, history_fk = PRICE_FIELDS[model]
+    reason = describe_change(percent, delta)
+    with transaction.atomic():
+        # Блокируем строки, чтобы история совпадала с тем, что реально изменилось
+        old_prices = dict(queryset.select_for_update().order_by('pk').values_list('pk', field))
+        if not old_prices:
+            return 0
+        changed = model.objects.filter(pk__in=old_prices)
+        updated = changed.update(**{field: price_expression(field, percent, delta)})
+        new_prices = changed.values_list('pk', field)
+        PriceChange.objects.bulk_create([
+            PriceChange(**{history_fk: pk}, old_price=old_prices[pk], new_price=new_price, reason=reason, changed_by=user)
+            for pk, new_price in new_prices
+            if new_price != old_prices[pk]
+        ], batch_size=1000)
+    return updated
@@ -0,0 +1,176 @@
+# shop/routers.py
+"""
+Чтение каталога и отчётов с реплики БД.
+
+По умолчанию все запросы идут в default. Чтения внутри replica_reads() (GET
+каталога и аналитики через ReplicaReadMixin, выгрузки админки через
+report_database()) уходят в алиас REPLICA_DATABASE, если:
+
+- он есть в DATABASES и отвечает: проверка SELECT 1 кэшируется в процессе
+  на REPLICA_CHECK_INTERVAL секунд, упавшая реплика на это время выключается;
+- клиент недавно ничего не записывал: после запроса с записью
+  ReplicaMiddleware ставит cookie на REPLICA_STICKY_SECONDS, и пока она жива,
+  клиент читает с основной БД и видит свои изменения несмотря на отставание
+  реплики. В самом запросе после первой записи чтения тоже идут в default;
+- данные ответа (cache_namespaces вьюсета) не менялись последние
+  REPLICA_STICKY_SECONDS секунд — иначе в кэш API попал бы старый ответ;
+- нет открытой транзакции на default: в ней нужно видеть свои изменения.
+
+Запись всегда идёт в default.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from .catalog_cache import get_last_modified
+
+logger = logging.getLogger(__name__)
+
+STICKY_COOKIE = 'db_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_reads = ContextVar('replica_reads', default=False)
+# Состояние текущего запроса: {'primary': читать с default, 'written': была запись}
+_request = ContextVar('replica_request', default=None)
+
+# {алиас: (доступна, время проверки)}
+replica_health = {}
+
+
+def ping(alias):
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT 1')
+        return True
+    except DatabaseError:
+        logger.warning('Реплика %s недоступна, чтение идёт с основной БД', alias, exc_info=True)
+        connections[alias].close()
+        return False
+
+
+def check_due(alias):
+    healthy, checked_at = replica_health.get(alias, (None, 0))
+    return healthy is None or time.monotonic() - checked_at >= settings.REPLICA_CHECK_INTERVAL
+
+
+def replica_available():
+    alias = settings.REPLICA_DATABASE
+    if alias not in settings.DATABASES:
+        return False
+    if check_due(alias):
+        replica_health[alias] = (ping(alias), time.monotonic())
+    return replica_health[alias][0]
+
+
+async def acheck_replica():
+    """Для асинхронных вьюх: проверяет реплику (если пора) в потоке, а не в цикле событий."""
+    alias = settings.REPLICA_DATABASE
+    if alias in settings.DATABASES and check_due(alias):
+        await sync_to_async(use_replica)()
+
+
+def use_replica():
+    state = _request.get()
+    if state is not None and state['primary']:
+        return False
+    if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return False
+    return replica_available()
+
+
+def report_database():
+    """Алиас для тяжёлых отчётов: реплика, если её можно использовать сейчас."""
+    return settings.REPLICA_DATABASE if use_replica() else DEFAULT_DB_ALIAS
+
+
+def recently_changed(namespaces):
+    modified = get_last_modified(namespaces) if namespaces else None
+    return modified is not None and time.time() - modified < settings.REPLICA_STICKY_SECONDS
+
+
+@contextmanager
+def replica_reads(request=None, namespaces=()):
+    """Чтения внутри блока идут на реплику, если это безопасно."""
+    enabled = (request is None or request.method in SAFE_METHODS) and not recently_changed(namespaces)
+    token = _reads.set(enabled)
+    try:
+        yield
+    finally:
+        _reads.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _reads.get() and use_replica():
+            return settings.REPLICA_DATABASE
+        # None: связанные объекты читаются из той же БД, что и исходный
+        return None
+
+    def db_for_write(self, model, **hints):
+        state = _request.get()
+        if state is not None:
+            state['primary'] = state['written'] = True
+        # Явно: объект, прочитанный с реплики, всё равно сохраняется в default
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+class ReplicaMiddleware:
+    """Клиент, который что-то записал, REPLICA_STICKY_SECONDS читает с основной БД."""
+    sync_capable = True
+    async_capable = True  # Под ASGI не переводит асинхронные вьюхи в поток
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = {'primary': STICKY_COOKIE in request.COOKIES, 'written': False}
+        token = _request.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request.reset(token)
+        return self.process_response(state, response)
+
+    async def __acall__(self, request):
+        state = {'primary': STICKY_COOKIE in request.COOKIES, 'written': False}
+        token = _request.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request.reset(token)
+        return self.process_response(state, response)
+
+    def process_response(self, state, response):
+        if state['written']:
+            response.set_cookie(
+                STICKY_COOKIE, '1', max_age=settings.REPLICA_STICKY_SECONDS, httponly=True, samesite='Lax',
+            )
+        return response
+
+
+class ReplicaReadMixin:
+    """GET-запросы вьюсета читают с реплики. Ставится первым в списке базовых классов."""
+
+    def dispatch(self, request, *args, **kwargs):
+        with replica_reads(request, getattr(self, 'cache_namespaces', ())):
+            return super().dispatch(request, *args, **kwargs)
+
+    def perform_authentication(self, request):
+        # Токен и пользователь — с основной БД: только что выданный токен мог не дойти до реплики
+        token = _reads.set(False)
+        try:
+            super().perform_authentication(request)
+        finally:
+            _reads.reset(token)
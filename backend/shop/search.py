@@ -0,0 +1,156 @@
+# shop/search.py
+"""
+Полнотекстовый поиск по названию и описанию товаров.
+
+SQLite (разработка): виртуальная таблица FTS5 с внешним содержимым, которую
+поддерживают в актуальном состоянии триггеры на shop_product.
+MySQL (продакшен): индекс FULLTEXT, его InnoDB обновляет сам.
+Для остальных СУБД остаётся поиск по подстроке.
+"""
+import re
+
+from django.db import connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'shop_product_fts'
+FULLTEXT_INDEX = 'product_fulltext_idx'
+
+# Сколько лучших совпадений ранжируем в /api/products/search/
+MAX_RANKED_RESULTS = 500
+
+SQLITE_TABLE = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+    name, description,
+    content='shop_product', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+)
+"""
+
+SQLITE_TRIGGERS = {
+    f'{FTS_TABLE}_ai': f"""
+CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON shop_product BEGIN
+    INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+END
+""",
+    f'{FTS_TABLE}_ad': f"""
+CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON shop_product BEGIN
+    INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+END
+""",
+    f'{FTS_TABLE}_au': f"""
+CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, description ON shop_product BEGIN
+    INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+    INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+END
+""",
+}
+
+
+def install(using='default'):
+    """Создаёт индекс, если его нет. Безопасно вызывать повторно."""
+    connection = connections[using]
+    if 'shop_product' not in connection.introspection.table_names():
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            # Пересборка таблицы при миграциях SQLite удаляет триггеры,
+            # поэтому восстанавливаем их и переиндексируем товары
+            cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+            existing = {row[0] for row in cursor.fetchall()}
+            if FTS_TABLE in existing and all(name in existing for name in SQLITE_TRIGGERS):
+                return
+            cursor.execute(SQLITE_TABLE)
+            for sql in SQLITE_TRIGGERS.values():
+                cursor.execute(sql)
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        elif connection.vendor == 'mysql':
+            cursor.execute(
+                "SELECT 1 FROM information_schema.statistics "
+                "WHERE table_schema = DATABASE() AND table_name = 'shop_product' AND index_name = %s",
+                [FULLTEXT_INDEX],
+            )
+            if cursor.fetchone() is None:
+                cursor.execute(f"ALTER TABLE shop_product ADD FULLTEXT INDEX {FULLTEXT_INDEX} (name, description)")
+
+
+def uninstall(using='default'):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            for name in SQLITE_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+        elif connection.vendor == 'mysql':
+            cursor.execute(f"ALTER TABLE shop_product DROP INDEX {FULLTEXT_INDEX}")
+
+
+def ensure_search_index(sender, using='default', **kwargs):
+    # Обработчик post_migrate
+    install(using)
+
+
+def tokenize(term):
+    return re.findall(r'\w+', term or '')
+
+
+def fts5_query(tokens):
+    # Каждое слово в кавычках и с поиском по префиксу: "видео"* "карт"*
+    return ' '.join('"{}"*'.format(token.replace('"', '""')) for token in tokens)
+
+
+def mysql_query(tokens):
+    return ' '.join(f'+{token}*' for token in tokens)
+
+
+def mysql_rank(tokens):
+    return RawSQL(
+        "MATCH (shop_product.name, shop_product.description) AGAINST (%s IN BOOLEAN MODE)",
+        [mysql_query(tokens)],
+        output_field=FloatField(),
+    )
+
+
+def filter_products(queryset, term):
+    """Оставляет товары, подходящие под запрос, не меняя сортировку."""
+    tokens = tokenize(term)
+    if not tokens:
+        return queryset
+    vendor = connections[queryset.db].vendor
+    if vendor == 'sqlite':
+        return queryset.filter(id__in=RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [fts5_query(tokens)],
+        ))
+    if vendor == 'mysql':
+        return queryset.alias(search_rank=mysql_rank(tokens)).filter(search_rank__gt=0)
+    condition = Q()
+    for token in tokens:
+        condition &= Q(name__icontains=token) | Q(description__icontains=token)
+    return queryset.filter(condition)
+
+
+def search_products(queryset, term, limit=MAX_RANKED_RESULTS):
+    """
+    Не больше limit товаров, подходящих под запрос, в порядке релевантности
+    (search_rank по убыванию) на любой СУБД.
+    """
+    tokens = tokenize(term)
+    if not tokens:
+        return queryset.none()
+    connection = connections[queryset.db]
+    if connection.vendor == 'sqlite':
+        # Совпадения отбираются подзапросом MATCH вместе с остальными фильтрами
+        # queryset (как в filter_products), и только потом ранжируются: bm25
+        # FTS5 для каждой найденной строки, название весомее описания
+        rank = RawSQL(
+            f"SELECT -bm25({FTS_TABLE}, 10.0, 1.0) FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND rowid = shop_product.id",
+            [fts5_query(tokens)],
+            output_field=FloatField(),
+        )
+        queryset = filter_products(queryset, term).annotate(search_rank=rank)
+        return queryset.order_by('-search_rank', 'id')[:limit]
+    if connection.vendor == 'mysql':
+        queryset = queryset.annotate(search_rank=mysql_rank(tokens)).filter(search_rank__gt=0)
+        return queryset.order_by('-search_rank', 'id')[:limit]
+    return filter_products(queryset, term).annotate(search_rank=Value(0)).order_by('name', 'id')[:limit]
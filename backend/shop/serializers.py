@@ -1,9 +1,32 @@
 # shop/serializers.py
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
-from .models import Category, Product, Order, ComponentOption
+from . import inventory
+from .filters import split_param
+from .images import VARIANT_FORMATS
+from .instrumentation import span
+from .models import Category, Product, Order, OrderItem, ComponentOption, UploadSession
+from .orders import MAX_QUANTITY, amount_error, create_order_items, items_from_text, price_items, resolve_items
 
-class CategorySerializer(serializers.ModelSerializer):
+class TimedListSerializer(serializers.ListSerializer):
+    @property
+    def data(self):
+        with span('serialize'):
+            return super().data
+
+class TimedSerializerMixin:
+    """Время сборки .data попадает в Server-Timing (shop.instrumentation)."""
+
+    @property
+    def data(self):
+        with span('serialize'):
+            return super().data
+
+class CategorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
+        list_serializer_class = TimedListSerializer
         model = Category
         fields = '__all__'
 
@@ -12,19 +35,208 @@ class ComponentOptionSerializer(serializers.ModelSerializer):
         model = ComponentOption
         fields = ['id', 'name', 'price', 'volume']
 
-class ProductSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """Принимает fields=[...] и оставляет в сериализаторе только эти поля."""
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+class ProductSerializer(TimedSerializerMixin, SparseFieldsMixin, serializers.ModelSerializer):
     image = serializers.ImageField(use_url=True, allow_null=True)
     model_3d = serializers.FileField(use_url=True, allow_null=True)
     category_name = serializers.CharField(source='category.name', read_only=True)
     compatible_with = serializers.PrimaryKeyRelatedField(many=True, queryset=Product.objects.all(), required=False)
     components = ComponentOptionSerializer(many=True, read_only=True)
     brand = serializers.CharField(allow_blank=True, allow_null=True)
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'category', 'category_name', 'base_price', 'description', 'image', 'model_3d', 'stock', 'discount', 'component_type', 'components', 'compatible_with', 'brand']
+        list_serializer_class = TimedListSerializer
+        read_only_fields = ['final_price']
+        fields = ['id', 'sku', 'name', 'category', 'category_name', 'base_price', 'final_price', 'description', 'image', 'image_variants', 'model_3d', 'stock', 'discount', 'component_type', 'components', 'compatible_with', 'brand', 'created_at', 'updated_at']
+
+    def get_image_variants(self, obj):
+        # {'webp': {'160': url, '480': url, ...}, 'jpeg': {...}} — для srcset
+        request = self.context.get('request')
+        variants = {}
+        for extension in VARIANT_FORMATS:
+            files = (obj.image_variants or {}).get(extension) or {}
+            urls = {width: default_storage.url(name) for width, name in files.items()}
+            if request is not None:
+                urls = {width: request.build_absolute_uri(url) for width, url in urls.items()}
+            variants[extension] = urls
+        return variants
+
+def requested_fields(params, serializer_class):
+    """
+    Набор полей ответа для товаров: ?fields=id,name,... заменяет стандартный
+    набор serializer_class, ?expand=description,components добавляет поля
+    полного представления. None — все поля сериализатора.
+    """
+    available = ProductSerializer.Meta.fields
+    requested = split_param(params.getlist('fields'))
+    expand = split_param(params.getlist('expand'))
+    unknown = [name for name in requested + expand if name not in available]
+    if unknown:
+        raise serializers.ValidationError({'fields': f"Неизвестные поля: {', '.join(unknown)}."})
+    defaults = getattr(serializer_class, 'default_fields', None)
+    if requested:
+        return requested + expand
+    if expand:
+        return (defaults or available) + expand
+    return defaults
+
+class ProductListSerializer(ProductSerializer):
+    """Облегчённое представление для сетки товаров. Остальные поля — через ?expand=."""
+
+    default_fields = ['id', 'name', 'category', 'category_name', 'base_price', 'final_price', 'image', 'image_variants', 'stock', 'discount', 'component_type', 'brand']
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, fields=fields or self.default_fields, **kwargs)
+
+class BatchedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Проверяет только формат ID. Объекты загружаются одним запросом в validate_*()."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+class OrderItemSerializer(serializers.ModelSerializer):
+    product = BatchedPrimaryKeyRelatedField(queryset=Product.objects.all(), allow_null=True, required=False)
+    options = BatchedPrimaryKeyRelatedField(many=True, queryset=ComponentOption.objects.all(), required=False)
+
+    class Meta:
+        model = OrderItem
+        fields = ['id', 'product', 'name', 'quantity', 'unit_price', 'options']
+        extra_kwargs = {
+            'name': {'required': False},
+            'unit_price': {'required': False, 'min_value': 0},
+            'quantity': {'min_value': 1, 'max_value': MAX_QUANTITY},
+        }
+
+class OrderSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    order_items = OrderItemSerializer(many=True, required=False)
 
-class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
-        fields = '__all__'
\ No newline at end of file
+        list_serializer_class = TimedListSerializer
+        fields = ['id', 'customer_name', 'address', 'delivery', 'comment', 'total', 'created_at', 'items', 'status', 'order_items']
+        extra_kwargs = {'total': {'required': False, 'min_value': 0}}
+
+    def is_staff(self):
+        request = self.context.get('request')
+        return request is not None and request.user.is_staff
+
+    def validate_order_items(self, items):
+        # Товары и комплектующие всех позиций загружаем двумя запросами
+        errors = resolve_items(items, allow_prices=self.is_staff())
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        # Итог проверяем до записи: не поместившийся в Order.total дал бы ошибку БД
+        error = amount_error(items, price_items(items))
+        if error:
+            raise serializers.ValidationError(error)
+        return items
+
+    def create(self, validated_data):
+        items_data = validated_data.pop('order_items', None)
+        if items_data is None:
+            # Старый формат: текст в items (JSON или через запятую)
+            items_data = items_from_text(validated_data.get('items'), keep_prices=self.is_staff())
+        # Итог считает сервер, как в /api/configurator/quote/. Присланный total
+        # принимается только от сотрудника и только для заказа без позиций
+        total = price_items(items_data)
+        error = amount_error(items_data, total)
+        if error:
+            # Только для старого формата: order_items уже проверены в validate_order_items
+            raise serializers.ValidationError({'items': [error]})
+        if items_data or not self.is_staff() or 'total' not in validated_data:
+            validated_data['total'] = total
+        try:
+            with transaction.atomic():
+                # Остатки списываем первым делом: строки товаров блокируются FOR UPDATE
+                # по возрастанию id до вставки позиций. Иначе проверка FK позиций в
+                # InnoDB возьмёт на товар разделяемую блокировку, и два заказа одного
+                # товара попадут во взаимоблокировку, повышая её до исключительной
+                inventory.reserve(inventory.item_quantities(items_data))
+                order = super().create(validated_data)
+                create_order_items(order, items_data)
+        except inventory.InsufficientStock as error:
+            raise serializers.ValidationError(self.stock_errors(items_data, error.shortages))
+        # Для ответа: позиции и их комплектующие двумя запросами, а не по запросу на позицию
+        prefetch_related_objects([order], 'order_items__options')
+        return order
+
+    def stock_errors(self, items_data, shortages):
+        errors = []
+        for item in items_data:
+            product = item.get('product')
+            if product is not None and product.pk in shortages:
+                errors.append({'quantity': [f'Недостаточно «{product.name}» на складе: доступно {shortages[product.pk]}.']})
+            else:
+                errors.append({})
+        return {'order_items' if 'order_items' in self.initial_data else 'items': errors}
+
+    def update(self, instance, validated_data):
+        if 'order_items' in validated_data:
+            raise serializers.ValidationError({'order_items': 'Состав заказа нельзя изменить после создания.'})
+        total = validated_data.get('total', instance.total)
+        if total != instance.total and (not self.is_staff() or instance.order_items.exists()):
+            raise serializers.ValidationError({'total': 'Итог заказа считает сервер.'})
+        status = validated_data.pop('status', instance.status)
+        try:
+            with transaction.atomic():
+                instance = super().update(instance, validated_data)
+                if status != instance.status:
+                    # Отмена возвращает товары на склад, возврат из отмены снова их резервирует
+                    inventory.change_status(instance, status)
+        except inventory.InsufficientStock:
+            raise serializers.ValidationError({'status': ['Недостаточно товара на складе, чтобы вернуть заказ из отмены.']})
+        return instance
+
+class QuoteItemSerializer(OrderItemSerializer):
+    product = BatchedPrimaryKeyRelatedField(queryset=Product.objects.all())
+    line_total = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+
+    class Meta(OrderItemSerializer.Meta):
+        fields = ['product', 'name', 'quantity', 'unit_price', 'line_total', 'options']
+        extra_kwargs = {
+            'name': {'required': False},
+            'unit_price': {'read_only': True},
+            'quantity': {'min_value': 1, 'max_value': MAX_QUANTITY},
+        }
+
+class QuoteSerializer(TimedSerializerMixin, serializers.Serializer):
+    """Расчёт стоимости сборки без создания заказа."""
+    order_items = QuoteItemSerializer(many=True, allow_empty=False)
+    total = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+
+    def validate_order_items(self, items):
+        errors = resolve_items(items)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return items
+
+    def quote(self):
+        items = self.validated_data['order_items']
+        total = price_items(items)
+        for item in items:
+            if not item.get('name') and item.get('product'):
+                item['name'] = item['product'].name
+        return {'order_items': items, 'total': total}
+
+class UploadSessionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        list_serializer_class = TimedListSerializer
+        model = UploadSession
+        fields = ['id', 'product', 'field', 'filename', 'size', 'sha256', 'received', 'created_at', 'completed_at']
+        read_only_fields = ['received', 'created_at', 'completed_at']
+        extra_kwargs = {'size': {'min_value': 1}}
@@ -0,0 +1,78 @@
+# shop/signals.py
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import catalog_cache, compatibility
+from .models import Category, ComponentOption, Product
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=ComponentOption)
+@receiver(post_delete, sender=ComponentOption)
+def catalog_changed(sender, **kwargs):
+    catalog_cache.invalidate_model(sender)
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, **kwargs):
+    # Название категории входит в ответ по товару (category_name)
+    if not created:
+        Product.objects.filter(category=instance).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=ComponentOption)
+@receiver(pre_delete, sender=ComponentOption)
+def component_option_changed(sender, instance, **kwargs):
+    if not kwargs.get('created'):
+        Product.objects.filter(components=instance).update(updated_at=timezone.now())
+
+
+@receiver(m2m_changed, sender=Product.components.through)
+@receiver(m2m_changed, sender=Product.compatible_with.through)
+def catalog_relations_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if isinstance(instance, Product) and not reverse:
+        Product.objects.filter(pk=instance.pk).update(updated_at=timezone.now())
+    elif model is Product and pk_set:
+        Product.objects.filter(pk__in=pk_set).update(updated_at=timezone.now())
+    else:
+        catalog_cache.invalidate_model(Product)
+
+
+@receiver(post_save, sender=Product)
+def product_type_saved(sender, instance, created, update_fields, **kwargs):
+    # Граф совместимости зависит только от типа товара: сохранение с тем же
+    # типом не заставляет остальные процессы перечитывать граф
+    if update_fields is not None and 'component_type' not in update_fields:
+        return
+    if created or getattr(instance, 'saved_component_type', None) != instance.component_type:
+        compatibility.graph.product_saved(instance.pk, instance.component_type)
+    instance.saved_component_type = instance.component_type
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    compatibility.graph.product_deleted(instance.pk)
+
+
+@receiver(m2m_changed, sender=Product.compatible_with.through)
+def compatibility_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    graph = compatibility.graph
+    if action == 'post_clear':
+        # При clear() pk_set не передаётся, связи берём из самого графа
+        if reverse:
+            graph.links_cleared(target=instance.pk)
+        else:
+            graph.links_cleared(source=instance.pk)
+    elif action in ('post_add', 'post_remove') and pk_set:
+        update = graph.links_added if action == 'post_add' else graph.links_removed
+        if reverse:
+            for source in pk_set:
+                update(source, [instance.pk])
+        else:
+            update(instance.pk, pk_set)
@@ -1,3 +1,1579 @@
-from django.test import TestCase
+import base64
+from decimal import Decimal
+import gzip
+import hashlib
+import json
+from io import BytesIO, StringIO
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.models import F, QuerySet
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from . import catalog_cache, compatibility, counters, images, importer, instrumentation, inventory, routers, search, uploads
+from .exports import product_rows
+from .filters import ProductOrderingFilter
+from .models import (
+    Category, ComponentOption, Order, OrderItem, PriceChange, Product, ProductSalesDaily, SalesDaily, SalesHourly,
+    UploadSession,
+)
+from .pricing import apply_price_change, preview_price_change
+
+
+def create_catalog(count, category=None):
+    category = category or Category.objects.create(name='Комплектующие')
+    options = [
+        ComponentOption.objects.create(name='DDR5', price=50, volume='16GB', type='ram'),
+        ComponentOption.objects.create(name='DDR5', price=90, volume='32GB', type='ram'),
+    ]
+    products = []
+    for i in range(count):
+        product = Product.objects.create(
+            name=f'Товар {i:03d}',
+            category=category,
+            base_price=100 + i,
+            stock=i % 3,
+            discount=i % 2 * 10,
+            component_type='ram',
+        )
+        product.components.set(options)
+        if products:
+            product.compatible_with.add(products[-1])
+        products.append(product)
+    return products
+
+
+class ProductQueryCountTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_list_query_count_does_not_depend_on_page_size(self):
+        create_catalog(2)
+        small = self.count_queries('/api/products/?expand=components,compatible_with')
+        create_catalog(10)
+        large = self.count_queries('/api/products/?expand=components,compatible_with')
+        self.assertEqual(small, large)
+
+    def test_list_query_count(self):
+        create_catalog(12)
+        # Облегчённый список: один запрос с JOIN категории; COUNT(*) не выполняется
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/products/')
+        self.assertEqual(len(response.data['results']), 12)
+        # Со связями: плюс по запросу на комплектующие и совместимость
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/products/?expand=components,compatible_with')
+        self.assertEqual(len(response.data['results'][0]['components']), 2)
+
+    def test_detail_query_count(self):
+        product = create_catalog(3)[-1]
+        # updated_at для ETag, товар с категорией, комплектующие, совместимость
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/api/products/{product.id}/')
+        self.assertEqual(response.data['category_name'], 'Комплектующие')
+        self.assertEqual(len(response.data['components']), 2)
+        self.assertEqual(response.data['compatible_with'], [product.id - 1])
+
+
+class ProductFilterTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.products = create_catalog(6)
+        other = Category.objects.create(name='Периферия')
+        self.mouse = Product.objects.create(
+            name='Мышь', category=other, base_price=20, stock=5, brand='Logitech',
+            description='Беспроводная мышь', component_type='other',
+        )
+
+    def ids(self, query):
+        response = self.client.get('/api/products/' + query)
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data['results']]
+
+    def test_filters(self):
+        self.assertEqual(self.ids(f'?category={self.mouse.category_id}'), [self.mouse.id])
+        self.assertEqual(self.ids('?brand=Logitech,Asus'), [self.mouse.id])
+        self.assertEqual(self.ids('?component_type=other'), [self.mouse.id])
+        self.assertEqual(self.ids('?search=Беспроводная'), [self.mouse.id])
+        # Диапазон цен считается по цене со скидкой: 90.90, 92.70 и 94.50 в него не попадают
+        self.assertEqual(self.ids('?min_price=95&max_price=102'), [self.products[0].id, self.products[2].id])
+        in_stock = self.ids('?in_stock=true')
+        self.assertEqual(len(in_stock), 1 + sum(1 for p in self.products if p.stock > 0))
+
+    def test_ordering(self):
+        self.assertEqual(self.ids('?ordering=base_price')[0], self.mouse.id)
+        self.assertEqual(self.ids('?ordering=-base_price')[0], self.products[-1].id)
+        self.assertEqual(self.ids('?ordering=-final_price')[0], self.products[4].id)
+
+    def test_invalid_price(self):
+        for query in ('?min_price=abc', '?min_price=NaN', '?max_price=Infinity', '?max_price=-inf'):
+            response = self.client.get('/api/products/' + query)
+            self.assertEqual(response.status_code, 400, query)
+
+
+class FinalPriceTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Видеокарты')
+
+    def test_save_and_update_keep_final_price_in_sync(self):
+        product = Product.objects.create(name='RTX', category=self.category, base_price='199.99', discount=15)
+        self.assertEqual(product.final_price, Decimal('169.99'))
+
+        Product.objects.filter(pk=product.pk).update(discount=10)
+        product.refresh_from_db()
+        self.assertEqual(product.final_price, Decimal('179.99'))
+
+        Product.objects.filter(pk=product.pk).update(base_price=F('base_price') + 100, discount=0)
+        product.refresh_from_db()
+        self.assertEqual(product.final_price, Decimal('299.99'))
+
+        product.discount = 50
+        product.save(update_fields=['discount'])
+        product.refresh_from_db()
+        self.assertEqual(product.final_price, Decimal('150.00'))
+
+    def test_bulk_paths(self):
+        products = Product.objects.bulk_create([
+            Product(name='A', category=self.category, base_price=10, discount=50),
+            Product(name='B', category=self.category, base_price=20),
+        ])
+        self.assertEqual([p.final_price for p in products], [Decimal('5.00'), Decimal('20.00')])
+        products = list(Product.objects.order_by('name'))
+        for product in products:
+            product.discount = 25
+        Product.objects.bulk_update(products, ['discount'])
+        self.assertEqual(
+            list(Product.objects.order_by('name').values_list('final_price', flat=True)),
+            [Decimal('7.50'), Decimal('15.00')],
+        )
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        category = Category.objects.create(name='Видеокарты')
+        self.gpu = Product.objects.create(name='Видеокарта GeForce RTX 4070', category=category, description='Игровая видеокарта')
+        self.cooler = Product.objects.create(name='Кулер', category=category, description='Подходит для видеокарты GeForce')
+        Product.objects.create(name='Корпус', category=category, description='Башня')
+
+    def search(self, query):
+        response = self.client.get('/api/products/search/' + query)
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data['results']]
+
+    def test_ranked_by_relevance(self):
+        # Совпадение в названии важнее совпадения в описании
+        self.assertEqual(self.search('?q=geforce'), [self.gpu.id, self.cooler.id])
+        self.assertEqual(self.search('?q=видеокарт rtx'), [self.gpu.id])
+        self.assertEqual(self.search('?q='), [])
+
+    def test_filters_apply_before_ranking_limit(self):
+        # Слабое совпадение из другой категории не теряется за лучшими совпадениями
+        other = Category.objects.create(name='Кулеры')
+        weak = Product.objects.create(name='Вентилятор', category=other, description='Для GeForce')
+        self.assertEqual(self.search(f'?q=geforce&category={other.id}'), [weak.id])
+        ranked = search.search_products(Product.objects.filter(category=other), 'geforce', limit=1)
+        self.assertEqual([product.id for product in ranked], [weak.id])
+
+    def test_index_follows_updates_and_deletes(self):
+        Product.objects.filter(pk=self.cooler.pk).update(description='Тихий кулер')
+        self.assertEqual(self.search('?q=geforce'), [self.gpu.id])
+        self.gpu.delete()
+        self.assertEqual(self.search('?q=geforce'), [])
+        self.assertEqual(self.search('?q=тихий'), [self.cooler.id])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def walk(self, url):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data)
+            url = response.data['next']
+        return pages
+
+    def test_products_follow_requested_ordering(self):
+        products = create_catalog(30)
+        pages = self.walk('/api/products/?ordering=-final_price&page_size=7')
+        ids = [item['id'] for page in pages for item in page['results']]
+        expected = [p.id for p in sorted(products, key=lambda p: (-p.final_price, -p.id))]
+        self.assertEqual(ids, expected)
+        self.assertNotIn('count', pages[0])
+
+        previous = self.client.get(pages[2]['previous']).data
+        self.assertEqual(previous['results'], pages[1]['results'])
+
+    def test_orders_keyset_with_equal_timestamps(self):
+        orders = Order.objects.bulk_create([
+            Order(customer_name=f'Клиент {i}', address='Бишкек', delivery='standard', total=10)
+            for i in range(25)
+        ])
+        Order.objects.update(created_at=orders[0].created_at)
+        pages = self.walk('/api/orders/?count=1')
+        self.assertEqual(pages[0]['count'], 25)
+        ids = [item['id'] for page in pages for item in page['results']]
+        self.assertEqual(ids, sorted((o.id for o in Order.objects.all()), reverse=True))
+
+    def test_every_ordering_field_has_keyset_index(self):
+        indexed = {tuple(index.fields) for index in Product._meta.indexes}
+        for field in ProductOrderingFilter.ordering_fields:
+            self.assertIn((field, 'id'), indexed)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/orders/?cursor=zzz').status_code, 404)
+        # Значения курсора неверного типа — тоже 404, а не ошибка SQL
+        def cursor(*values):
+            return base64.urlsafe_b64encode(json.dumps({'r': 0, 'v': values}).encode()).decode()
+
+        for url in (f'/api/orders/?cursor={cursor(None, None)}',
+                    f'/api/orders/?cursor={cursor("вчера", 1)}',
+                    f'/api/orders/?cursor={cursor("2024-01-01T00:00:00+00:00", "abc")}',
+                    f'/api/products/?cursor={cursor("RTX", None)}',
+                    f'/api/products/?ordering=final_price&cursor={cursor("дёшево", 1)}',
+                    f'/api/products/?ordering=created_at&cursor={cursor([1], 1)}'):
+            self.assertEqual(self.client.get(url).status_code, 404, url)
+        self.assertEqual(self.client.get(f'/api/products/?ordering=final_price&cursor={cursor("10.50", "7")}').status_code, 200)
+
+
+class OrderItemTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('manager'))
+        self.products = create_catalog(5)
+        Product.objects.update(stock=100)
+        self.options = list(ComponentOption.objects.all())
+
+    def order_payload(self, **extra):
+        return {'customer_name': 'Айбек', 'address': 'Бишкек', 'delivery': 'standard', 'total': '0', **extra}
+
+    def test_nested_items_created_in_bulk(self):
+        def create(count):
+            items = [{'product': p.id, 'quantity': 2, 'options': [o.id for o in self.options]} for p in self.products[:count]]
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.post('/api/orders/', self.order_payload(order_items=items), format='json')
+            self.assertEqual(response.status_code, 201, response.data)
+            return response, len(ctx.captured_queries)
+
+        _, one = create(1)
+        response, five = create(5)
+        self.assertEqual(one, five)
+        order = Order.objects.get(pk=response.data['id'])
+        self.assertEqual(order.order_items.count(), 5)
+        item = order.order_items.first()
+        unit_price = self.products[0].final_price + sum(o.price for o in self.options)
+        self.assertEqual((item.product, item.unit_price, item.quantity), (self.products[0], unit_price, 2))
+        self.assertEqual(set(item.options.all()), set(self.options))
+
+    def test_options_linked_without_returned_ids(self):
+        # Как на MySQL: bulk_create не проставляет id позиций
+        items = [{'product': p.id, 'options': [self.options[i % 2].id]} for i, p in enumerate(self.products[:3])]
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            response = self.client.post('/api/orders/', self.order_payload(order_items=items), format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        order_items = OrderItem.objects.filter(order_id=response.data['id']).prefetch_related('options')
+        self.assertEqual(
+            [(i.product_id, [o.id for o in i.options.all()]) for i in order_items],
+            [(p.id, [self.options[i % 2].id]) for i, p in enumerate(self.products[:3])],
+        )
+
+    def test_server_computes_total(self):
+        items = [{'product': self.products[1].id, 'quantity': 2, 'options': [self.options[0].id], 'unit_price': '1.00'}]
+        response = self.client.post('/api/orders/', self.order_payload(order_items=items, total='1.00'), format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        expected = (self.products[1].final_price + self.options[0].price) * 2
+        self.assertEqual(Decimal(response.data['total']), expected)
+
+        quote = self.client.post('/api/configurator/quote/', {'order_items': items}, format='json')
+        self.assertEqual(quote.status_code, 200, quote.data)
+        self.assertEqual(Decimal(quote.data['total']), expected)
+        line = quote.data['order_items'][0]
+        self.assertEqual((line['name'], Decimal(line['line_total'])), (self.products[1].name, expected))
+
+    def test_client_prices_are_not_trusted(self):
+        free = {'name': 'free', 'unit_price': '-90.00'}
+        payload = self.order_payload(order_items=[{'product': self.products[0].id}, free], total='10.00')
+        response = self.client.post('/api/orders/', payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('unit_price', response.data['order_items'][1])
+
+        response = self.client.post('/api/orders/', self.order_payload(order_items=[{'name': 'free', 'unit_price': '5.00'}]), format='json')
+        self.assertIn('unit_price', response.data['order_items'][0])
+        response = self.client.post('/api/orders/', self.order_payload(order_items=[{'name': 'Сборка'}], total='999'), format='json')
+        self.assertEqual(Decimal(response.data['total']), 0)
+
+        other = ComponentOption.objects.create(name='Чужая опция', price=-500)
+        response = self.client.post('/api/orders/', self.order_payload(order_items=[
+            {'product': self.products[0].id, 'options': [other.id]},
+        ]), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('options', response.data['order_items'][0])
+
+        staff = APIClient()
+        staff.force_authenticate(User.objects.create_user('admin', is_staff=True))
+        response = staff.post('/api/orders/', self.order_payload(order_items=[free]), format='json')
+        self.assertEqual(response.status_code, 400)
+        response = staff.post('/api/orders/', self.order_payload(order_items=[
+            {'product': self.products[0].id}, {'name': 'Сборка', 'unit_price': '15.00'},
+        ], total='1.00'), format='json')
+        self.assertEqual(Decimal(response.data['total']), self.products[0].final_price + 15)
+        response = self.client.patch(f'/api/orders/{response.data["id"]}/', {'total': '1.00'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_total_must_fit_order(self):
+        # Итог сверх Order.total (max_digits=10) — 400 до записи, а не ошибка БД
+        product = self.products[0]
+        huge = {'product': product.id, 'quantity': 10 ** 9}
+        response = self.client.post('/api/orders/', self.order_payload(order_items=[huge]), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Сумма заказа', str(response.data['order_items']))
+        response = self.client.post('/api/orders/', self.order_payload(order_items=[{**huge, 'quantity': 2 ** 31}]), format='json')
+        self.assertIn('quantity', response.data['order_items'][0])
+
+        legacy = json.dumps([{'product': product.id, 'quantity': 10 ** 9}])
+        response = self.client.post('/api/orders/', self.order_payload(items=legacy), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Сумма заказа', str(response.data['items']))
+        self.assertFalse(Order.objects.exists())
+
+    def test_quote_in_two_queries(self):
+        items = [{'product': p.id, 'options': [o.id for o in self.options]} for p in self.products]
+        client = APIClient()
+        with self.assertNumQueries(2):
+            response = client.post('/api/configurator/quote/', {'order_items': items}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['order_items']), 5)
+        response = client.post('/api/configurator/quote/', {'order_items': [{'product': 999999}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_unknown_product_is_rejected(self):
+        response = self.client.post('/api/orders/', self.order_payload(order_items=[{'product': 999999}]), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('product', response.data['order_items'][0])
+
+    def test_legacy_text_items(self):
+        text = f'{self.products[1].name}, Неизвестный товар'
+        response = self.client.post('/api/orders/', self.order_payload(items=text), format='json')
+        self.assertEqual(response.status_code, 201)
+        items = OrderItem.objects.filter(order_id=response.data['id'])
+        self.assertEqual([(i.name, i.product_id) for i in items], [(self.products[1].name, self.products[1].id), ('Неизвестный товар', None)])
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('manager'))
+        category = Category.objects.create(name='Видеокарты')
+        self.gpu = Product.objects.create(name='RTX 4070', category=category, base_price=500, stock=3)
+        self.cpu = Product.objects.create(name='Ryzen 7', category=category, base_price=300, stock=1)
+
+    def order(self, *items):
+        payload = {'customer_name': 'Айбек', 'address': 'Бишкек', 'delivery': 'standard', 'order_items': [
+            {'product': product.pk, 'quantity': quantity} for product, quantity in items
+        ]}
+        return self.client.post('/api/orders/', payload, format='json')
+
+    def stock(self):
+        return list(Product.objects.filter(pk__in=[self.gpu.pk, self.cpu.pk]).order_by('pk').values_list('stock', flat=True))
+
+    def test_reserve_all_or_nothing(self):
+        self.assertEqual(self.order((self.gpu, 2), (self.cpu, 1)).status_code, 201)
+        self.assertEqual(self.stock(), [1, 0])
+
+        response = self.order((self.gpu, 1), (self.cpu, 1))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['order_items'][0], {})
+        self.assertIn('доступно 0', str(response.data['order_items'][1]['quantity'][0]))
+        # Ни заказа, ни списания по первой позиции
+        self.assertEqual(self.stock(), [1, 0])
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_stock_locked_before_order_rows(self):
+        # Блокировка и списание товаров идут до INSERT заказа и позиций: FK позиций
+        # в InnoDB иначе взял бы на товар разделяемую блокировку раньше FOR UPDATE
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.order((self.cpu, 1), (self.gpu, 1)).status_code, 201)
+        statements = [query['sql'] for query in ctx.captured_queries]
+
+        def first(prefix):
+            return next(i for i, sql in enumerate(statements) if sql.startswith(prefix))
+
+        self.assertLess(first('UPDATE "shop_product"'), first('INSERT INTO "shop_order"'))
+
+    def test_cancel_releases_once(self):
+        order_id = self.order((self.gpu, 2), (self.gpu, 1)).data['id']
+        self.assertEqual(self.stock(), [0, 1])
+        for _ in range(2):
+            response = self.client.patch(f'/api/orders/{order_id}/', {'status': 'Cancelled'}, format='json')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(), [3, 1])
+        self.assertEqual(inventory.cancel_orders(Order.objects.all()), 0)
+
+        # Возврат из отмены снова резервирует, а без остатка — запрещён
+        self.client.patch(f'/api/orders/{order_id}/', {'status': 'Pending'}, format='json')
+        self.assertEqual(self.stock(), [0, 1])
+        inventory.cancel_orders(Order.objects.filter(pk=order_id))
+        Product.objects.filter(pk=self.gpu.pk).update(stock=1)
+        response = self.client.patch(f'/api/orders/{order_id}/', {'status': 'Pending'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.get(pk=order_id).status, 'Cancelled')
+        self.assertEqual(self.stock(), [1, 1])
+
+    def test_admin_cannot_edit_reserved_items(self):
+        order_id = self.order((self.gpu, 2)).data['id']
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pass'))
+        url = f'/admin/shop/order/{order_id}/change/'
+        self.assertNotContains(self.client.get(url), 'name="order_items-0-quantity"')
+        item = OrderItem.objects.get(order_id=order_id)
+        response = self.client.post(url, {
+            'customer_name': 'Айбек', 'address': 'Бишкек', 'delivery': 'standard', 'total': '1000.00',
+            'status': 'Pending', 'items': '',
+            'order_items-TOTAL_FORMS': '1', 'order_items-INITIAL_FORMS': '1',
+            'order_items-0-id': item.pk, 'order_items-0-order': order_id, 'order_items-0-quantity': '1',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(OrderItem.objects.get(pk=item.pk).quantity, 2)
+        self.assertEqual(self.stock(), [1, 1])
+
+
+class StockContentionTests(TransactionTestCase):
+    """
+    Много потоков одновременно оформляют заказы.
+
+    Тестовая БД — SQLite в памяти: она блокирует всю базу, а не строки, и на
+    занятую блокировку сразу отвечает ошибкой, которую hammer повторяет. Так
+    проверяется только корректность — защита от перепродажи и тот же итог,
+    что при последовательном оформлении, — но не порядок блокировок строк и
+    не отсутствие взаимоблокировок в shop.inventory: это видно только на
+    MySQL. Пропускную способность меряет команда benchmark_checkout.
+    """
+
+    def hammer(self, products, threads, orders_per_thread):
+        # Поток i покупает products[i % len(products)]
+        user, _ = User.objects.get_or_create(username='buyer')
+        statuses = []
+        start = threading.Barrier(threads)
+
+        def committed(marker):
+            while True:
+                try:
+                    return Order.objects.filter(comment=marker).exists()
+                except OperationalError:
+                    time.sleep(0.001)
+
+        def buyer(number, product):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                start.wait()
+                for attempt_order in range(orders_per_thread):
+                    # Метка заказа: по ней видно, зафиксирован ли он, если запрос упал
+                    marker = f'{number}-{attempt_order}'
+                    payload = {'customer_name': 'Покупатель', 'address': 'Бишкек', 'delivery': 'standard',
+                               'comment': marker, 'order_items': [{'product': product.pk, 'quantity': 1}]}
+                    for attempt in range(100):
+                        try:
+                            statuses.append(client.post('/api/orders/', payload, format='json').status_code)
+                            break
+                        except OperationalError:
+                            # SQLite в памяти не ждёт блокировку, а сразу отвечает «table is locked».
+                            # Ошибка бывает и после коммита (при сборке ответа), поэтому
+                            # повторяем, только если заказа с этой меткой нет
+                            if committed(marker):
+                                statuses.append(201)
+                                break
+                            time.sleep(random.uniform(0, 0.001 * 2 ** min(attempt, 6)))
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=buyer, args=(i, products[i % len(products)])) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return statuses
+
+    def test_no_overselling(self):
+        # Защита от перепродажи: условный UPDATE не продаёт больше остатка
+        product = Product.objects.create(
+            name='Горячий товар', category=Category.objects.create(name='Акция'), base_price=100, stock=40,
+        )
+        statuses = self.hammer([product], threads=8, orders_per_thread=10)
+
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 0)
+        # Продано ровно столько, сколько было: отказы откатились вместе с заказом
+        self.assertEqual(OrderItem.objects.filter(product=product).count(), 40)
+        self.assertEqual(Order.objects.count(), 40)
+        self.assertEqual((statuses.count(201), statuses.count(400), len(statuses)), (40, 40, 80))
+
+    def test_concurrent_checkout_matches_serial(self):
+        # Товары одной категории: параллельно оформленные заказы дают тот же итог,
+        # что и по одному, и ни один заказ не продублирован повтором
+        category = Category.objects.create(name='Общая')
+        products = [Product.objects.create(name=f'Товар {i}', category=category, base_price=100, stock=100) for i in range(4)]
+        statuses = self.hammer(products, threads=8, orders_per_thread=5)
+
+        self.assertEqual(statuses, [201] * 40)
+        self.assertEqual(sorted(Order.objects.values_list('comment', flat=True)),
+                         sorted(f'{i}-{n}' for i in range(8) for n in range(5)))
+        self.assertEqual(list(Product.objects.filter(category=category).order_by('pk').values_list('stock', flat=True)), [90] * 4)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_checkout', '--threads', '2', '--orders', '2', stdout=out)
+        self.assertIn('separate-categories', out.getvalue())
+        # Свои данные команда удаляет
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(Product.objects.exists())
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('manager', is_staff=True))
+        category = Category.objects.create(name='Видеокарты')
+        self.gpu = Product.objects.create(name='RTX 4070', category=category, base_price=500, stock=10)
+        self.cpu = Product.objects.create(name='Ryzen 7', category=category, base_price=300, stock=10)
+
+    def order(self, delivery, *items):
+        payload = {'customer_name': 'Айбек', 'address': 'Бишкек', 'delivery': delivery, 'order_items': [
+            {'product': product.pk, 'quantity': quantity} for product, quantity in items
+        ]}
+        # Сводки прибавляются после коммита транзакции заказа
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/orders/', payload, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def snapshot(self):
+        return (
+            list(SalesDaily.objects.exclude(orders=0).values_list('date', 'status', 'delivery', 'orders', 'revenue')),
+            list(SalesHourly.objects.exclude(orders=0).values_list('hour', 'status', 'delivery', 'orders', 'revenue')),
+            list(ProductSalesDaily.objects.exclude(units=0).values_list('date', 'product_id', 'status', 'units', 'revenue')),
+        )
+
+    def test_status_change_locks_orders_before_reading(self):
+        # Два параллельных изменения статуса не должны оба вычесть прежний статус:
+        # «до» читается с блокировкой заказа и позиций (на SQLite FOR UPDATE не пишется)
+        order_id = self.order('standard', (self.gpu, 1))
+        select_for_update = QuerySet.select_for_update
+        with mock.patch.object(QuerySet, 'select_for_update', autospec=True, side_effect=select_for_update) as locked:
+            Order.objects.filter(pk=order_id).update(status='Shipped')
+        self.assertTrue({Order, OrderItem} <= {call.args[0].model for call in locked.call_args_list})
+
+    def test_incremental_matches_rebuild(self):
+        first = self.order('standard', (self.gpu, 2), (self.cpu, 1))
+        second = self.order('express', (self.gpu, 1))
+        self.order('pickup', (self.cpu, 3))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/orders/{second}/', {'status': 'Cancelled'}, format='json')
+            Order.objects.filter(pk=first).update(delivery='express')
+            Order.objects.create(customer_name='Старый', address='Ош', delivery='standard', total=77, items='Кулер')
+            Order.objects.get(customer_name='Старый').delete()
+
+        today = timezone.localdate()
+        self.assertEqual(
+            list(SalesDaily.objects.filter(date=today).exclude(orders=0).values_list('status', 'delivery', 'orders', 'revenue')),
+            [('Cancelled', 'express', 1, Decimal('500.00')), ('Pending', 'express', 1, Decimal('1300.00')),
+             ('Pending', 'pickup', 1, Decimal('900.00'))],
+        )
+        gpu_sales = ProductSalesDaily.objects.filter(product=self.gpu).exclude(units=0)
+        self.assertEqual(sorted(gpu_sales.values_list('status', 'units')), [('Cancelled', 1), ('Pending', 2)])
+
+        incremental = self.snapshot()
+        out = StringIO()
+        call_command('rebuild_sales_rollups', stdout=out)
+        self.assertIn('Учтено заказов: 3', out.getvalue())
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_checkout_does_not_write_rollups_in_its_transaction(self):
+        payload = {'customer_name': 'Айбек', 'address': 'Бишкек', 'delivery': 'standard',
+                   'order_items': [{'product': self.gpu.pk, 'quantity': 1}]}
+        with self.captureOnCommitCallbacks() as callbacks:
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.client.post('/api/orders/', payload, format='json').status_code, 201)
+        self.assertFalse([q for q in ctx.captured_queries if 'shop_sales' in q['sql'] or 'shop_productsales' in q['sql']])
+        self.assertFalse(SalesDaily.objects.exists())
+        for callback in callbacks:
+            callback()
+        self.assertEqual(list(SalesDaily.objects.values_list('orders', 'revenue')), [(1, Decimal('500.00'))])
+
+    def test_analytics_api(self):
+        self.order('standard', (self.gpu, 2))
+        self.order('standard', (self.cpu, 1))
+        self.assertIn(APIClient().get('/api/analytics/sales/').status_code, (401, 403))
+
+        # Отчёт читает только сводку: число запросов не зависит от числа заказов
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/analytics/sales/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['totals'], {'Pending': {'orders': 2, 'revenue': '1300.00'}})
+        self.assertEqual(response.data['results'][0]['period'], timezone.localdate())
+
+        hourly = self.client.get('/api/analytics/sales/?granularity=hour&status=Cancelled').data
+        self.assertEqual(hourly['results'], [])
+        self.assertEqual(self.client.get('/api/analytics/sales/?granularity=week').status_code, 400)
+        self.assertEqual(self.client.get('/api/analytics/sales/?from=2024-01-01&to=2023-01-01').status_code, 400)
+
+        top = self.client.get('/api/analytics/products/').data['results']
+        self.assertEqual([(row['name'], row['units'], row['revenue']) for row in top],
+                         [('RTX 4070', 2, '1000.00'), ('Ryzen 7', 1, '300.00')])
+        self.assertEqual(len(self.client.get('/api/analytics/products/?limit=1').data['results']), 1)
+        for limit in ('0', '-1', 'abc'):
+            self.assertEqual(self.client.get(f'/api/analytics/products/?limit={limit}').status_code, 400, limit)
+
+
+class CategoryCounterTests(TestCase):
+    def setUp(self):
+        self.gpus = Category.objects.create(name='Видеокарты')
+        self.cpus = Category.objects.create(name='Процессоры')
+
+    def counters(self, category):
+        category.refresh_from_db()
+        return (category.product_count, category.in_stock_count, category.total_stock, category.catalog_value)
+
+    def test_counters_follow_every_write_path(self):
+        stale = Category.objects.get(pk=self.gpus.pk)
+        gpu = Product.objects.create(name='RTX 4070', category=self.gpus, base_price='500.50', stock=3)
+        Product.objects.bulk_create([
+            Product(name='RTX 4060', category=self.gpus, base_price=300, stock=0),
+            Product(name='Ryzen 5', category=self.cpus, base_price=200, stock=5),
+        ])
+        self.assertEqual(self.counters(self.gpus), (2, 1, 3, Decimal('800.50')))
+        # Сохранение устаревшего объекта категории не затирает счётчики
+        stale.name = 'Графика'
+        stale.save()
+        self.assertEqual(self.counters(self.gpus), (2, 1, 3, Decimal('800.50')))
+
+        Product.objects.filter(name='RTX 4060').update(stock=2, category=self.cpus)
+        gpu.stock = 0
+        gpu.save()
+        self.assertEqual(self.counters(self.gpus), (1, 0, 0, Decimal('500.50')))
+        self.assertEqual(self.counters(self.cpus), (2, 2, 7, Decimal('500.00')))
+
+        importer.import_catalog(BytesIO('sku,name,category,stock\nX-1,Ryzen 9,Процессоры,4'.encode('utf-8')))
+        Product.objects.filter(sku='X-1').update(base_price=700)
+        Product.objects.filter(name='Ryzen 5').delete()
+        self.assertEqual(self.counters(self.cpus), (2, 2, 6, Decimal('1000.00')))
+        self.assertEqual(counters.reconcile(dry_run=True), [])
+
+    def test_checkout_does_not_lock_category(self):
+        gpu = Product.objects.create(name='RTX 4070', category=self.gpus, base_price=500, stock=1)
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('buyer'))
+        payload = {'customer_name': 'Айбек', 'address': 'Бишкек', 'delivery': 'standard',
+                   'order_items': [{'product': gpu.pk, 'quantity': 1}]}
+        with self.captureOnCommitCallbacks() as callbacks:
+            with CaptureQueriesContext(connection) as ctx:
+                order_id = client.post('/api/orders/', payload, format='json').data['id']
+        # В транзакции заказа нет ни чтения, ни UPDATE строки категории
+        self.assertFalse([q['sql'] for q in ctx.captured_queries if 'shop_category' in q['sql']])
+        self.assertEqual(self.counters(self.gpus), (1, 1, 1, Decimal('500.00')))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.counters(self.gpus), (1, 0, 0, Decimal('500.00')))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            client.patch(f'/api/orders/{order_id}/', {'status': 'Cancelled'}, format='json')
+        self.assertEqual(self.counters(self.gpus), (1, 1, 1, Decimal('500.00')))
+        self.assertEqual(counters.reconcile(dry_run=True), [])
+
+    def test_merge_and_reconcile(self):
+        Product.objects.create(name='RTX 4070', category=self.gpus, base_price=500, stock=3)
+        Product.objects.create(name='Ryzen 5', category=self.cpus, base_price=200, stock=0)
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        self.client.force_login(admin_user)
+        self.client.post('/admin/shop/category/', {
+            'action': 'merge_categories', '_selected_action': [self.gpus.pk, self.cpus.pk],
+        })
+        main = Category.objects.get()
+        self.assertEqual(self.counters(main), (2, 1, 3, Decimal('700.00')))
+
+        Category._base_manager.filter(pk=main.pk).update(product_count=99, total_stock=0)
+        out = StringIO()
+        call_command('reconcile_category_counters', stdout=out)
+        self.assertIn('product_count: 99 -> 2', out.getvalue())
+        self.assertEqual(self.counters(main), (2, 1, 3, Decimal('700.00')))
+
+        data = APIClient().get('/api/categories/').data
+        rows = data['results'] if isinstance(data, dict) else data
+        self.assertEqual((rows[0]['product_count'], rows[0]['in_stock_count']), (2, 1))
+
+
+class CsvExportTests(TestCase):
+    def test_product_export_reads_in_chunks(self):
+        create_catalog(7)
+        rows = product_rows(Product.objects.all(), chunk_size=3)
+        with self.assertNumQueries(3):  # 7 товаров порциями по 3
+            data = list(rows)
+        self.assertEqual(len(data), 8)
+        self.assertEqual(data[1][2], 'Комплектующие')
+
+    def test_admin_action_streams(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+        self.client.force_login(admin)
+        order = Order.objects.create(customer_name='Айбек', address='Бишкек', delivery='pickup', total=10)
+        OrderItem.objects.create(order=order, name='RTX 4070', quantity=2)
+        response = self.client.post('/admin/shop/order/', {'action': 'export_to_csv', '_selected_action': [order.pk]})
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode()
+        self.assertIn('RTX 4070 x2', content)
+
+    def test_management_command(self):
+        create_catalog(2)
+        out = StringIO()
+        call_command('export_csv', 'products', stdout=out)
+        self.assertEqual(len(out.getvalue().strip().splitlines()), 3)
+
+
+class BulkPriceTests(TestCase):
+    def setUp(self):
+        self.products = create_catalog(4)
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass')
+
+    def test_apply_is_set_based_and_records_history(self):
+        # SAVEPOINT, SELECT FOR UPDATE, UPDATE, SELECT, INSERT истории, RELEASE
+        # и счётчики категорий: id, два чтения с блокировкой, UPDATE категорий
+        with self.assertNumQueries(10):
+            updated = apply_price_change(Product.objects.all(), percent=Decimal('12.5'), user=self.admin)
+        self.assertEqual(updated, 4)
+        product = Product.objects.get(pk=self.products[1].pk)  # 101.00, скидка 10%
+        self.assertEqual(product.base_price, Decimal('113.63'))
+        self.assertEqual(product.final_price, Decimal('102.27'))
+        change = PriceChange.objects.get(product=product)
+        self.assertEqual((change.old_price, change.new_price, change.changed_by), (Decimal('101.00'), Decimal('113.63'), self.admin))
+
+    def test_delta_never_goes_negative(self):
+        apply_price_change(ComponentOption.objects.all(), delta=Decimal('-60'))
+        self.assertEqual(sorted(ComponentOption.objects.values_list('price', flat=True)), [Decimal('0.00'), Decimal('30.00')])
+
+    def test_preview(self):
+        with self.assertNumQueries(1):
+            stats = preview_price_change(Product.objects.all(), percent=-10)
+        self.assertEqual(stats['count'], 4)
+        self.assertEqual((stats['old_min'], stats['new_max']), (Decimal('100.00'), Decimal('92.70')))
+
+    def test_admin_preview_then_apply(self):
+        self.client.force_login(self.admin)
+        data = {'action': 'adjust_prices', '_selected_action': [p.pk for p in self.products], 'mode': 'delta', 'value': '5'}
+        response = self.client.post('/admin/shop/product/', {**data, 'preview': '1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['preview']['new_max'], Decimal('108.00'))
+        self.assertFalse(PriceChange.objects.exists())
+        response = self.client.post('/admin/shop/product/', {**data, 'apply': '1'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(PriceChange.objects.count(), 4)
+
+
+class AdminQueryCountTests(TestCase):
+    """Количество запросов страниц админки не должно зависеть от числа строк."""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pass'))
+        # Первый запрос прогревает кэши admin_interface и сессии
+        self.client.get('/admin/')
+
+    def add_rows(self, count):
+        products = create_catalog(count)
+        for product in products:
+            order = Order.objects.create(customer_name='Клиент', address='Бишкек', delivery='standard', total=1)
+            OrderItem.objects.create(order=order, product=product, name=product.name, quantity=1)
+        apply_price_change(Product.objects.filter(pk__in=[p.pk for p in products]), percent=1)
+        return products
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_changelists(self):
+        urls = [
+            '/admin/shop/product/',
+            '/admin/shop/componentoption/',
+            '/admin/shop/category/',
+            '/admin/shop/order/',
+            '/admin/shop/pricechange/',
+        ]
+        self.add_rows(2)
+        before = {url: self.count_queries(url) for url in urls}
+        self.add_rows(8)
+        after = {url: self.count_queries(url) for url in urls}
+        self.assertEqual(before, after)
+
+    def test_product_change_form_with_inlines(self):
+        products = self.add_rows(1)
+        product = products[0]
+        self.client.get(f'/admin/shop/product/{product.pk}/change/')
+        few = self.count_queries(f'/admin/shop/product/{product.pk}/change/')
+        product.components.set(ComponentOption.objects.create(name=f'Опция {i}', type='ram') for i in range(6))
+        many = self.count_queries(f'/admin/shop/product/{product.pk}/change/')
+        self.assertEqual(few, many)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        caches['catalog'].clear()
+        self.client = APIClient()
+        self.products = create_catalog(3)
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_repeated_reads_skip_database(self):
+        self.assertEqual(self.get('/api/products/?ordering=name')['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.get('/api/products/?ordering=name')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(len(response.data['results']), 3)
+        # Другой query string — другой ключ
+        self.assertEqual(self.get('/api/products/?ordering=-name')['X-Cache'], 'MISS')
+
+    def test_invalidation(self):
+        product = self.products[0]
+        url = f'/api/products/{product.pk}/'
+        self.get(url)
+        self.get('/api/categories/')
+
+        product.category.name = 'Память'
+        product.category.save()
+        self.assertEqual(self.get(url).data['category_name'], 'Память')
+        self.assertEqual(self.get('/api/categories/').data['results'][0]['name'], 'Память')
+
+        ComponentOption.objects.filter(pk=product.components.first().pk).update(name='DDR4')
+        self.assertIn('DDR4', [c['name'] for c in self.get(url).data['components']])
+
+        product.compatible_with.clear()
+        self.assertEqual(self.get(url).data['compatible_with'], [])
+
+        Product.objects.filter(pk=product.pk).update(stock=42)
+        self.assertEqual(self.get(url).data['stock'], 42)
+
+    def test_category_cache_survives_product_changes(self):
+        self.get('/api/categories/')
+        self.products[0].name = 'Новое название'
+        self.products[0].save()
+        self.assertEqual(self.get('/api/categories/')['X-Cache'], 'HIT')
+        # Удаление товара меняет счётчики категории
+        self.products[0].delete()
+        self.assertEqual(self.get('/api/categories/')['X-Cache'], 'MISS')
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        caches['catalog'].clear()
+        self.client = APIClient()
+        self.products = create_catalog(2)
+
+    def test_list_without_catalog_cache_is_not_conditional(self):
+        # С dummy-кэшем версий нет: постоянный ETag давал бы 304 после любых изменений
+        dummy = {
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'catalog': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+        }
+        with override_settings(CACHES=dummy):
+            response = self.client.get('/api/products/')
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.has_header('ETag'))
+            self.assertEqual(self.client.get('/api/products/', HTTP_IF_NONE_MATCH='*').status_code, 200)
+
+    def test_list_revalidation(self):
+        response = self.client.get('/api/products/')
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        # Другой query string — другой ETag
+        self.assertNotEqual(self.client.get('/api/products/?ordering=-name')['ETag'], etag)
+
+        Product.objects.filter(pk=self.products[0].pk).update(stock=0)
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('Last-Modified'))
+
+    def test_detail_follows_related_changes(self):
+        product = self.products[1]
+        url = f'/api/products/{product.pk}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Правка другого товара не влияет на ETag этого
+        self.products[0].name = 'Другой'
+        self.products[0].save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        for change in (
+            lambda: ComponentOption.objects.filter(product=product).update(volume='64GB'),
+            lambda: Category.objects.filter(pk=product.category_id).update(name='ОЗУ'),
+            lambda: product.compatible_with.clear(),
+        ):
+            change()
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+
+    def test_related_bulk_updates_touch_products_with_one_query(self):
+        product = self.products[1]
+        product.refresh_from_db()
+        touched = product.updated_at
+        category = Category.objects.filter(pk=product.category_id)
+        # Поля, которых нет в ответе по товару, товары не трогают
+        with self.assertNumQueries(1):
+            category.update(in_stock_count=F('in_stock_count'))
+        with self.assertNumQueries(1):
+            ComponentOption.objects.filter(product=product).update(type='ram')
+        product.refresh_from_db()
+        self.assertEqual(product.updated_at, touched)
+
+        # Товары отбираются подзапросом до изменения, даже если фильтр — по изменяемому полю
+        name = category.get().name
+        with self.assertNumQueries(2):
+            Category.objects.filter(name=name).update(name='ОЗУ')
+        product.refresh_from_db()
+        self.assertGreater(product.updated_at, touched)
+
+    def test_categories(self):
+        response = self.client.get('/api/categories/')
+        self.assertEqual(self.client.get('/api/categories/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        Category.objects.create(name='Новая')
+        self.assertEqual(self.client.get('/api/categories/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        caches['catalog'].clear()
+        self.client = APIClient()
+        self.product = create_catalog(1)[0]
+
+    def test_list_and_detail_representations(self):
+        item = self.client.get('/api/products/').data['results'][0]
+        self.assertNotIn('description', item)
+        self.assertNotIn('components', item)
+        self.assertIn('final_price', item)
+        detail = self.client.get(f'/api/products/{self.product.pk}/').data
+        self.assertIn('description', detail)
+        self.assertIn('components', detail)
+
+    def test_fields_and_expand(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/products/?fields=id,name,final_price')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name', 'final_price'})
+        sql = ctx.captured_queries[-1]['sql']
+        self.assertNotIn('shop_category', sql)
+        self.assertNotIn('"description"', sql)
+
+        response = self.client.get('/api/products/?expand=description')
+        self.assertIn('description', response.data['results'][0])
+        response = self.client.get(f'/api/products/{self.product.pk}/?fields=id,components')
+        self.assertEqual(set(response.data), {'id', 'components'})
+
+    def test_unknown_field(self):
+        self.assertEqual(self.client.get('/api/products/?fields=id,secret').status_code, 400)
+
+
+class CompatibilityTests(TestCase):
+    def setUp(self):
+        caches['catalog'].clear()
+        compatibility.graph.loaded = False
+        self.client = APIClient()
+        category = Category.objects.create(name='Комплектующие')
+
+        def make(name, component_type):
+            return Product.objects.create(name=name, category=category, base_price=100, component_type=component_type)
+
+        self.am5 = make('Ryzen 7', 'cpu')
+        self.lga = make('Core i7', 'cpu')
+        self.board_am5 = make('B650', 'motherboard')
+        self.board_lga = make('Z790', 'motherboard')
+        self.gpu = make('RTX 4070', 'gpu')
+        self.am5.compatible_with.add(self.board_am5)
+        self.board_lga.compatible_with.add(self.lga)
+
+    def test_candidates_and_validation_without_queries(self):
+        graph = compatibility.get_graph()
+        with self.assertNumQueries(0):
+            candidates = graph.candidates({'cpu': self.am5.pk})
+            self.assertEqual(candidates['motherboard'], [self.board_am5.pk])
+            self.assertEqual(candidates['gpu'], [self.gpu.pk])
+            self.assertEqual(graph.candidates({'motherboard': self.board_lga.pk})['cpu'], [self.lga.pk])
+            self.assertEqual(graph.validate({'cpu': self.am5.pk, 'motherboard': self.board_am5.pk, 'gpu': self.gpu.pk}), [])
+            errors = graph.validate({'cpu': self.lga.pk, 'motherboard': self.board_am5.pk})
+            self.assertEqual([error['error'] for error in errors], ['incompatible'])
+            errors = graph.validate({'gpu': self.am5.pk})
+            self.assertEqual(errors[0]['error'], 'wrong_type')
+
+    def test_graph_follows_relation_changes(self):
+        graph = compatibility.get_graph()
+        self.lga.compatible_with.add(self.board_am5)
+        self.board_am5.compatible_with.remove(self.am5)  # связи в обратную сторону не было
+        with self.assertNumQueries(0):
+            self.assertEqual(graph.candidates({'cpu': self.lga.pk})['motherboard'], [self.board_am5.pk, self.board_lga.pk])
+
+        # Связей плат с Ryzen не осталось, но Z790 по-прежнему ограничена своим процессором
+        self.board_am5.product_set.clear()
+        self.assertEqual(compatibility.get_graph().candidates({'cpu': self.am5.pk})['motherboard'], [self.board_am5.pk])
+
+        self.gpu.component_type = 'psu'
+        self.gpu.save()
+        self.assertEqual(compatibility.get_graph().candidates({})['psu'], [self.gpu.pk])
+        self.board_lga.delete()
+        self.assertNotIn(self.board_lga.pk, compatibility.get_graph().types)
+
+    def test_saves_without_type_change_keep_graph_version(self):
+        # Граф не загружен в этом процессе, но другие процессы перечитывают его по версии
+        def version():
+            return catalog_cache.get_versions([compatibility.NAMESPACE])[0]
+
+        before = version()
+        product = Product.objects.get(pk=self.gpu.pk)
+        product.stock = 5
+        product.save()
+        product.name = 'RTX 4070 Super'
+        product.save(update_fields=['name'])
+        self.assertEqual(version(), before)
+
+        product.component_type = 'psu'
+        product.save(update_fields=['component_type'])
+        self.assertNotEqual(version(), before)
+        changed = version()
+        product.save()
+        self.assertEqual(version(), changed)
+
+    def test_bulk_changes_reload_graph(self):
+        compatibility.get_graph()
+        Product.objects.filter(pk=self.gpu.pk).update(component_type='storage')
+        self.assertEqual(compatibility.get_graph().candidates({})['storage'], [self.gpu.pk])
+
+    def test_endpoint(self):
+        response = self.client.get('/api/configurator/compatibility/', {'cpu': self.am5.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['valid'])
+        self.assertFalse(response.data['complete'])
+        self.assertEqual(response.data['candidates']['motherboard'], [self.board_am5.pk])
+
+        response = self.client.post(
+            '/api/configurator/compatibility/', {'cpu': self.am5.pk, 'motherboard': self.board_lga.pk}, format='json',
+        )
+        self.assertFalse(response.data['valid'])
+        self.assertNotIn('cpu', response.data['candidates'])
+        self.assertEqual(self.client.get('/api/configurator/compatibility/?cpu=abc').status_code, 400)
+
+
+class ConfiguratorPartsTests(TestCase):
+    def setUp(self):
+        caches['catalog'].clear()
+        self.client = APIClient()
+        self.products = create_catalog(4)  # stock = i % 3: товар 000 не в наличии
+        Product.objects.exclude(pk=self.products[1].pk).update(component_type='other')
+        Product.objects.filter(pk=self.products[2].pk).update(component_type='gpu')
+
+    def test_parts_grouped_by_type_in_two_queries(self):
+        # Товары и id их вариантов; число запросов не зависит от числа вариантов
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/configurator/')
+        self.assertEqual(response.status_code, 200)
+        parts = response.data['parts']
+        options = sorted(self.products[1].components.values_list('id', flat=True))
+        self.assertEqual(parts['ram'], [[self.products[1].pk, 'Товар 001', '90.90', options]])
+        self.assertEqual([row[0] for row in parts['gpu']], [self.products[2].pk])
+        self.assertEqual(parts['cpu'], [])  # остальные товары типа other или не в наличии
+        self.assertEqual(response.data['fields'], ('id', 'name', 'price', 'options'))
+
+        with self.assertNumQueries(0):
+            self.client.get('/api/configurator/')
+        Product.objects.filter(pk=self.products[2].pk).update(stock=0)
+        self.assertEqual(self.client.get('/api/configurator/').data['parts']['gpu'], [])
+
+
+def make_image(width, height, name='photo.png', mode='RGBA'):
+    buffer = BytesIO()
+    Image.new(mode, (width, height), (200, 30, 30, 128) if mode == 'RGBA' else (200, 30, 30)).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        self.category = Category.objects.create(name='Видеокарты')
+
+    def test_variants_created_on_upload(self):
+        product = Product.objects.create(name='RTX', category=self.category, image=make_image(1200, 600))
+        variants = product.image_variants
+        self.assertEqual(variants['source'], product.image.name)
+        self.assertEqual(sorted(variants['webp'], key=int), ['160', '480', '960'])
+        with default_storage.open(variants['jpeg']['480']) as file:
+            self.assertEqual(Image.open(file).size, (480, 240))
+        with default_storage.open(variants['webp']['160']) as file:
+            self.assertEqual(Image.open(file).format, 'WEBP')
+
+        # Без смены изображения копии не пересоздаются, при замене старые удаляются
+        product.name = 'RTX 4070'
+        product.save()
+        self.assertEqual(product.image_variants, variants)
+        product.image = make_image(300, 300, name='small.png')
+        product.save()
+        self.assertEqual(list(product.image_variants['jpeg']), ['160'])
+        self.assertFalse(default_storage.exists(variants['jpeg']['960']))
+
+    def test_same_stem_does_not_share_variants(self):
+        png = Product.objects.create(name='A', category=self.category, image=make_image(600, 300, name='a.png'))
+        jpg = Product.objects.create(name='B', category=self.category, image=make_image(600, 300, name='a.jpg'))
+        self.assertFalse(set(images.variant_files(png.image_variants)) & set(images.variant_files(jpg.image_variants)))
+        jpg.image = None
+        jpg.save()
+        self.assertTrue(all(default_storage.exists(name) for name in images.variant_files(png.image_variants)))
+
+    def test_serializer_exposes_variant_urls(self):
+        product = Product.objects.create(name='RTX', category=self.category, stock=1, image=make_image(600, 400))
+        item = APIClient().get('/api/products/').data['results'][0]
+        self.assertEqual(item['id'], product.pk)
+        self.assertTrue(item['image_variants']['webp']['480'].startswith('http://testserver/media/products/variants/'))
+
+    def test_backfill_command(self):
+        product = Product.objects.create(name='RTX', category=self.category, image=make_image(500, 500))
+        Product.objects.filter(pk=product.pk).update(image_variants={})
+        Product.objects.create(name='Без фото', category=self.category)
+        out = StringIO()
+        call_command('generate_image_variants', workers=1, stdout=out)
+        product.refresh_from_db()
+        self.assertEqual(sorted(product.image_variants['jpeg'], key=int), ['160', '480'])
+        self.assertIn('Обработано изображений: 1', out.getvalue())
+
+
+class Model3dDeliveryTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        override = override_settings(MEDIA_ROOT=self.media, MODEL_3D_SENDFILE='')
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        self.data = bytes(range(256)) * 400
+        product = Product.objects.create(
+            name='Корпус', category=Category.objects.create(name='Корпуса'),
+            model_3d=SimpleUploadedFile('case.glb', self.data),
+        )
+        self.url = product.model_3d.url
+
+    def get(self, **headers):
+        response = self.client.get(self.url, **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_full_file_and_sidecar(self):
+        response, body = self.get()
+        self.assertEqual((response.status_code, body), (200, self.data))
+        self.assertEqual(response['Content-Type'], 'model/gltf-binary')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('max-age=', response['Cache-Control'])
+
+        response, body = self.get(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(body), self.data)
+        self.assertNotEqual(response['ETag'], self.get()[0]['ETag'])
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_ranges(self):
+        response, body = self.get(HTTP_RANGE='bytes=100-199')
+        self.assertEqual((response.status_code, body), (206, self.data[100:200]))
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.data)}')
+
+        response, body = self.get(HTTP_RANGE='bytes=-50', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual((response.status_code, body), (206, self.data[-50:]))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        response, _ = self.get(HTTP_RANGE=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, 416)
+
+        # Файл сменился (другой ETag в If-Range) — отдаём целиком
+        response, body = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual((response.status_code, len(body)), (200, len(self.data)))
+
+    def test_conditional_and_sendfile(self):
+        etag = self.get()[0]['ETag']
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag)[0].status_code, 304)
+        with override_settings(MODEL_3D_SENDFILE='nginx', MODEL_3D_ACCEL_PREFIX='/protected-media/'):
+            response, body = self.get()
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.url[len('/media/'):])
+        self.assertEqual(body, b'')
+        self.assertEqual(self.client.get('/media/3d_models/../../settings.py').status_code, 404)
+
+
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        override = override_settings(
+            MEDIA_ROOT=self.media, UPLOAD_TEMP_DIR=os.path.join(self.media, 'tmp'), UPLOAD_READ_SIZE=1000,
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('manager', is_staff=True))
+        self.product = Product.objects.create(name='Корпус', category=Category.objects.create(name='Корпуса'))
+        self.data = bytes(range(256)) * 40  # 10240 байт
+
+    def start(self, **extra):
+        payload = {'product': self.product.pk, 'field': 'model_3d', 'filename': 'case.glb', 'size': len(self.data), **extra}
+        response = self.client.post('/api/uploads/', payload, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def put(self, session_id, start, end, checksum=None, body=None):
+        body = self.data[start:end + 1] if body is None else body
+        return self.client.generic(
+            'PUT', f'/api/uploads/{session_id}/chunk/', body, content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{len(self.data)}',
+            HTTP_X_CHUNK_SHA256=checksum or hashlib.sha256(self.data[start:end + 1]).hexdigest(),
+        )
+
+    def test_resumable_upload(self):
+        session_id = self.start(sha256=hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(self.put(session_id, 0, 4095).data['received'], 4096)
+
+        # Повреждённая часть отбрасывается, продолжаем с того же места
+        response = self.put(session_id, 4096, 8191, body=b'x' * 4096)
+        self.assertEqual((response.status_code, response.data['received']), (400, 4096))
+        self.assertEqual(os.path.getsize(os.path.join(self.media, 'tmp', f'{session_id}.part')), 4096)
+        # Часть не с того места
+        self.assertEqual(self.put(session_id, 8192, 10239).status_code, 409)
+
+        self.assertEqual(self.client.get(f'/api/uploads/{session_id}/').data['received'], 4096)
+        self.assertEqual(self.client.post(f'/api/uploads/{session_id}/finalize/').status_code, 409)
+        self.put(session_id, 4096, 8191)
+        self.put(session_id, 8192, 10239)
+
+        response = self.client.post(f'/api/uploads/{session_id}/finalize/')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.product.refresh_from_db()
+        with self.product.model_3d.open('rb') as file:
+            self.assertEqual(file.read(), self.data)
+        self.assertTrue(os.path.exists(self.product.model_3d.path + '.gz'))
+        self.assertIsNotNone(UploadSession.objects.get(pk=session_id).completed_at)
+
+    def test_finalize_keeps_concurrent_changes(self):
+        session_id = self.start()
+        self.put(session_id, 0, len(self.data) - 1)
+        session = UploadSession.objects.select_related('product').get(pk=session_id)
+        # Пока шла загрузка, заказ списал остаток, а менеджер сменил цену
+        Product.objects.filter(pk=self.product.pk).update(stock=7, base_price=300)
+        uploads.finalize(session)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.base_price), (7, Decimal('300.00')))
+        self.assertTrue(self.product.model_3d)
+        # Повторный finalize по устаревшему объекту сессии не прикрепит файл второй раз
+        session.completed_at = None
+        with self.assertRaises(uploads.UploadError):
+            uploads.finalize(session)
+
+    def test_checksum_mismatch_restarts_upload(self):
+        session_id = self.start(sha256='0' * 64)
+        self.put(session_id, 0, len(self.data) - 1)
+        response = self.client.post(f'/api/uploads/{session_id}/finalize/')
+        self.assertEqual((response.status_code, response.data['received']), (400, 0))
+        self.assertEqual(os.path.getsize(os.path.join(self.media, 'tmp', f'{session_id}.part')), 0)
+        self.assertEqual(self.put(session_id, 0, len(self.data) - 1).status_code, 200)
+
+    def test_image_upload_and_permissions(self):
+        buffer = BytesIO()
+        Image.new('RGB', (400, 200), 'red').save(buffer, 'PNG')
+        self.data = buffer.getvalue()
+        session_id = self.start(field='image', filename='photo.png')
+        self.put(session_id, 0, len(self.data) - 1)
+        self.assertEqual(self.client.post(f'/api/uploads/{session_id}/finalize/').status_code, 200)
+        self.product.refresh_from_db()
+        self.assertIn('160', self.product.image_variants['webp'])
+
+        anonymous = APIClient()
+        self.assertEqual(anonymous.get(f'/api/uploads/{session_id}/').status_code, 401)
+        with override_settings(UPLOAD_MAX_SIZE=100):
+            response = self.client.post('/api/uploads/', {
+                'product': self.product.pk, 'field': 'image', 'filename': 'big.png', 'size': 101,
+            }, format='json')
+        self.assertEqual(response.status_code, 413)
+
+
+class CatalogImportTests(TestCase):
+    def setUp(self):
+        self.options = list(ComponentOption.objects.bulk_create([
+            ComponentOption(name='DDR5', price=50, volume='16GB', type='ram'),
+            ComponentOption(name='DDR5', price=90, volume='32GB', type='ram'),
+        ]))
+        self.existing = Product.objects.create(
+            name='Старое название', sku='CPU-1', category=Category.objects.create(name='Процессоры'), base_price=10,
+        )
+
+    def csv_file(self, count):
+        lines = ['sku,name,category,base_price,discount,stock,component_type,components,compatible_with']
+        option_ids = ';'.join(str(o.pk) for o in self.options)
+        lines.append(f'CPU-1,Ryzen 7,Процессоры,300,10,5,cpu,,MB-{count - 1}')
+        for i in range(count):
+            lines.append(f'MB-{i},Плата {i},Материнские платы,{100 + i},0,{i % 4},motherboard,{option_ids},')
+        return BytesIO('\n'.join(lines).encode('utf-8'))
+
+    def test_batched_import(self):
+        with CaptureQueriesContext(connection) as small:
+            report = importer.import_catalog(self.csv_file(10), batch_size=100)
+        self.assertEqual((report['created'], report['updated'], report['error_count']), (10, 1, 0))
+
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.name, self.existing.final_price), ('Ryzen 7', Decimal('270.00')))
+        board = Product.objects.get(sku='MB-9')
+        self.assertEqual(board.category.name, 'Материнские платы')
+        self.assertEqual(set(board.components.all()), set(self.options))
+        self.assertEqual(list(self.existing.compatible_with.all()), [board])
+
+        # Повторный импорт того же объёма в 10 раз больше — столько же запросов на пачку
+        with CaptureQueriesContext(connection) as large:
+            report = importer.import_catalog(self.csv_file(100), batch_size=200)
+        # Строки без изменений не переписываются; у CPU-1 сменилась только совместимость
+        self.assertEqual((report['created'], report['updated'], report['unchanged']), (90, 1, 10))
+        self.assertLessEqual(len(large.captured_queries), len(small.captured_queries) + 2)
+
+    def test_row_errors(self):
+        data = '\n'.join([
+            json.dumps({'sku': 'A', 'name': 'Новый', 'category': 'Разное', 'base_price': '5'}),
+            json.dumps({'sku': 'B', 'name': 'Без категории'}),
+            json.dumps({'sku': 'C', 'name': 'Цена', 'category': 'Разное', 'base_price': 'abc'}),
+            '{broken',
+            json.dumps({'sku': 'D', 'name': 'Опции', 'category': 'Разное', 'components': [999999]}),
+            json.dumps({'sku': 'E', 'name': 'Совместимость', 'category': 'Разное', 'compatible_with': ['A', 'NOPE']}),
+        ])
+        report = importer.import_catalog(BytesIO(data.encode('utf-8')), format='jsonl')
+        self.assertEqual((report['created'], report['error_count']), (2, 5))
+        self.assertEqual([error['row'] for error in report['errors']], [3, 4, 2, 5, None])
+        self.assertEqual(list(Product.objects.get(sku='E').compatible_with.values_list('sku', flat=True)), ['A'])
+
+    def test_relation_only_changes_update_etag(self):
+        importer.import_catalog(self.csv_file(2))
+        board = Product.objects.get(sku='MB-0')
+        client = APIClient()
+        etags = {pk: client.get(f'/api/products/{pk}/')['ETag'] for pk in (board.pk, self.existing.pk)}
+
+        feed = f'sku,components,compatible_with\nMB-0,{self.options[0].pk},\nCPU-1,,MB-0\n'
+        report = importer.import_catalog(BytesIO(feed.encode('utf-8')))
+        self.assertEqual((report['updated'], report['unchanged']), (2, 0))
+        for pk, etag in etags.items():
+            self.assertEqual(client.get(f'/api/products/{pk}/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(list(board.components.all()), [self.options[0]])
+
+        # Тот же файл ещё раз: связи не переписываются
+        report = importer.import_catalog(BytesIO(feed.encode('utf-8')))
+        self.assertEqual((report['updated'], report['unchanged']), (0, 2))
+
+    def test_command_and_api(self):
+        path = os.path.join(tempfile.mkdtemp(), 'feed.csv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'wb') as file:
+            file.write(self.csv_file(3).getvalue())
+        out = StringIO()
+        call_command('import_catalog', path, stdout=out, stderr=StringIO())
+        self.assertIn('Создано: 3, обновлено: 1', out.getvalue())
+
+        client = APIClient()
+        self.assertEqual(client.post('/api/products/import/', {}).status_code, 401)
+        client.force_authenticate(User.objects.create_user('manager', is_staff=True))
+        body = json.dumps({'sku': 'MB-0', 'stock': 42}).encode('utf-8')
+        response = client.generic('POST', '/api/products/import/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual(Product.objects.get(sku='MB-0').stock, 42)
+        upload = SimpleUploadedFile('feed.csv', self.csv_file(2).getvalue(), content_type='text/csv')
+        response = client.post('/api/products/import/', {'file': upload}, format='multipart')
+        # MB-0: остаток, CPU-1: совместимость с MB-1 вместо MB-2
+        self.assertEqual((response.status_code, response.data['updated'], response.data['unchanged']), (200, 2, 1))
+        self.assertEqual(Product.objects.get(sku='MB-0').stock, 0)
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    # default и replica — две разные SQLite-БД: по содержимому видно, откуда читали
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        routers.replica_health.clear()
+        self.addCleanup(routers.replica_health.clear)
+        Category.objects.create(name='Основная')
+        Category.objects.using('replica').create(name='Реплика')
+        # Штампы сброса кэша забываем: иначе каталог «только что менялся» и читается с default
+        catalog_cache.get_cache().clear()
+        self.client = APIClient()
+
+    def names(self):
+        response = self.client.get('/api/categories/')
+        self.assertEqual(response.status_code, 200)
+        return [category['name'] for category in response.data['results']]
+
+    def test_catalog_reads_go_to_replica(self):
+        self.assertEqual(self.names(), ['Реплика'])
+        # Запись — всегда в основную БД
+        self.client.force_authenticate(User.objects.create_user('manager', is_staff=True))
+        self.assertEqual(self.client.post('/api/categories/', {'name': 'Новая'}).status_code, 201)
+        self.assertTrue(Category.objects.using('default').filter(name='Новая').exists())
+        self.assertFalse(Category.objects.using('replica').filter(name='Новая').exists())
+
+    def test_client_sticks_to_primary_after_write(self):
+        self.client.force_authenticate(User.objects.create_user('manager', is_staff=True))
+        response = self.client.post('/api/categories/', {'name': 'Новая'})
+        self.assertEqual(response.cookies[routers.STICKY_COOKIE]['max-age'], 10)
+        catalog_cache.get_cache().clear()
+        self.assertEqual(self.names(), ['Новая', 'Основная'])
+        # Другой клиент записей не делал и читает с реплики
+        self.client.cookies.clear()
+        catalog_cache.get_cache().clear()
+        self.assertEqual(self.names(), ['Реплика'])
+
+    def test_recent_catalog_change_reads_primary(self):
+        Category.objects.create(name='Новая')
+        self.assertEqual(self.names(), ['Новая', 'Основная'])
+
+    def test_unhealthy_replica_falls_back_to_primary(self):
+        with override_settings(REPLICA_DATABASE='missing'):
+            self.assertEqual(routers.report_database(), 'default')
+        routers.replica_health['replica'] = (False, time.monotonic())
+        self.assertEqual(self.names(), ['Основная'])
+        # После REPLICA_CHECK_INTERVAL реплика проверяется заново и возвращается
+        with override_settings(REPLICA_CHECK_INTERVAL=0):
+            catalog_cache.get_cache().clear()
+            self.assertEqual(self.names(), ['Реплика'])
+
+
+class AsyncCatalogTests(TestCase):
+    def setUp(self):
+        caches['catalog'].clear()
+        self.products = create_catalog(15)
+        self.client = APIClient()
+
+    def async_request(self, method, url):
+        async def send():
+            return await getattr(self.async_client, method)(url)
+        return async_to_sync(send)()
+
+    def compare(self, url):
+        response = self.async_request('get', url.replace('/api/', '/api/async/'))
+        self.assertEqual(response['Content-Type'], 'application/json')
+        expected = self.client.get(url)
+        self.assertEqual(response.status_code, expected.status_code)
+        data = json.loads(response.content.decode('utf-8').replace('/api/async/', '/api/'))
+        self.assertEqual(data, json.loads(expected.content))
+        return data
+
+    def test_same_responses_as_sync_endpoints(self):
+        page = self.compare('/api/products/?ordering=-final_price&in_stock=1&page_size=4')
+        self.assertEqual(len(page['results']), 4)
+        self.compare(page['next'].replace('http://testserver', ''))
+        self.compare('/api/products/?fields=id,name&expand=components&count=1')
+        self.compare(f'/api/products/{self.products[3].id}/')
+        self.compare(f'/api/products/{self.products[3].id}/?fields=id,compatible_with')
+        self.compare('/api/products/999999/')
+        self.compare('/api/products/?fields=nope')
+        self.compare('/api/categories/')
+        self.compare('/api/configurator/')
+
+    def test_list_is_cached_and_read_only(self):
+        with self.assertNumQueries(1):
+            response = self.async_request('get', '/api/async/products/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.async_request('get', '/api/async/products/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(self.async_request('post', '/api/async/products/').status_code, 405)
+
+
+class CatalogBenchmarkTests(TransactionTestCase):
+    def test_command_runs_all_modes(self):
+        create_catalog(5)
+        out = StringIO()
+        call_command(
+            'benchmark_catalog', requests=20, concurrency=5, threads=2, client_delay=0, stdout=out,
+        )
+        rows = {line.split()[0]: line.split() for line in out.getvalue().splitlines()[2:]}
+        self.assertEqual(sorted(rows), ['asgi', 'asgi-sync', 'wsgi'])
+        # Последняя колонка — потоки, перед ней — число ошибок
+        self.assertEqual({row[-2] for row in rows.values()}, {'0'})
+
+
+@override_settings(PERF_INSTRUMENTATION=True, PERF_SLOW_REQUEST_MS=60000, PERF_SLOW_REQUEST_QUERIES=3)
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        caches['catalog'].clear()
+        self.products = create_catalog(3)
+        self.client = APIClient()
+
+    def server_timing(self, response):
+        timing = {}
+        for metric in response['Server-Timing'].split(', '):
+            name, *params = metric.split(';')
+            timing[name] = dict(param.split('=', 1) for param in params)
+        return timing
+
+    def test_server_timing(self):
+        with self.assertNoLogs('shop.performance'):
+            response = self.client.get('/api/products/')
+        timing = self.server_timing(response)
+        self.assertEqual(list(timing), ['db', 'serialize', 'render', 'total'])
+        self.assertEqual(timing['db']['desc'], '"1 SQL"')
+        self.assertGreater(float(timing['serialize']['dur']) + float(timing['render']['dur']), 0)
+        self.assertGreaterEqual(float(timing['total']['dur']), float(timing['db']['dur']))
+        # Асинхронный эндпоинт: SQL выполняется в потоке асинхронного ORM, но тоже учитывается
+        caches['catalog'].clear()
+        async def get():
+            return await self.async_client.get('/api/async/products/?expand=components')
+        self.assertEqual(self.server_timing(async_to_sync(get)())['db']['desc'], '"2 SQL"')
+
+    def test_slow_request_log(self):
+        for product in self.products:
+            product.compatible_with.clear()
+        with self.assertLogs('shop.performance', 'WARNING') as logs:
+            response = self.client.get(f'/api/products/{self.products[0].id}/')
+        self.assertEqual(response.status_code, 200)
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual((entry['method'], entry['status'], entry['queries']), ('GET', 200, 4))
+        self.assertEqual(len(entry['top_queries']), 4)
+        self.assertEqual({query['count'] for query in entry['top_queries']}, {1})
+        # Один и тот же запрос с разными списками IN (...) считается одним
+        metrics = instrumentation.RequestMetrics()
+        metrics.add_query('SELECT 1 WHERE id IN (%s, %s)', 0.002)
+        metrics.add_query('SELECT 1 WHERE id IN (%s)', 0.001)
+        metrics.add_query('SELECT 2', 0.005)
+        self.assertEqual(metrics.top_queries(1), [{'sql': 'SELECT 1 WHERE id IN (...)', 'count': 2, 'ms': 3.0}])
+
+    def test_disabled(self):
+        with override_settings(PERF_INSTRUMENTATION=False):
+            with self.assertRaises(MiddlewareNotUsed):
+                instrumentation.PerformanceMiddleware(lambda request: None)
+            response = APIClient().get('/api/products/')
+        self.assertNotIn('Server-Timing', response)
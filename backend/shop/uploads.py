@@ -0,0 +1,171 @@
+# shop/uploads.py
+"""
+Загрузка больших файлов (фото, 3D-модели) частями.
+
+Клиент создаёт сессию (размер, имя файла, поле товара), затем шлёт части
+PUT-запросами с Content-Range и X-Chunk-SHA256. Каждая часть читается из
+потока запроса порциями по UPLOAD_READ_SIZE и сразу пишется в файл во
+временном каталоге, поэтому память не зависит от размера части. Часть с
+неверной контрольной суммой отбрасывается. После обрыва клиент узнаёт
+received из статуса сессии и продолжает с этого байта. В конце файл
+прикрепляется к Product.image или Product.model_3d.
+"""
+from datetime import timedelta
+import hashlib
+import os
+import re
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+from .models import Product, UploadSession
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class UploadError(Exception):
+    """Ошибка загрузки части; status — HTTP-код ответа."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def temp_path(session):
+    return os.path.join(settings.UPLOAD_TEMP_DIR, f'{session.pk}.part')
+
+
+def start_session(**fields):
+    if fields['size'] > settings.UPLOAD_MAX_SIZE:
+        raise UploadError(f'Файл больше {settings.UPLOAD_MAX_SIZE} байт.', status=413)
+    session = UploadSession.objects.create(**fields)
+    os.makedirs(settings.UPLOAD_TEMP_DIR, exist_ok=True)
+    open(temp_path(session), 'wb').close()
+    return session
+
+
+def parse_content_range(header, session):
+    match = CONTENT_RANGE_RE.match(header or '')
+    if not match:
+        raise UploadError('Нужен заголовок Content-Range: bytes начало-конец/размер.')
+    start, end, total = map(int, match.groups())
+    if total != session.size or start > end or end >= total:
+        raise UploadError('Content-Range не совпадает с размером файла.', status=416)
+    if end - start + 1 > settings.UPLOAD_CHUNK_MAX_SIZE:
+        raise UploadError(f'Часть больше {settings.UPLOAD_CHUNK_MAX_SIZE} байт.', status=413)
+    return start, end
+
+
+def claim(session, start):
+    """
+    Занимает сессию для записи части с байта start. Не даёт двум запросам
+    писать одновременно; запись, зависшая дольше UPLOAD_WRITE_TIMEOUT, считается прерванной.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.UPLOAD_WRITE_TIMEOUT)
+    return UploadSession.objects.filter(
+        Q(writing_since__isnull=True) | Q(writing_since__lt=stale),
+        pk=session.pk, received=start, completed_at__isnull=True,
+    ).update(writing_since=now) == 1
+
+
+def write_chunk(session, stream, content_range, checksum):
+    """
+    Пишет часть из потока stream (объект с read(n)) на её место в файле.
+    Возвращает обновлённую сессию.
+    """
+    if session.completed_at:
+        raise UploadError('Загрузка уже завершена.', status=409)
+    start, end = parse_content_range(content_range, session)
+    if not checksum:
+        raise UploadError('Нужен заголовок X-Chunk-SHA256.')
+    if not claim(session, start):
+        session.refresh_from_db()
+        raise UploadError(f'Ожидается часть с байта {session.received}.', status=409)
+
+    length = end - start + 1
+    digest = hashlib.sha256()
+    written = 0
+    try:
+        with open(temp_path(session), 'r+b') as file:
+            file.seek(start)
+            while written < length:
+                data = stream.read(min(settings.UPLOAD_READ_SIZE, length - written))
+                if not data:
+                    break
+                digest.update(data)
+                file.write(data)
+                written += len(data)
+            if written != length or digest.hexdigest() != checksum.lower():
+                # Отбрасываем испорченную часть: файл снова заканчивается на start
+                file.truncate(start)
+                raise UploadError('Часть повреждена: не совпадает размер или контрольная сумма.')
+    except Exception:
+        UploadSession.objects.filter(pk=session.pk).update(writing_since=None)
+        raise
+    UploadSession.objects.filter(pk=session.pk).update(received=end + 1, writing_since=None)
+    session.received, session.writing_since = end + 1, None
+    return session
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(settings.UPLOAD_READ_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def finalize(session):
+    """
+    Проверяет собранный файл и прикрепляет его к товару. Сессия заблокирована
+    до конца: параллельный finalize дождётся и получит 409, а не прикрепит
+    файл второй раз. Если не совпала контрольная сумма всего файла, загрузка
+    начинается заново с нулевого байта.
+    """
+    with transaction.atomic():
+        locked = UploadSession.objects.select_for_update().get(pk=session.pk)
+        session.received, session.completed_at = locked.received, locked.completed_at
+        if session.completed_at:
+            raise UploadError('Загрузка уже завершена.', status=409)
+        if session.received != session.size:
+            raise UploadError(f'Получено {session.received} из {session.size} байт.', status=409)
+        path = temp_path(session)
+        corrupted = bool(session.sha256) and file_sha256(path) != session.sha256.lower()
+        if corrupted:
+            open(path, 'wb').close()
+            session.received = 0
+            session.save(update_fields=['received'])
+        else:
+            if session.field == 'image':
+                try:
+                    with Image.open(path) as image:
+                        image.verify()
+                except (OSError, UnidentifiedImageError):
+                    raise UploadError('Файл не является изображением.')
+
+            # Товар читаем заново и сохраняем только поле файла: остаток, цена и
+            # категория могли измениться с начала запроса (резервирование заказов)
+            product = Product.objects.get(pk=session.product_id)
+            with open(path, 'rb') as file:
+                # Product.save копирует файл в хранилище порциями и создаёт
+                # уменьшенные копии фото или сжатые копии модели
+                setattr(product, session.field, File(file, name=os.path.basename(session.filename)))
+                product.save(update_fields=[session.field, 'updated_at'])
+            session.completed_at = timezone.now()
+            session.save(update_fields=['completed_at'])
+    if corrupted:
+        raise UploadError('Контрольная сумма файла не совпадает, загрузите файл заново.')
+    os.remove(path)
+    return product
+
+
+def discard(session):
+    if os.path.exists(temp_path(session)):
+        os.remove(temp_path(session))
+    session.delete()
@@ -1,15 +1,319 @@
-from rest_framework import viewsets
-from .models import Category, Product, Order
-from .serializers import CategorySerializer, ProductSerializer, OrderSerializer
+from datetime import datetime, time, timedelta
+from io import BytesIO
 
-class CategoryViewSet(viewsets.ModelViewSet):
+from django.db.models import Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.permissions import AllowAny, IsAdminUser
+from rest_framework.response import Response
+from .models import Category, Product, Order, ProductSalesDaily, SalesDaily, SalesHourly, UploadSession
+from .serializers import CategorySerializer, ProductSerializer, ProductListSerializer, OrderSerializer, QuoteSerializer, UploadSessionSerializer, requested_fields
+from .filters import ProductFilter, ProductOrderingFilter, split_param
+from .caching import CachedResponseMixin, ConditionalGetMixin
+from .pagination import KeysetPagination
+from .routers import ReplicaReadMixin
+from . import compatibility, configurator, importer, inventory, search, uploads
+
+class CategoryViewSet(ReplicaReadMixin, ConditionalGetMixin, CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    cache_namespaces = ('categories',)
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(ReplicaReadMixin, ConditionalGetMixin, CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    cache_namespaces = ('products',)
+    cached_actions = ('list', 'retrieve', 'search')
+    # ?category=, ?brand=, ?component_type=, ?min_price=, ?max_price=, ?in_stock=, ?search=, ?ordering=
+    filter_backends = [ProductFilter, ProductOrderingFilter]
+    pagination_class = KeysetPagination
+
+    read_actions = ('list', 'retrieve', 'search')
+
+    def get_serializer_class(self):
+        if self.action in ('list', 'search'):
+            return ProductListSerializer
+        return ProductSerializer
+
+    def get_requested_fields(self):
+        """Поля ответа по ?fields=/?expand= (serializers.requested_fields)."""
+        if self.action not in self.read_actions:
+            return None
+        if not hasattr(self, '_requested_fields'):
+            self._requested_fields = requested_fields(self.request.query_params, self.get_serializer_class())
+        return self._requested_fields
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_requested_fields()
+        if fields is not None:
+            kwargs['fields'] = fields
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        # Подгружаем только связи и колонки, нужные запрошенным полям, без N+1 в сериализаторе
+        return super().get_queryset().for_catalog(self.get_requested_fields())
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        return self.cached_response(request, self._search)
+
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[IsAdminUser])
+    def import_catalog(self, request):
+        """
+        Массовый импорт: файл в поле file (multipart) или тело запроса
+        (text/csv, application/x-ndjson). ?format=csv|jsonl, ?batch_size=.
+        """
+        params = request.query_params
+        if request.content_type.startswith('multipart/'):
+            upload = request.FILES.get('file')
+            if upload is None:
+                raise ValidationError({'file': 'Файл не передан.'})
+            file, name = upload.file, upload.name
+        else:
+            # Тело читаем потоком, не загружая целиком в память
+            file, name = request.stream or BytesIO(), ''
+        format = params.get('format') or (
+            'jsonl' if name.endswith(('.jsonl', '.ndjson')) or 'ndjson' in request.content_type else 'csv'
+        )
+        if format not in ('csv', 'jsonl'):
+            raise ValidationError({'format': 'Поддерживаются csv и jsonl.'})
+        try:
+            batch_size = max(int(params.get('batch_size', importer.BATCH_SIZE)), 1)
+        except ValueError:
+            raise ValidationError({'batch_size': 'Ожидается целое число.'})
+        report = importer.import_catalog(file, format, params.get('delimiter', ','), batch_size)
+        return Response(report, status=status.HTTP_200_OK)
+
+    def _search(self, request):
+        # /api/products/search/?q=... — результаты по релевантности, остальные фильтры тоже работают
+        queryset = ProductFilter().filter_queryset(request, self.get_queryset(), self)
+        queryset = search.search_products(queryset, request.query_params.get('q', ''))
+        # Результатов не больше search.MAX_RANKED_RESULTS, поэтому хватает обычных страниц
+        paginator = PageNumberPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
 class OrderViewSet(viewsets.ModelViewSet):
-    queryset = Order.objects.all()
-    serializer_class = OrderSerializer
\ No newline at end of file
+    queryset = Order.objects.prefetch_related('order_items__options')
+    serializer_class = OrderSerializer
+    pagination_class = KeysetPagination  # (created_at, id) по убыванию
+
+class ConfiguratorViewSet(viewsets.ViewSet):
+    # Проверка сборки ничего не меняет, поэтому POST доступен и без авторизации
+    permission_classes = [AllowAny]
+
+    def parse_build(self, data):
+        build = {}
+        for slot in compatibility.BUILD_SLOTS:
+            value = data.get(slot)
+            if value in (None, ''):
+                continue
+            try:
+                build[slot] = int(value)
+            except (TypeError, ValueError):
+                raise ValidationError({slot: 'Ожидается id товара.'})
+        return build
+
+    def list(self, request):
+        # Всё, из чего можно собрать ПК, одним ответом: конструктору не нужно листать каталог
+        return Response({
+            'fields': configurator.PART_FIELDS,
+            'parts': configurator.get_parts(),
+        })
+
+    @action(detail=False, methods=['get', 'post'])
+    def compatibility(self, request):
+        """
+        Сборка передаётся как {слот: id товара} (в теле POST или ?cpu=1&gpu=2).
+        Ответ: ошибки совместимости и id подходящих товаров для пустых слотов.
+        Всё считается по графу в памяти, без запросов к БД.
+        """
+        build = self.parse_build(request.data if request.method == 'POST' else request.query_params)
+        graph = compatibility.get_graph()
+        errors = graph.validate(build)
+        return Response({
+            'build': build,
+            'valid': not errors,
+            'complete': len(build) == len(compatibility.BUILD_SLOTS),
+            'errors': errors,
+            'candidates': graph.candidates(build),
+        })
+
+    @action(detail=False, methods=['post'])
+    def quote(self, request):
+        """
+        Стоимость сборки по данным сервера: {"order_items": [{"product": 1,
+        "quantity": 1, "options": [2, 3]}, ...]}. Считается так же, как при
+        создании заказа.
+        """
+        serializer = QuoteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(QuoteSerializer(serializer.quote()).data)
+
+class UploadViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """
+    Загрузка больших файлов товара частями:
+    POST /api/uploads/ -> PUT /api/uploads/<id>/chunk/ (сколько нужно раз) ->
+    POST /api/uploads/<id>/finalize/. GET /api/uploads/<id>/ — сколько байт
+    уже получено, с этого места продолжают после обрыва.
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [IsAdminUser]
+
+    def get_queryset(self):
+        queryset = UploadSession.objects.select_related('product')
+        if not self.request.user.is_superuser:
+            queryset = queryset.filter(created_by=self.request.user)
+        return queryset
+
+    def upload_error(self, error, session=None):
+        data = {'detail': error.message}
+        if session is not None:
+            data['received'] = session.received
+        return Response(data, status=error.status)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            session = uploads.start_session(created_by=request.user, **serializer.validated_data)
+        except uploads.UploadError as error:
+            return self.upload_error(error)
+        return Response(self.get_serializer(session).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['put'])
+    def chunk(self, request, pk=None):
+        # Тело читаем из потока сами (request.data не трогаем), порциями прямо в файл
+        session = self.get_object()
+        try:
+            uploads.write_chunk(
+                session, request.stream or BytesIO(),
+                request.headers.get('Content-Range'), request.headers.get('X-Chunk-SHA256'),
+            )
+        except uploads.UploadError as error:
+            return self.upload_error(error, session)
+        return Response(self.get_serializer(session).data)
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        session = self.get_object()
+        try:
+            product = uploads.finalize(session)
+        except uploads.UploadError as error:
+            return self.upload_error(error, session)
+        data = self.get_serializer(session).data
+        data['url'] = request.build_absolute_uri(getattr(product, session.field).url)
+        return Response(data)
+
+    def perform_destroy(self, instance):
+        uploads.discard(instance)
+
+class AnalyticsViewSet(ReplicaReadMixin, viewsets.ViewSet):
+    """
+    Отчёты по продажам из сводных таблиц (shop.analytics): время ответа
+    зависит от длины периода, а не от числа заказов.
+    Параметры: from, to (ГГГГ-ММ-ДД, по умолчанию последние 30 дней), status, delivery.
+    """
+    permission_classes = [IsAdminUser]
+    DEFAULT_DAYS = 30
+    MAX_DAYS = {'day': 731, 'hour': 62}
+
+    def parse_period(self, request, granularity='day'):
+        today = timezone.localdate()
+        try:
+            end = parse_date(request.query_params.get('to') or '') or today
+            start = parse_date(request.query_params.get('from') or '') or end - timedelta(days=self.DEFAULT_DAYS - 1)
+        except ValueError:
+            raise ValidationError({'from': 'Дата в формате ГГГГ-ММ-ДД.'})
+        if start > end:
+            raise ValidationError({'from': 'Начало периода позже конца.'})
+        if (end - start).days >= self.MAX_DAYS[granularity]:
+            raise ValidationError({'from': f'Период не длиннее {self.MAX_DAYS[granularity]} дней.'})
+        return start, end
+
+    def money(self, value):
+        # SUM по DecimalField на SQLite теряет знаки после запятой
+        return f'{value:.2f}'
+
+    def filter_dimensions(self, request, queryset, fields):
+        for field in fields:
+            values = split_param(request.query_params.getlist(field))
+            if values:
+                queryset = queryset.filter(**{f'{field}__in': values})
+        return queryset
+
+    @action(detail=False)
+    def sales(self, request):
+        """Заказы и выручка по дням (granularity=day) или часам (granularity=hour)."""
+        granularity = request.query_params.get('granularity', 'day')
+        if granularity not in self.MAX_DAYS:
+            raise ValidationError({'granularity': 'Ожидается day или hour.'})
+        start, end = self.parse_period(request, granularity)
+        if granularity == 'hour':
+            rows = SalesHourly.objects.filter(
+                hour__gte=timezone.make_aware(datetime.combine(start, time.min)),
+                hour__lt=timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)),
+            )
+        else:
+            rows = SalesDaily.objects.filter(date__range=(start, end))
+        rows = self.filter_dimensions(request, rows, ('status', 'delivery')).filter(orders__gt=0)
+
+        totals = rows.values('status').annotate(orders_sum=Sum('orders'), revenue_sum=Sum('revenue')).order_by('status')
+        period = 'hour' if granularity == 'hour' else 'date'
+        return Response({
+            'granularity': granularity,
+            'from': start,
+            'to': end,
+            'totals': {
+                row['status']: {'orders': row['orders_sum'], 'revenue': self.money(row['revenue_sum'])} for row in totals
+            },
+            'results': [
+                {
+                    'period': timezone.localtime(row[period]) if granularity == 'hour' else row[period],
+                    'status': row['status'],
+                    'delivery': row['delivery'],
+                    'orders': row['orders'],
+                    'revenue': self.money(row['revenue']),
+                }
+                for row in rows.values(period, 'status', 'delivery', 'orders', 'revenue')
+            ],
+        })
+
+    @action(detail=False)
+    def products(self, request):
+        """Самые продаваемые товары за период; отменённые заказы не считаются, если не указан status."""
+        start, end = self.parse_period(request)
+        try:
+            limit = min(int(request.query_params.get('limit', 20)), 100)
+        except ValueError:
+            raise ValidationError({'limit': 'Ожидается число.'})
+        if limit < 1:
+            raise ValidationError({'limit': 'Ожидается число не меньше 1.'})
+        rows = ProductSalesDaily.objects.filter(date__range=(start, end))
+        if request.query_params.get('status'):
+            rows = self.filter_dimensions(request, rows, ('status',))
+        else:
+            rows = rows.exclude(status=inventory.CANCELLED)
+        top = list(
+            rows.values('product_id').annotate(units_sum=Sum('units'), revenue_sum=Sum('revenue'))
+            .filter(units_sum__gt=0).order_by('-units_sum', 'product_id')[:limit]
+        )
+        names = dict(Product.objects.filter(pk__in=[row['product_id'] for row in top]).values_list('pk', 'name'))
+        return Response({
+            'from': start,
+            'to': end,
+            'results': [
+                {
+                    'product': row['product_id'],
+                    'name': names.get(row['product_id']),
+                    'units': row['units_sum'],
+                    'revenue': self.money(row['revenue_sum']),
+                }
+                for row in top
+            ],
+        })